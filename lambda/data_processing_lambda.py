@@ -1,5 +1,9 @@
 """Lambda function to run filtering process"""
+import csv
+import io
+import itertools
 import json
+import os
 import urllib.parse
 import boto3
 #from io import StringIO
@@ -8,19 +12,151 @@ print('Loading function')
 
 s3 = boto3.client('s3')
 
-def lambda_handler(event):
-    """A Lambda handler to apply filtering into the raw data. 
+# S3 multipart parts must be at least 5 MB, except the last one
+MIN_PART_SIZE = 5 * 1024 ** 2
+
+
+def filter_config():
+    """Row filter settings from the function's environment variables.
+
+    DROP_CANCELLED=true drops rows whose Cancelled column is True, COLUMNS is a
+    comma-separated list of columns to keep and PART_SIZE_MB sets the size of
+    the multipart upload parts, and so the memory the function holds.
+
+    Returns:
+        dict: drop_cancelled, columns (None to keep all) and part_size in bytes.
+    """
+    columns = os.environ.get('COLUMNS', '').strip()
+    return {
+        'drop_cancelled': os.environ.get('DROP_CANCELLED', 'false').lower() == 'true',
+        'columns': [column.strip() for column in columns.split(',')] if columns else None,
+        'part_size': max(MIN_PART_SIZE,
+                         int(float(os.environ.get('PART_SIZE_MB', '8')) * 1024 ** 2)),
+    }
+
+
+def filter_rows(rows, drop_cancelled=False, columns=None):
+    """Drop cancelled flights and project columns of parsed CSV rows, header first.
+
+    Args:
+        rows: Iterator of CSV rows as lists of strings; the first one is the header.
+        drop_cancelled (bool): Drop rows whose Cancelled value is True.
+        columns (list): Columns to keep, in this order; None keeps all.
+
+    Yields:
+        list: The header, then every kept row.
+
+    Raises:
+        KeyError: When Cancelled or a requested column is not in the header.
+    """
+    header = next(rows, None)
+    if header is None:
+        return
+    positions = {name: i for i, name in enumerate(header)}
+    keep = None if columns is None else [positions[column] for column in columns]
+    cancelled = positions['Cancelled'] if drop_cancelled else None
+    yield header if keep is None else columns
+    for row in rows:
+        if cancelled is not None and row[cancelled].strip().lower() in ('true', '1'):
+            continue
+        yield row if keep is None else [row[i] for i in keep]
+
+
+def copy_object(s3_client, bucket, key, destination_bucket, destination_key):
+    """Copy an object inside S3 without passing its bytes through the function.
+
+    The managed copy switches to a multipart server-side copy for large objects.
+    """
+    s3_client.copy({'Bucket': bucket, 'Key': key}, destination_bucket, destination_key)
+
+
+def stream_filtered(s3_client, bucket, key, destination_bucket, destination_key, config):
+    """Stream an object through filter_rows into a multipart upload.
+
+    The object is parsed as it is read and written out part by part, so the
+    function holds about one part in memory whatever the size of the file.
+    Quoted fields such as airline names with commas are kept intact.
+
+    Args:
+        s3_client: boto3 S3 client.
+        bucket (str): Source bucket.
+        key (str): Source key.
+        destination_bucket (str): Destination bucket.
+        destination_key (str): Destination key.
+        config (dict): drop_cancelled, columns and part_size, as from filter_config.
+
+    Returns:
+        dict: ContentType of the source, rows written (with the header) and parts uploaded.
+
+    Raises:
+        ValueError: When Cancelled or a requested column is not in the header.
+    """
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    reader = csv.reader(io.TextIOWrapper(response['Body'], encoding='utf-8', newline=''))
+    filtered = filter_rows(reader, config['drop_cancelled'], config['columns'])
+    # The header is checked before any upload is started
+    try:
+        header = next(filtered, None)
+    except KeyError as error:
+        raise ValueError(f"Column {error.args[0]!r} is not in the header of "
+                         f"s3://{bucket}/{key}") from None
+    upload = s3_client.create_multipart_upload(
+        Bucket=destination_bucket, Key=destination_key,
+        ContentType=response.get('ContentType', 'text/csv'))
+    parts = []
+
+    def upload_part(data):
+        number = len(parts) + 1
+        part = s3_client.upload_part(Bucket=destination_bucket, Key=destination_key,
+                                     UploadId=upload['UploadId'], PartNumber=number, Body=data)
+        parts.append({'ETag': part['ETag'], 'PartNumber': number})
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    rows = 0
+    try:
+        for row in itertools.chain([] if header is None else [header], filtered):
+            writer.writerow(row)
+            rows += 1
+            if buffer.tell() >= config['part_size']:
+                upload_part(buffer.getvalue().encode('utf-8'))
+                buffer.seek(0)
+                buffer.truncate()
+        # The last part may be smaller than MIN_PART_SIZE, or the only part
+        upload_part(buffer.getvalue().encode('utf-8'))
+        s3_client.complete_multipart_upload(Bucket=destination_bucket, Key=destination_key,
+                                            UploadId=upload['UploadId'],
+                                            MultipartUpload={'Parts': parts})
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=destination_bucket, Key=destination_key,
+                                         UploadId=upload['UploadId'])
+        raise
+    return {'ContentType': response.get('ContentType'), 'rows': rows, 'parts': len(parts)}
+
+
+def lambda_handler(event, context=None, s3_client=None):
+    """A Lambda handler to apply filtering into the raw data.
        This python script will be used in Lambda AWS platform, not for Docker.
 
+       Without a filter configured (see filter_config) the file is copied
+       server-side; otherwise it is streamed through the filter into a
+       multipart upload, so memory use does not grow with the file.
+
     Args:
-        return the response content type 
-        and re-direct the processed file into the destination bucket
+        event: S3 event naming the source bucket, destination bucket and key.
+        context: Lambda context; unused.
+        s3_client: S3 client to use instead of the module's, e.g. a stub in tests.
+
+    Returns:
+        The content type of the file re-directed into the destination bucket.
 
     Raises:
         e: KeyError
         No return value. It will raise an exception alert if the key value does not match or not found.
     """
     print("Received event: " + json.dumps(event, indent=2))
+    s3_client = s3_client or s3
+    config = filter_config()
 
     # Get the object from the event and show its content type
     bucket = event['Records'][0]['s3']['bucket']['name']
@@ -28,12 +164,17 @@ def lambda_handler(event):
     key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
     destination_key = key
     try:
-        response = s3.get_object(Bucket=bucket, Key=key)
-        print("CONTENT TYPE: " + response['ContentType'])
+        if config['drop_cancelled'] or config['columns']:
+            result = stream_filtered(s3_client, bucket, key, destination_bucket,
+                                     destination_key, config)
+            print(f"File {key} filtered into {destination_key}: "
+                  f"{result['rows']} rows in {result['parts']} parts")
+            return result['ContentType']
 
-        s3.put_object(Bucket=destination_bucket, Key=key, Body=response['Body'].read())
+        copy_object(s3_client, bucket, key, destination_bucket, destination_key)
         print(f"File {key} copied to {destination_key} ")
-        return response['ContentType']
+        return s3_client.head_object(Bucket=destination_bucket,
+                                     Key=destination_key)['ContentType']
 
     except KeyError as e:
         print(e)
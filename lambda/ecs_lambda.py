@@ -1,34 +1,362 @@
 """Lambda function to run trigger ECR/ECS Pipeline"""
+import copy
+import fcntl
+import hashlib
 import json
+import os
+import threading
+import time
+import urllib.parse
 import boto3
 
 print('Loading function')
 
-s3 = boto3.client('ecs')
+ecs = boto3.client('ecs')
 
-def lambda_handler():
-    """A Lambda handler to trigger ECR/ECS Pipeline
-       This python script will be used in Lambda AWS platform, not for Docker.
-       Note that this handler does not have Args or Return Value.
-    
-    """
-    client = boto3.client('ecs')
-    response = client.run_task(
-        cluster='cloud-project-pipeline',
-        launchType='FARGATE',
-        taskDefinition='cloud-project-pipeline-v2',
-        networkConfiguration={
-            'awsvpcConfiguration': {
-                'subnets': [
-                    'subnet-0169d9e6343f8a1dd',  # Replace with your subnet ID
-                    'subnet-07e50de48236c1c32',
-                    'subnet-09820407b79b4673f'
-                ],
-                'assignPublicIp': 'ENABLED'  # 'DISABLED' if you don't need a public IP
+SUBNETS = 'subnet-0169d9e6343f8a1dd,subnet-07e50de48236c1c32,subnet-09820407b79b4673f'
+
+# A claimed launch whose task ARN was never recorded is given up after this long
+CLAIM_TIMEOUT = 60
+# Launched runs are forgotten after a day, so the state stays small
+RUN_TTL = 24 * 3600
+
+
+def trigger_config():
+    """Trigger settings from the function's environment variables.
+
+    WINDOW_SECONDS is the quiet period after the last event before a batch is
+    launched and MAX_WAIT_SECONDS caps how long a batch can keep growing.
+    CLUSTER, TASK_DEFINITION, CONTAINER_NAME, SUBNETS (comma-separated) and
+    ASSIGN_PUBLIC_IP describe the ECS task.
+
+    Returns:
+        dict: window, max_wait and the ECS task settings.
+    """
+    return {
+        'window': float(os.environ.get('WINDOW_SECONDS', '60')),
+        'max_wait': float(os.environ.get('MAX_WAIT_SECONDS', '300')),
+        'cluster': os.environ.get('CLUSTER', 'cloud-project-pipeline'),
+        'task_definition': os.environ.get('TASK_DEFINITION', 'cloud-project-pipeline-v2'),
+        'container_name': os.environ.get('CONTAINER_NAME', 'cloud-project-pipeline'),
+        'subnets': [subnet.strip() for subnet in os.environ.get('SUBNETS', SUBNETS).split(',')],
+        'assign_public_ip': os.environ.get('ASSIGN_PUBLIC_IP', 'ENABLED'),
+    }
+
+
+def empty_state():
+    """Coordination state with no pending batch and no runs."""
+    return {'batch': None, 'runs': {}}
+
+
+class MemoryState:
+    """Coordination state held in this process, for tests and single containers.
+
+    Every backend offers transact(update): update receives the state as a dict,
+    may change it, and its return value is passed back; no other transact on
+    the same state runs in between.
+    """
+
+    def __init__(self):
+        self.state = empty_state()
+        self.lock = threading.Lock()
+
+    def transact(self, update):
+        with self.lock:
+            return update(self.state)
+
+
+class FileState:
+    """Coordination state in a local JSON file, locked while it is updated.
+
+    Invocations share it only when they share a file system, e.g. a warm
+    container's /tmp or a mounted EFS volume.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def transact(self, update):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                text = f.read()
+                state = json.loads(text) if text else empty_state()
+                result = update(state)
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class S3State:
+    """Coordination state in an S3 object, shared by every invocation.
+
+    Updates are conditional writes on the object's ETag and are retried when
+    another invocation wrote in between.
+    """
+
+    def __init__(self, bucket, key, s3_client=None, retries=10):
+        self.bucket = bucket
+        self.key = key
+        self.s3_client = s3_client or boto3.client('s3')
+        self.retries = retries
+
+    def transact(self, update):
+        for _ in range(self.retries):
+            try:
+                obj = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+                state, condition = json.loads(obj['Body'].read()), {'IfMatch': obj['ETag']}
+            except self.s3_client.exceptions.NoSuchKey:
+                state, condition = empty_state(), {'IfNoneMatch': '*'}
+            result = update(state)
+            try:
+                self.s3_client.put_object(Bucket=self.bucket, Key=self.key,
+                                          Body=json.dumps(state).encode('utf-8'), **condition)
+                return result
+            except self.s3_client.exceptions.ClientError as e:
+                if e.response['Error']['Code'] not in ('PreconditionFailed',
+                                                       'ConditionalRequestConflict'):
+                    raise
+        raise RuntimeError(f'Could not update s3://{self.bucket}/{self.key}: too many conflicts')
+
+
+def state_from_env():
+    """The state backend named by STATE_BACKEND: s3 (the default), file or memory.
+
+    s3 keeps the state in STATE_BUCKET under STATE_KEY and is the only backend
+    every invocation shares. file (STATE_PATH) and memory are private to one
+    Lambda container, so they never coalesce concurrent invocations and have
+    to be chosen explicitly, e.g. for local runs.
+
+    Raises:
+        ValueError: When the s3 backend has no STATE_BUCKET, or the backend is unknown.
+    """
+    backend = os.environ.get('STATE_BACKEND', 's3')
+    if backend == 's3':
+        if not os.environ.get('STATE_BUCKET'):
+            raise ValueError('STATE_BUCKET must name the bucket holding the trigger state; '
+                             'set STATE_BACKEND=file or memory only for local runs')
+        return S3State(os.environ['STATE_BUCKET'],
+                       os.environ.get('STATE_KEY', 'ecs-trigger/state.json'))
+    if backend == 'file':
+        return FileState(os.environ.get('STATE_PATH', '/tmp/ecs-trigger-state.json'))
+    if backend == 'memory':
+        return MemoryState()
+    raise ValueError(f'Unknown STATE_BACKEND {backend}; expected s3, file or memory')
+
+
+def fingerprint(keys):
+    """Identity of a pipeline run's inputs: the digest of its sorted keys."""
+    return hashlib.sha256('\n'.join(sorted(keys)).encode('utf-8')).hexdigest()[:16]
+
+
+def event_keys(event):
+    """Object keys of the S3 records in an event, also when wrapped in SQS messages.
+
+    Returns:
+        list: Decoded keys in event order, without duplicates.
+    """
+    keys = []
+    for record in (event or {}).get('Records', []):
+        if 'body' in record:
+            keys.extend(event_keys(json.loads(record['body'])))
+        elif 's3' in record:
+            keys.append(urllib.parse.unquote_plus(record['s3']['object']['key'],
+                                                   encoding='utf-8'))
+    return list(dict.fromkeys(keys))
+
+
+class TriggerCoordinator:
+    """Coalesce object events into batches and launch one pipeline run per batch.
+
+    The first event of a batch opens it and its invocation waits until no
+    event has arrived for window seconds, or the batch is max_wait seconds
+    old, before launching. Events arriving meanwhile only add their keys. A
+    batch whose inputs match a run still in flight is not launched again.
+
+    Args:
+        state: Coordination state backend, e.g. MemoryState, FileState or S3State.
+        ecs_client: boto3 ECS client.
+        config (dict): Settings as from trigger_config.
+        clock: Function returning the time in seconds.
+        sleep: Function waiting the given seconds.
+    """
+
+    def __init__(self, state, ecs_client, config, clock=time.time, sleep=time.sleep):
+        self.state = state
+        self.ecs_client = ecs_client
+        self.config = config
+        self.clock = clock
+        self.sleep = sleep
+
+    def due_at(self, batch):
+        """Time at which a batch is launched."""
+        return min(batch['last_event_at'] + self.config['window'],
+                   batch['opened_at'] + self.config['max_wait'])
+
+    def add(self, keys):
+        """Add keys to the pending batch.
+
+        Returns:
+            bool: Whether this call opened the batch and so has to flush it.
+                A batch left long past its due time, e.g. by an invocation that
+                timed out, is taken over too.
+        """
+        now = self.clock()
+
+        def update(state):
+            batch = state['batch']
+            if batch is None:
+                state['batch'] = {'keys': sorted(set(keys)), 'opened_at': now,
+                                  'last_event_at': now}
+                return True
+            stale = now > self.due_at(batch) + self.config['window']
+            batch['keys'] = sorted(set(batch['keys']) | set(keys))
+            batch['last_event_at'] = now
+            return stale
+        return self.state.transact(update)
+
+    def take(self):
+        """Remove the pending batch if it is due and return its keys, else None."""
+        now = self.clock()
+
+        def update(state):
+            batch = state['batch']
+            if batch is None or self.due_at(batch) > now:
+                return None
+            state['batch'] = None
+            return batch['keys']
+        return self.state.transact(update)
+
+    def wait_and_flush(self):
+        """Wait until the pending batch is due, then launch it.
+
+        Returns:
+            dict or None: The launch result, or None when another invocation
+            took the batch first.
+        """
+        while True:
+            batch = self.state.transact(lambda state: copy.deepcopy(state['batch']))
+            if batch is None:
+                return None
+            remaining = self.due_at(batch) - self.clock()
+            if remaining > 0:
+                self.sleep(remaining)
+                continue
+            keys = self.take()
+            if keys is not None:
+                return self.launch(keys)
+
+    def running(self, run):
+        """Whether a recorded run is still claimed, pending or running in ECS."""
+        if run.get('task_arn') is None:
+            return self.clock() - run['started_at'] < CLAIM_TIMEOUT
+        tasks = self.ecs_client.describe_tasks(cluster=self.config['cluster'],
+                                               tasks=[run['task_arn']])['tasks']
+        return any(task.get('lastStatus') != 'STOPPED' for task in tasks)
+
+    def launch(self, keys):
+        """Run the pipeline task on keys unless a run on the same keys is in flight.
+
+        The keys are passed to ml_pipeline.py as --file-keys; with no keys the
+        task runs its default command.
+
+        Returns:
+            dict: status ('launched' or 'skipped'), keys, fingerprint and task_arn.
+        """
+        described = ', '.join(keys) or 'default inputs'
+        run_id = fingerprint(keys)
+        result = {'keys': keys, 'fingerprint': run_id}
+        seen = self.state.transact(lambda state: copy.deepcopy(state['runs'].get(run_id)))
+        if seen is not None and self.running(seen):
+            print(f'Run {run_id} on {described} is still in flight; skipping')
+            return {**result, 'status': 'skipped', 'task_arn': seen.get('task_arn')}
+
+        now = self.clock()
+
+        def claim(state):
+            # Someone else launched or claimed these keys since we looked
+            if state['runs'].get(run_id) != seen:
+                return False
+            state['runs'] = {other: run for other, run in state['runs'].items()
+                             if now - run['started_at'] < RUN_TTL}
+            state['runs'][run_id] = {'task_arn': None, 'started_at': now}
+            return True
+        if not self.state.transact(claim):
+            print(f'Run {run_id} on {described} was launched by another invocation; skipping')
+            return {**result, 'status': 'skipped', 'task_arn': None}
+
+        try:
+            response = self.ecs_client.run_task(**self.task_request(keys))
+            if not response.get('tasks'):
+                raise RuntimeError(f"ECS did not start the task: {response.get('failures')}")
+        except Exception:
+            self.state.transact(lambda state: state['runs'].pop(run_id, None))
+            raise
+        task_arn = response['tasks'][0]['taskArn']
+
+        def record(state):
+            state['runs'][run_id] = {'task_arn': task_arn, 'started_at': now}
+        self.state.transact(record)
+        print(f'Launched run {run_id} on {described}: {task_arn}')
+        return {**result, 'status': 'launched', 'task_arn': task_arn}
+
+    def task_request(self, keys):
+        """Arguments of run_task for a pipeline run on keys."""
+        request = {
+            'cluster': self.config['cluster'],
+            'launchType': 'FARGATE',
+            'taskDefinition': self.config['task_definition'],
+            'networkConfiguration': {
+                'awsvpcConfiguration': {
+                    'subnets': self.config['subnets'],
+                    'assignPublicIp': self.config['assign_public_ip']
+                }
             }
         }
-    )
+        if keys:
+            request['overrides'] = {'containerOverrides': [{
+                'name': self.config['container_name'],
+                'command': ['python', 'ml_pipeline.py', '--file-keys', *keys],
+            }]}
+        return request
+
+
+def lambda_handler(event=None, context=None, coordinator=None):
+    """A Lambda handler to trigger ECR/ECS Pipeline
+       This python script will be used in Lambda AWS platform, not for Docker.
+
+       Object events are coalesced: the invocation that opens a batch waits for
+       the configured window and launches one run on every key added
+       meanwhile, the others return straight away. An invocation without
+       object keys (e.g. manual or scheduled) flushes a pending batch, or
+       runs the pipeline on its default inputs when there is none. The
+       function timeout has to exceed MAX_WAIT_SECONDS.
+
+    Args:
+        event: S3 event, SQS messages of S3 events, or None.
+        context: Lambda context; unused.
+        coordinator: TriggerCoordinator to use instead of one built from the
+            environment, e.g. with stub clients in tests.
+
+    Returns:
+        dict: statusCode, and a body with the status (launched, skipped,
+        coalesced or flushed) and the batched keys.
+    """
+    print("Received event: " + json.dumps(event, indent=2))
+    coordinator = coordinator or TriggerCoordinator(state_from_env(), ecs, trigger_config())
+
+    keys = event_keys(event)
+    if keys and not coordinator.add(keys):
+        result = {'status': 'coalesced', 'keys': keys}
+    elif keys or coordinator.state.transact(lambda state: state['batch'] is not None):
+        result = coordinator.wait_and_flush() or {'status': 'flushed', 'keys': keys}
+    else:
+        result = coordinator.launch([])
     return {
         'statusCode': 200,
-        'body': json.dumps(response)
+        'body': json.dumps(result, default=str)
     }
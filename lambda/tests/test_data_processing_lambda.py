@@ -0,0 +1,113 @@
+"""
+    Tests for the data processing Lambda, against an in-memory S3 stub
+    """
+import io
+
+import pytest
+import data_processing_lambda as dpl
+
+HEADER = 'Month,Cancelled,Airline,DepDelayMinutes\n'
+ROWS = ['1,False,Envoy Air,3.0\n',
+        '2,True,"Commutair Aka Champlain Enterprises, Inc.",\n',
+        '3,False,"Commutair Aka Champlain Enterprises, Inc.",12.0\n']
+
+
+class StubS3:
+    """
+    The S3 client calls the handler makes, kept in memory
+    """
+    def __init__(self, objects):
+        self.objects = dict(objects)
+        self.uploads = {}
+        self.calls = []
+
+    def get_object(self, Bucket, Key):
+        self.calls.append('get_object')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)]), 'ContentType': 'text/csv'}
+
+    def head_object(self, Bucket, Key):
+        return {'ContentType': 'text/csv', 'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def copy(self, CopySource, Bucket, Key):
+        self.calls.append('copy')
+        self.objects[(Bucket, Key)] = self.objects[(CopySource['Bucket'], CopySource['Key'])]
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        self.uploads['upload-1'] = {}
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append('upload_part')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        assert [part['PartNumber'] for part in MultipartUpload['Parts']] == sorted(parts)
+        self.objects[(Bucket, Key)] = b''.join(parts[number] for number in sorted(parts))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append('abort')
+        self.uploads.pop(UploadId)
+
+
+def event(key='raw/flights.csv'):
+    """
+    S3 event as the function receives it
+    """
+    return {'Records': [{'s3': {'bucket': {'name': 'raw', 'dest_name': 'clean'},
+                                'object': {'key': key}}}]}
+
+
+def test_copies_server_side_without_filter(monkeypatch):
+    """
+    Tests that an unfiltered file is copied without reading its body
+    """
+    monkeypatch.delenv('DROP_CANCELLED', raising=False)
+    monkeypatch.delenv('COLUMNS', raising=False)
+    body = (HEADER + ''.join(ROWS)).encode()
+    stub = StubS3({('raw', 'raw/flights.csv'): body})
+    assert dpl.lambda_handler(event(), s3_client=stub) == 'text/csv'
+    assert stub.calls == ['copy']
+    assert stub.objects[('clean', 'raw/flights.csv')] == body
+
+
+def test_streams_filtered_rows_in_parts(monkeypatch):
+    """
+    Tests that cancelled rows are dropped and columns projected across several parts
+    """
+    monkeypatch.setenv('DROP_CANCELLED', 'true')
+    monkeypatch.setenv('COLUMNS', 'Airline,DepDelayMinutes')
+    monkeypatch.setattr(dpl, 'MIN_PART_SIZE', 64)
+    monkeypatch.setenv('PART_SIZE_MB', '0')
+    body = (HEADER + ''.join(ROWS * 20)).encode()
+    stub = StubS3({('raw', 'raw/flights.csv'): body})
+
+    dpl.lambda_handler(event(), s3_client=stub)
+    lines = stub.objects[('clean', 'raw/flights.csv')].decode().splitlines()
+    assert lines[0] == 'Airline,DepDelayMinutes'
+    assert lines[1:3] == ['Envoy Air,3.0', '"Commutair Aka Champlain Enterprises, Inc.",12.0']
+    assert len(lines) == 1 + 40
+    assert stub.calls.count('upload_part') > 1
+
+
+def test_rejects_missing_column_before_upload(monkeypatch):
+    """
+    Tests that a column missing from the header is named and starts no upload
+    """
+    monkeypatch.setenv('COLUMNS', 'Airline,Nope')
+    stub = StubS3({('raw', 'raw/flights.csv'): (HEADER + ROWS[0]).encode()})
+    with pytest.raises(ValueError, match="'Nope' is not in the header of s3://raw/raw/flights.csv"):
+        dpl.lambda_handler(event(), s3_client=stub)
+    assert stub.calls == ['get_object'] and ('clean', 'raw/flights.csv') not in stub.objects
+
+
+def test_aborts_upload_on_truncated_row(monkeypatch):
+    """
+    Tests that a row failing mid-stream aborts the multipart upload
+    """
+    monkeypatch.setenv('COLUMNS', 'Airline,DepDelayMinutes')
+    stub = StubS3({('raw', 'raw/flights.csv'): (HEADER + ROWS[0] + '2,False\n').encode()})
+    with pytest.raises(IndexError):
+        dpl.lambda_handler(event(), s3_client=stub)
+    assert 'abort' in stub.calls and ('clean', 'raw/flights.csv') not in stub.objects
@@ -0,0 +1,182 @@
+"""
+    Tests for the ECS trigger Lambda, against a stub ECS client and a fake clock
+    """
+import io
+import json
+import os
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import ecs_lambda as el  # noqa: E402
+
+CONFIG = {'window': 60, 'max_wait': 300, 'cluster': 'pipeline', 'task_definition': 'pipeline-v2',
+          'container_name': 'pipeline', 'subnets': ['subnet-1'], 'assign_public_ip': 'ENABLED'}
+
+
+class StubECS:
+    """
+    The ECS client calls the coordinator makes, kept in memory
+    """
+    def __init__(self):
+        self.launched = []
+        self.status = {}
+
+    def run_task(self, **request):
+        arn = f'task-{len(self.launched) + 1}'
+        self.launched.append(request)
+        self.status[arn] = 'RUNNING'
+        return {'tasks': [{'taskArn': arn}], 'failures': []}
+
+    def describe_tasks(self, cluster, tasks):
+        return {'tasks': [{'taskArn': arn, 'lastStatus': self.status[arn]} for arn in tasks]}
+
+
+class Clock:
+    """
+    Fake time; sleeping advances it and runs whatever is scheduled for that moment
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.during_sleep = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if self.during_sleep:
+            self.during_sleep.pop(0)()
+
+
+def coordinator(state, ecs, clock):
+    return el.TriggerCoordinator(state, ecs, CONFIG, clock=clock, sleep=clock.sleep)
+
+
+def event(*keys):
+    """
+    S3 event as the function receives it
+    """
+    return {'Records': [{'s3': {'bucket': {'name': 'clean'}, 'object': {'key': key}}}
+                        for key in keys]}
+
+
+def test_coalesces_events_into_one_run():
+    """
+    Tests that events within the window launch a single run on all their keys
+    """
+    state, ecs, clock = el.MemoryState(), StubECS(), Clock()
+    replies = []
+
+    def deliver(*keys):
+        def later():
+            replies.append(el.lambda_handler(event(*keys),
+                                             coordinator=coordinator(state, ecs, clock)))
+        return later
+    clock.during_sleep = [deliver('2021/03.csv'), deliver('2021/02.csv', '2021/03.csv')]
+
+    reply = el.lambda_handler(event('2021/01.csv'), coordinator=coordinator(state, ecs, clock))
+    body = json.loads(reply['body'])
+    assert body['status'] == 'launched' and body['keys'] == ['2021/01.csv', '2021/02.csv',
+                                                            '2021/03.csv']
+    assert [json.loads(r['body'])['status'] for r in replies] == ['coalesced', 'coalesced']
+    assert len(ecs.launched) == 1
+    assert ecs.launched[0]['overrides']['containerOverrides'] == [{
+        'name': 'pipeline',
+        'command': ['python', 'ml_pipeline.py', '--file-keys', '2021/01.csv', '2021/02.csv',
+                    '2021/03.csv']}]
+    # The batch launches a window after the last event
+    assert clock.now == 1000 + 3 * 60
+    assert state.state['batch'] is None
+
+
+def test_max_wait_caps_batch():
+    """
+    Tests that a steady stream of events still launches after max_wait
+    """
+    state, ecs, clock = el.MemoryState(), StubECS(), Clock()
+    trigger = coordinator(state, ecs, clock)
+    clock.during_sleep = [lambda i=i: trigger.add([f'part-{i}.csv']) for i in range(100)]
+    assert trigger.add(['part-start.csv'])
+    result = trigger.wait_and_flush()
+    assert clock.now == 1000 + 300 and len(result['keys']) == 6
+
+
+def test_skips_run_in_flight(tmp_path):
+    """
+    Tests that the same inputs are not launched again until their task stops
+    """
+    state, ecs, clock = el.FileState(str(tmp_path / 'state.json')), StubECS(), Clock()
+    trigger = coordinator(state, ecs, clock)
+    assert trigger.launch(['a.csv', 'b.csv'])['status'] == 'launched'
+    assert trigger.launch(['b.csv', 'a.csv'])['status'] == 'skipped'
+    assert trigger.launch(['a.csv'])['status'] == 'launched'
+
+    ecs.status['task-1'] = 'STOPPED'
+    result = trigger.launch(['a.csv', 'b.csv'])
+    assert result['status'] == 'launched' and result['task_arn'] == 'task-3'
+    runs = json.loads((tmp_path / 'state.json').read_text())['runs']
+    assert sorted(run['task_arn'] for run in runs.values()) == ['task-2', 'task-3']
+
+
+def test_event_without_keys_runs_default_inputs():
+    """
+    Tests SQS-wrapped keys and that a keyless invocation runs the default command
+    """
+    wrapped = {'Records': [{'body': json.dumps(event('raw/a%2Bb.csv', 'raw/c.csv'))}]}
+    assert el.event_keys(wrapped) == ['raw/a+b.csv', 'raw/c.csv']
+
+    ecs = StubECS()
+    reply = el.lambda_handler(coordinator=coordinator(el.MemoryState(), ecs, Clock()))
+    assert json.loads(reply['body'])['status'] == 'launched'
+    assert 'overrides' not in ecs.launched[0]
+
+
+def test_s3_state_retries_conflicting_write():
+    """
+    Tests that a write losing the ETag race is retried on the state it re-reads
+    """
+    s3 = boto3.client('s3')
+    state = el.S3State('state-bucket', 'trigger.json', s3_client=s3)
+    stored = {'batch': {'keys': ['a.csv'], 'opened_at': 0, 'last_event_at': 0}, 'runs': {}}
+    seen = []
+
+    def add_key(current):
+        seen.append(sorted(current['batch']['keys']))
+        current['batch']['keys'].append('c.csv')
+        return len(current['batch']['keys'])
+
+    with Stubber(s3) as stubber:
+        stubber.add_response('get_object', {'Body': io.BytesIO(json.dumps(stored).encode()),
+                                            'ETag': '"1"'},
+                             {'Bucket': 'state-bucket', 'Key': 'trigger.json'})
+        stubber.add_client_error('put_object', service_error_code='PreconditionFailed',
+                                 http_status_code=412)
+        stored['batch']['keys'].append('b.csv')
+        stubber.add_response('get_object', {'Body': io.BytesIO(json.dumps(stored).encode()),
+                                            'ETag': '"2"'})
+        stubber.add_response('put_object', {'ETag': '"3"'},
+                             {'Bucket': 'state-bucket', 'Key': 'trigger.json', 'IfMatch': '"2"',
+                              'Body': json.dumps({**stored, 'batch': {
+                                  **stored['batch'],
+                                  'keys': ['a.csv', 'b.csv', 'c.csv']}}).encode('utf-8')})
+        assert state.transact(add_key) == 3
+        stubber.assert_no_pending_responses()
+    assert seen == [['a.csv'], ['a.csv', 'b.csv']]
+
+
+def test_state_backend_defaults_to_s3(monkeypatch):
+    """
+    Tests that a missing STATE_BUCKET fails loudly unless a local backend is chosen
+    """
+    monkeypatch.delenv('STATE_BUCKET', raising=False)
+    monkeypatch.delenv('STATE_BACKEND', raising=False)
+    with pytest.raises(ValueError, match='STATE_BUCKET'):
+        el.state_from_env()
+    monkeypatch.setenv('STATE_BUCKET', 'state-bucket')
+    assert isinstance(el.state_from_env(), el.S3State)
+    monkeypatch.setenv('STATE_BACKEND', 'memory')
+    assert isinstance(el.state_from_env(), el.MemoryState)
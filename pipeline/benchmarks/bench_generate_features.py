@@ -0,0 +1,77 @@
+"""
+Benchmark generate_features against the original loop/concat implementation
+
+Run from the pipeline directory:
+    python -m benchmarks.bench_generate_features --sizes 1000000 10000000 50000000
+"""
+import argparse
+import time
+
+import pandas as pd
+
+import src.generate_features as gf
+import src.schema as schema
+import src.synthetic_data as sd
+
+# The parser dtypes before the compact schema: 64-bit numbers and object strings
+LEGACY_DTYPES = {column: "int64" if dtype == "int8" else "float64" if dtype == "float32"
+                 else object for column, dtype in schema.RAW_DTYPES.items()}
+
+
+def legacy_frame(data: pd.DataFrame) -> pd.DataFrame:
+    '''
+    The flights as the legacy parser returned them, with "True"/"False" Cancelled strings
+    '''
+    data = data.astype(LEGACY_DTYPES)
+    data["Cancelled"] = data["Cancelled"].map({True: "True", False: "False"})
+    return data
+
+
+def legacy_generate_features(data: pd.DataFrame) -> pd.DataFrame:
+    '''
+    The original per-row loop and per-group concat implementation, on legacy_frame input
+    '''
+    data = data[data['Cancelled'] == 'False']
+    dep_time = []
+    for i in data['DepTimeBlk']:
+        dep_time.append(int(i[0:2]))
+    data = data.assign(dep_time=dep_time)
+    for col in ['Airline']:
+        ohe = pd.get_dummies(data[col])
+        data = pd.concat([data, ohe], axis=1)
+    for col in ['dept-type', 'arr-type']:
+        ohe = pd.get_dummies(data[col], prefix=col+'_ohe')
+        data = pd.concat([data, ohe], axis=1)
+    return data
+
+
+def rows_per_second(func, data: pd.DataFrame) -> float:
+    '''
+    Time one call of func on data
+    '''
+    start = time.perf_counter()
+    func(data)
+    return len(data) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark feature generation")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1_000_000, 10_000_000, 50_000_000])
+    parser.add_argument("--skip-legacy", action="store_true",
+                        help="Only time the vectorized implementation")
+    args = parser.parse_args()
+
+    check = sd.generate_flights(10_000)
+    pd.testing.assert_frame_equal(legacy_frame(gf.generate_features(check)),
+                                  legacy_generate_features(legacy_frame(check)),
+                                  check_dtype=False)
+
+    print(f"{'rows':>12} {'legacy rows/s':>16} {'vectorized rows/s':>18} {'speedup':>8}")
+    for size in args.sizes:
+        frame = sd.generate_flights(size)
+        new = rows_per_second(gf.generate_features, frame)
+        old = float("nan") if args.skip_legacy else rows_per_second(legacy_generate_features,
+                                                                    legacy_frame(frame))
+        print(f"{size:>12,} {old:>16,.0f} {new:>18,.0f} {new / old:>7.1f}x")
+        del frame
@@ -0,0 +1,79 @@
+"""
+Benchmark the compact model format against joblib: file size, load time and predict latency
+
+Run from the pipeline directory:
+    python -m benchmarks.bench_model_format --rows 200000 --max-depth 12
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import yaml
+
+import src.compact_model as cm
+import src.train_model as tm
+
+
+def best_of(func, repeat: int = 5) -> float:
+    '''
+    Fastest of several timed calls, in seconds
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def synthetic_features(n_rows: int, features, seed: int = 0) -> pd.DataFrame:
+    '''
+    Random feature frame with a response depending on a few features
+    '''
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(rng.random((n_rows, len(features))), columns=features)
+    data["DepDelayMinutes"] = 30 * data.iloc[:, :5].sum(axis=1) + rng.exponential(10, n_rows)
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark model serialization formats")
+    parser.add_argument("--config", default="config/default-config.yaml")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--max-depth", type=int, default=12)
+    parser.add_argument("--batch", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)["train_model"]
+    config["RF"]["max_depth"] = config["GBM"]["max_depth"] = args.max_depth
+    config["RF"]["n_jobs"] = -1
+    train = synthetic_features(args.rows, config["features"])
+    batch = synthetic_features(args.batch, config["features"], seed=1)[config["features"]]
+    models = {"pcr": tm.train_model_pcr(train, config), "rf": tm.train_model_rf(train, config),
+              "gbm": tm.train_model_gbm(train, config)}
+
+    print(f"{'model':<5} {'format':<18} {'size MB':>9} {'load ms':>9} "
+          f"{'1-row ms':>9} {'batch rows/s':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, model in models.items():
+            files = {"joblib": Path(tmp) / f"{name}.joblib",
+                     "compact": Path(tmp) / f"{name}.npz",
+                     "compact+deflate": Path(tmp) / f"{name}_deflate.npz"}
+            joblib.dump(model, files["joblib"])
+            cm.save_compact_model(model, files["compact"])
+            cm.save_compact_model(model, files["compact+deflate"], compress=True)
+            loaders = {"joblib": joblib.load, "compact": cm.load_compact_model,
+                       "compact+deflate": cm.load_compact_model}
+            for fmt, location in files.items():
+                loaded = loaders[fmt](location)
+                np.testing.assert_allclose(loaded.predict(batch), model.predict(batch))
+                load = best_of(lambda: loaders[fmt](location))
+                one_row = best_of(lambda: loaded.predict(batch.iloc[:1]), repeat=50)
+                rows = args.batch / best_of(lambda: loaded.predict(batch), repeat=3)
+                print(f"{name:<5} {fmt:<18} {location.stat().st_size / 1e6:>9.2f} "
+                      f"{load * 1e3:>9.2f} {one_row * 1e3:>9.3f} {rows:>14,.0f}")
@@ -0,0 +1,206 @@
+"""
+Time every pipeline stage and the web app's encode+predict path on synthetic flights at several scales
+
+Results are written as JSON so that runs on different commits can be compared.
+Run from the pipeline directory:
+    python -m benchmarks.bench_suite --scales 10000 100000 1000000 --output results.json
+    python -m benchmarks.bench_suite --scales 100000 --compare results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import warnings
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import sklearn
+import yaml
+
+import src.evaluate_performance as ep
+import src.generate_features as gf
+import src.scheduler as sched
+import src.split as sp
+import src.score_model as sm
+import src.synthetic_data as sd
+
+WEB_APP = Path(__file__).resolve().parents[2] / "web-app"
+# Web app labels of the raw airport types
+AIRPORT_LABELS = {"closed": "Closed", "large_airport": "Large Airport",
+                  "medium_airport": "Medium Airport", "small_airport": "Small Airport"}
+# Flights encoded and scored one at a time, as the UI and HTTP paths do
+SINGLE_FLIGHTS = 200
+
+
+def timed(func: Callable, *args, repeat: int = 1) -> Tuple[object, float]:
+    '''
+    Call func repeat times and return its result with the fastest elapsed seconds
+    '''
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def record(scale: int, stage: str, rows: int, seconds: float) -> Dict:
+    '''
+    One result row
+    '''
+    return {"scale": scale, "stage": stage, "rows": rows, "seconds": seconds,
+            "rows_per_s": rows / seconds if seconds > 0 else float("inf")}
+
+
+def web_encoder():
+    '''
+    The web app's FeatureEncoder, or None when the web app is not next to the pipeline
+    '''
+    if not (WEB_APP / "src" / "encoder.py").exists():
+        return None
+    sys.path.insert(0, str(WEB_APP / "src"))
+    import encoder  # pylint: disable=import-outside-toplevel
+    with open(WEB_APP / "config" / "config.yaml", "r", encoding="utf-8") as f:
+        return encoder.FeatureEncoder(yaml.safe_load(f))
+
+
+def web_inputs(test: pd.DataFrame, feature_encoder) -> pd.DataFrame:
+    '''
+    Raw web app inputs of the test flights
+    '''
+    inputs = test[["Quarter", "Month", "DayOfWeek"]
+                  + [feature for feature, _ in feature_encoder.numerical]].copy()
+    inputs["Airline"] = test["Airline"]
+    inputs["Departure Type"] = test["dept-type"].map(AIRPORT_LABELS)
+    inputs["Arrival Type"] = test["arr-type"].map(AIRPORT_LABELS)
+    return inputs
+
+
+def run_scale(scale: int, config: Dict, feature_encoder=None, repeat: int = 3) -> List[Dict]:
+    '''
+    Benchmark every stage on scale synthetic flights
+
+    Args:
+        scale (int): Number of raw flights.
+        config (Dict): The full pipeline config.
+        feature_encoder: Optional web app FeatureEncoder.
+        repeat (int): Timed calls of every stage but training; the fastest counts.
+
+    Returns:
+        List[Dict]: One result per stage.
+    '''
+    results = []
+    raw = sd.generate_flights(scale)
+    data, seconds = timed(gf.generate_features, raw, repeat=repeat)
+    results.append(record(scale, "generate_features", len(raw), seconds))
+    matrix, seconds = timed(sp.split_data, data, config, repeat=repeat)
+    results.append(record(scale, "split", len(data), seconds))
+    train, test = matrix.train, matrix.test
+
+    models = {}
+    for name, spec in sched.MODELS.items():
+        models[name], seconds = timed(spec["trainer"], train, config["train_model"])
+        results.append(record(scale, f"train_{name}", len(train), seconds))
+        scores, seconds = timed(sm.score_model, test, models[name], config["score_model"],
+                                repeat=repeat)
+        results.append(record(scale, f"score_{name}", len(test), seconds))
+        _, seconds = timed(ep.evaluate_performance, scores, repeat=repeat)
+        results.append(record(scale, f"evaluate_{name}", len(scores), seconds))
+
+    if feature_encoder is not None:
+        inputs = web_inputs(data.loc[test.index], feature_encoder)
+        model = models["rf"]
+        flights = inputs.head(SINGLE_FLIGHTS).to_dict(orient="records")
+        with warnings.catch_warnings():
+            # The web app scores plain arrays in the training column order, like its
+            # aws_import module
+            warnings.filterwarnings("ignore", message="X does not have valid feature names")
+            _, seconds = timed(lambda: model.predict(feature_encoder.encode_frame(inputs)),
+                               repeat=repeat)
+            results.append(record(scale, "web_encode_predict_batch", len(inputs), seconds))
+            _, seconds = timed(lambda: [model.predict(feature_encoder.encode(flight))
+                                        for flight in flights], repeat=repeat)
+            results.append(record(scale, "web_encode_predict_single", len(flights), seconds))
+    return results
+
+
+def environment() -> Dict:
+    '''
+    Commit and library versions the results were measured with
+    '''
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "pandas": pd.__version__, "sklearn": sklearn.__version__,
+            "cpu_count": os.cpu_count()}
+
+
+def compare(results: List[Dict], baseline: List[Dict], threshold: float) -> List[str]:
+    '''
+    Print throughput relative to a baseline run and list the regressed stages
+
+    Args:
+        results (List[Dict]): Results of this run.
+        baseline (List[Dict]): Results of the baseline run.
+        threshold (float): Throughput ratio below which a stage counts as regressed.
+
+    Returns:
+        List[str]: "stage@scale" of every regressed stage.
+    '''
+    before = {(row["scale"], row["stage"]): row["rows_per_s"] for row in baseline}
+    regressions = []
+    print(f"{'scale':>10} {'stage':<28} {'rows/s':>14} {'baseline':>14} {'ratio':>7}")
+    for row in results:
+        old: Optional[float] = before.get((row["scale"], row["stage"]))
+        if old is None:
+            continue
+        ratio = row["rows_per_s"] / old
+        flag = " <" if ratio < threshold else ""
+        print(f"{row['scale']:>10,} {row['stage']:<28} {row['rows_per_s']:>14,.0f} "
+              f"{old:>14,.0f} {ratio:>6.2f}x{flag}")
+        if ratio < threshold:
+            regressions.append(f"{row['stage']}@{row['scale']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic data")
+    parser.add_argument("--config", default="config/default-config.yaml")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--output", default="benchmarks/results.json")
+    parser.add_argument("--compare", help="Baseline results file to compare against")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timed calls of every stage but training; the fastest counts")
+    parser.add_argument("--threshold", type=float, default=0.9,
+                        help="Throughput ratio below which a stage counts as regressed")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    feature_encoder = web_encoder()
+    results = []
+    for scale in args.scales:
+        for row in run_scale(scale, config, feature_encoder, args.repeat):
+            print(f"{scale:>10,} {row['stage']:<28} {row['seconds']:>9.3f}s "
+                  f"{row['rows_per_s']:>14,.0f} rows/s")
+            results.append(row)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressed = compare(results, json.load(f)["results"], args.threshold)
+        if regressed:
+            print(f"Regressed: {', '.join(regressed)}")
+            sys.exit(1)
@@ -0,0 +1,52 @@
+"""
+Benchmark compiled tree inference against scikit-learn predict: 1-row latency and batch throughput
+
+Run from the pipeline directory:
+    python -m benchmarks.bench_tree_inference --batch 1000000 --max-depth 8 --jobs 1 4 -1
+"""
+import argparse
+import os
+
+import numpy as np
+import yaml
+
+import src.compact_model as cm
+import src.schema as schema
+import src.train_model as tm
+from benchmarks.bench_model_format import best_of, synthetic_features
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compiled tree inference")
+    parser.add_argument("--config", default="config/default-config.yaml")
+    parser.add_argument("--rows", type=int, default=100_000, help="Training rows")
+    parser.add_argument("--batch", type=int, default=1_000_000, help="Rows of the throughput batch")
+    parser.add_argument("--max-depth", type=int, default=None,
+                        help="Tree depth; the configured depth by default")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, -1],
+                        help="Thread counts of the compiled engine; -1 uses every core")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)["train_model"]
+    if args.max_depth is not None:
+        config["RF"]["max_depth"] = config["GBM"]["max_depth"] = args.max_depth
+    config["RF"]["n_jobs"] = -1
+    train = synthetic_features(args.rows, config["features"])
+    batch = schema.model_frame(synthetic_features(args.batch, config["features"], seed=1),
+                               config["features"])
+    one_row = batch.iloc[:1]
+    models = {"rf": tm.train_model_rf(train, config), "gbm": tm.train_model_gbm(train, config)}
+
+    print(f"{args.batch:,} rows, {os.cpu_count()} cores")
+    print(f"{'model':<5} {'engine':<10} {'threads':>7} {'1-row us':>10} {'batch rows/s':>14}")
+    for name, model in models.items():
+        # scikit-learn forests predict on their own n_jobs threads
+        engines = [("sklearn", getattr(model, "n_jobs", None) or 1, model)]
+        engines += [("compiled", n_jobs, cm.compile_model(model, n_jobs)) for n_jobs in args.jobs]
+        expected = model.predict(batch)
+        for engine, n_jobs, predictor in engines:
+            np.testing.assert_array_equal(predictor.predict(batch), expected)
+            latency = best_of(lambda: predictor.predict(one_row), repeat=200)
+            rows = args.batch / best_of(lambda: predictor.predict(batch), repeat=3)
+            print(f"{name:<5} {engine:<10} {n_jobs:>7} {latency * 1e6:>10.1f} {rows:>14,.0f}")
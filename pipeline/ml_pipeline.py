@@ -2,16 +2,21 @@ import argparse
 import datetime
 import logging
 import logging.config
+import tempfile
 import yaml
 import pandas as pd
 
 from pathlib import Path
 
 import src.aws_utils as aws
-import src.evaluate_performance as ep
+import src.dag as dag
+import src.feature_cache as fc
 import src.generate_features as gf
-import src.score_model as sm
+import src.profiling as profiling
+import src.scheduler as sched
+import src.split as sp
 import src.train_model as tm
+import src.tune_model as tune
 
 logging.config.fileConfig("config/logs/logging.conf")
 logger = logging.getLogger("delay")
@@ -23,6 +28,10 @@ if __name__ == "__main__":
     parser.add_argument(
         "--config", default="config/default-config.yaml", help="Path to configuration file"
     )
+    parser.add_argument(
+        "--file-keys", nargs="+", default=["flight_data_2021.csv"],
+        help="Keys of the raw flight data in the bucket, e.g. a batch passed by the ECS Lambda"
+    )
     args = parser.parse_args()
 
     # Load configuration file for parameters and run config
@@ -45,53 +54,79 @@ if __name__ == "__main__":
     with (artifacts / "config.yaml").open("w") as f:
         yaml.dump(config, f)
 
-    # Acquire data from repository and save to disk
-    aws_config = config.get("aws")
-    df = aws.read_csv_from_s3("flight_data_2021.csv", aws_config)
-    # Remove this line for real data
-    # df = df.drop(columns = "Unnamed: 0.1")
-    
-    # Clean datasets and generate features; save to disk
-    data = gf.generate_features(df)
-    print(data.columns)
-    #gf.save_features(data, artifacts / "data.csv")
-
-    # Split data into train/test set and train model based on config; save each to disk
-    train, test = tm.train_test(data)
-    #tm.save_data(train, test, artifacts)
-
-    pcr = tm.train_model_pcr(train, config["train_model"])
-    tm.save_model(pcr, artifacts / "pcr_model_object.joblib")
-
-    rf = tm.train_model_rf(train, config["train_model"])
-    tm.save_model(rf, artifacts / "rf_model_object.joblib")
-
-    gbm = tm.train_model_gbm(train, config["train_model"])
-    tm.save_model(gbm, artifacts / "gbm_model_object.joblib")
-
-    # Score model on test set; save scores to disk
-    scores_pcr = sm.score_model(test, pcr, config["score_model"])
-    sm.save_scores(scores_pcr, artifacts / "scores_pcr.csv")
+    # Record per-stage timings and memory into profile.json when enabled
+    profiling.profiler.configure(config.get("profiling"))
 
-    scores_rf = sm.score_model(test, rf, config["score_model"])
-    sm.save_scores(scores_rf, artifacts / "scores_rf.csv")
-
-    scores_gbm = sm.score_model(test, gbm, config["score_model"])
-    sm.save_scores(scores_gbm, artifacts / "scores_gbm.csv")
-
-    # Evaluate model performance metrics; save metrics to disk
-    metrics_pcr = ep.evaluate_performance(scores_pcr)
-    ep.save_metrics(metrics_pcr, artifacts / "metrics_pcr.yaml")
-
-    metrics_rf = ep.evaluate_performance(scores_rf)
-    ep.save_metrics(metrics_rf, artifacts / "metrics_rf.yaml")
-
-    metrics_gbm = ep.evaluate_performance(scores_gbm)
-    ep.save_metrics(metrics_gbm, artifacts / "metrics_gbm.yaml")
+    aws_config = config.get("aws")
+    cache_config = config.get("feature_cache", {})
+    incremental_config = config["train_model"].get("incremental", {})
+    dag_config = config.get("dag", {})
+    run_dag = dag_config.get("enabled", False) and not incremental_config.get("enabled", False)
+    file_keys = aws.as_keys(args.file_keys)
+    logger.info("Running on %d file(s): %s", len(file_keys), ", ".join(file_keys))
+    columns = aws.raw_columns(config["train_model"])
+
+    if incremental_config.get("enabled", False):
+        # Stream feature chunks so peak memory is bounded by aws.chunksize
+        model_columns = list(dict.fromkeys(config["train_model"]["features"]
+                                           + config["score_model"].get("segment_columns", [])
+                                           + [config["train_model"]["response"]]))
+
+        def chunks():
+            return gf.generate_feature_chunks(
+                aws.iter_csvs_from_s3(file_keys, aws_config, columns), model_columns)
+
+        with tempfile.TemporaryDirectory(prefix="delay-chunks-") as spool_dir:
+            if incremental_config.get("spool", True):
+                chunks = fc.spool_chunks(chunks(), Path(spool_dir))
+            metrics = sched.run_models_incremental(chunks, config, artifacts)
+    elif run_dag:
+        # Run only the stages whose inputs or config slice changed since a cached run;
+        # the upload stage runs last
+        pipeline = dag.DAG(dag.pipeline_nodes(config, artifacts, file_keys), dag_config)
+        metrics = pipeline.run(["upload"], workers=dag_config.get("workers") or 1)["upload"]
+    else:
+        # Acquire data from repository and generate features, reusing cached features if unchanged
+        data = None
+        if cache_config.get("enabled", False):
+            key = fc.cache_key(aws.objects_etag(file_keys, aws_config), columns)
+            data = fc.load_features(key, cache_config)
+
+        if data is None:
+            df = aws.read_csvs_from_s3(file_keys, aws_config, columns)
+            # Remove this line for real data
+            # df = df.drop(columns = "Unnamed: 0.1")
+
+            # Clean datasets and generate features; save to disk
+            data = gf.generate_features(df)
+            del df
+            if cache_config.get("enabled", False):
+                fc.store_features(data, key, cache_config)
+        print(data.columns)
+        #gf.save_features(data, artifacts / "data.csv")
+
+        # Split data into train/test views of one float32 matrix that every model reads
+        matrix = sp.split_data(data, config)
+        del data
+        train, test = matrix.train, matrix.test
+        #tm.save_data(train, test, artifacts)
+
+        # Pick hyperparameters by successive halving when train_model.tuning is enabled
+        config = tune.tune_models(train, config, artifacts)
+
+        # Train, score and evaluate each model; save models, scores and metrics to disk
+        metrics = sched.run_models(train, test, config, artifacts)
+
+    # Upload all artifacts to S3; a DAG run uploads in its last stage
+    if not run_dag:
+        if aws_config["upload"] == True:
+            aws.upload_artifacts(artifacts, aws_config)
+            logger.info("File uploaded to S3")
+        else:
+            logger.info("Do not uploaded to S3")
 
-    # Upload all artifacts to S3
-    if aws_config["upload"] == True:
+    # Written after the upload so that the upload is profiled too, then uploaded on its
+    # own; every other artifact is unchanged and skipped
+    if profiling.profiler.write(artifacts) is not None and aws_config["upload"] == True:
         aws.upload_artifacts(artifacts, aws_config)
-        logger.info("File uploaded to S3")
-    else:
-        logger.info("Do not uploaded to S3")
+        logger.info("Profile uploaded to S3")
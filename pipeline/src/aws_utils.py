@@ -1,59 +1,240 @@
 """
 This module sets up aws
 """
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Union
 from io import StringIO
 
 import boto3
 import pandas as pd
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import src.profiling as profiling
+from src.schema import RAW_DTYPES, concat_chunks
 
 logger = logging.getLogger("delay")
 
-def read_csv_from_s3(file_key: str, config: Dict) -> pd.DataFrame:
-    """Read a CSV file from S3 into a Pandas DataFrame."""
+# Raw columns that generate_features derives model features from
+SOURCE_COLUMNS = ["Cancelled", "DepTimeBlk", "Airline", "dept-type", "arr-type"]
+
+
+def raw_columns(config: Dict) -> Set[str]:
+    """Raw columns needed to build the configured features and response.
+
+    Args:
+        config (Dict): The ``train_model`` config with ``features`` and ``response``.
+
+    Returns:
+        Set[str]: Column names to keep while parsing the raw CSV.
+    """
+    return set(config["features"]) | set(SOURCE_COLUMNS) | {config["response"]}
+
+
+def iter_csv_from_s3(file_key: str, config: Dict,
+                     columns: Optional[Set[str]] = None) -> Iterator[pd.DataFrame]:
+    """Stream a CSV file from S3 into the parser and yield it chunk by chunk.
+
+    The S3 body is handed straight to ``pd.read_csv`` so the object is never
+    held in memory as bytes or as a decoded string.
+
+    Args:
+        file_key (str): Key of the CSV object in the bucket.
+        config (Dict): AWS config with ``bucket_name`` and optional ``chunksize``.
+        columns (Set[str], optional): Columns to keep; all columns when None.
+
+    Yields:
+        pd.DataFrame: Consecutive chunks of at most ``chunksize`` rows.
+    """
+    s3_session = boto3.client('s3')
+    obj = s3_session.get_object(Bucket=config["bucket_name"], Key=file_key)
+    profiling.annotate(bytes_read=obj['ContentLength'])
+    usecols = None if columns is None else (lambda col: col in columns)
+    reader = pd.read_csv(obj['Body'], usecols=usecols, dtype=RAW_DTYPES,
+                         chunksize=config.get("chunksize", 1_000_000))
+    with reader:
+        yield from reader
+
+
+@profiling.profiled("aws_utils.read_csv_from_s3")
+def read_csv_from_s3(file_key: str, config: Dict,
+                     columns: Optional[Set[str]] = None) -> pd.DataFrame:
+    """Read a CSV file from S3 into a Pandas DataFrame.
+
+    When ``config["stream"]`` is set the object is parsed in chunks straight
+    from the response body; otherwise it is downloaded and decoded first.
+
+    Args:
+        file_key (str): Key of the CSV object in the bucket.
+        config (Dict): AWS config with ``bucket_name``, ``stream`` and ``chunksize``.
+        columns (Set[str], optional): Columns to keep; all columns when None.
+
+    Returns:
+        pd.DataFrame: The parsed CSV.
+    """
+    if config.get("stream", False):
+        chunks = list(iter_csv_from_s3(file_key, config, columns))
+        if not chunks:
+            return pd.DataFrame(columns=sorted(columns or []))
+        if len(chunks) == 1:
+            profiling.annotate(rows=len(chunks[0]))
+            return chunks[0]
+        df_new = concat_chunks(chunks)
+        profiling.annotate(rows=len(df_new))
+        logger.info("Read %d rows from %s in %d chunks", len(df_new), file_key, len(chunks))
+        return df_new
 
     s3_session = boto3.client('s3')
     bucket_name = config["bucket_name"]
     # Get object from S3
     obj = s3_session.get_object(Bucket=bucket_name, Key=file_key)
-    df_new = pd.read_csv(StringIO(obj['Body'].read().decode('utf-8')))
+    profiling.annotate(bytes_read=obj['ContentLength'])
+    usecols = None if columns is None else (lambda col: col in columns)
+    df_new = pd.read_csv(StringIO(obj['Body'].read().decode('utf-8')), usecols=usecols,
+                         dtype=RAW_DTYPES)
+    profiling.annotate(rows=len(df_new))
     return df_new
 
+def object_etag(file_key: str, config: Dict) -> str:
+    """Fingerprint of an S3 object built from its location and ETag."""
+
+    s3_session = boto3.client('s3')
+    bucket_name = config["bucket_name"]
+    head = s3_session.head_object(Bucket=bucket_name, Key=file_key)
+    return f"s3://{bucket_name}/{file_key}@{head['ETag'].strip(chr(34))}"
+
+def as_keys(file_keys: Union[str, Sequence[str]]) -> List[str]:
+    """A single key or a batch of keys as a sorted list.
+
+    Sorting makes a batch read in the same order whatever order its keys were
+    given in, so the rows match the batch fingerprint of ``objects_etag``.
+    """
+
+    return [file_keys] if isinstance(file_keys, str) else sorted(file_keys)
+
+def iter_csvs_from_s3(file_keys: Union[str, Sequence[str]], config: Dict,
+                      columns: Optional[Set[str]] = None) -> Iterator[pd.DataFrame]:
+    """Stream several CSV objects one after the other, chunk by chunk.
+
+    Args:
+        file_keys (str or Sequence[str]): Keys of the CSV objects in the bucket.
+        config (Dict): AWS config with ``bucket_name`` and optional ``chunksize``.
+        columns (Set[str], optional): Columns to keep; all columns when None.
+
+    Yields:
+        pd.DataFrame: The chunks of every object, in sorted key order.
+    """
+    for file_key in as_keys(file_keys):
+        yield from iter_csv_from_s3(file_key, config, columns)
+
+def read_csvs_from_s3(file_keys: Union[str, Sequence[str]], config: Dict,
+                      columns: Optional[Set[str]] = None) -> pd.DataFrame:
+    """Read several CSV objects into one DataFrame, e.g. a batch of uploads.
+
+    Args:
+        file_keys (str or Sequence[str]): Keys of the CSV objects in the bucket.
+        config (Dict): AWS config, as for ``read_csv_from_s3``.
+        columns (Set[str], optional): Columns to keep; all columns when None.
+
+    Returns:
+        pd.DataFrame: The rows of every object, in sorted key order.
+    """
+    frames = [read_csv_from_s3(file_key, config, columns) for file_key in as_keys(file_keys)]
+    if len(frames) == 1:
+        return frames[0]
+    return concat_chunks(frames)
+
+def objects_etag(file_keys: Union[str, Sequence[str]], config: Dict) -> str:
+    """Fingerprint of a batch of S3 objects; the object_etag of a single key."""
+
+    return "|".join(object_etag(file_key, config) for file_key in as_keys(file_keys))
+
+def file_digest(location: Path, block_size: int = 1 << 20) -> str:
+    """Compute the sha256 digest of a local file without reading it whole."""
+
+    digest = hashlib.sha256()
+    with open(location, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _upload_if_changed(s3_client, file_path: Path, bucket_name: str, s3_key: str,
+                       transfer_config: TransferConfig) -> bool:
+    """Upload one file unless the object already carries the same sha256 metadata.
+
+    Returns:
+        bool: True if the file was uploaded, False if it was already up to date.
+    """
+    digest = file_digest(file_path)
+    try:
+        head = s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+        if head.get("Metadata", {}).get("sha256") == digest:
+            return False
+    except ClientError as client_error:
+        if client_error.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+    s3_client.upload_file(str(file_path), bucket_name, s3_key,
+                          ExtraArgs={"Metadata": {"sha256": digest}}, Config=transfer_config)
+    return True
+
+@profiling.profiled("aws_utils.upload_artifacts")
 def upload_artifacts(artifacts: Path, config: Dict) -> List[str]:
     """Upload all the artifacts in the specified directory to S3.
 
+    Files are uploaded concurrently with multipart transfers. Files whose
+    sha256 matches the metadata of the object already in the bucket are skipped.
+
     Args:
         artifacts (Path): 
         Directory containing all the artifacts from a given experiment.
-        config (Dict): Config required to upload artifacts to S3
+        config (Dict): Config required to upload artifacts to S3; optional keys are
+            ``prefix``, ``per_run_prefix``, ``upload_workers``,
+            ``multipart_threshold_mb`` and ``multipart_chunksize_mb``.
     Returns:
-        List[str]: List of S3 URIs for each file that was uploaded.
+        List[str]: List of S3 URIs for each file that was uploaded or already up to date.
     """
 
-    # Initialize S3 client
-    s3_client = boto3.client('s3')
+    upload_workers = config.get("upload_workers", 8)
+    transfer_config = TransferConfig(
+        multipart_threshold=config.get("multipart_threshold_mb", 64) * 1024 ** 2,
+        multipart_chunksize=config.get("multipart_chunksize_mb", 64) * 1024 ** 2,
+        max_concurrency=upload_workers)
+    # Initialize S3 client, shared by all upload threads; every file's transfer can
+    # hold max_concurrency connections at once, beyond botocore's default pool of 10
+    s3_client = boto3.client('s3', config=Config(
+        max_pool_connections=upload_workers * transfer_config.max_concurrency))
 
     # List of uploaded file paths
     uploaded_files = []
     bucket_name = config["bucket_name"]
-    s3_directory = "model-artifacts"
+    s3_directory = config.get("prefix", "model-artifacts")
+    if config.get("per_run_prefix", False):
+        s3_directory = f"{s3_directory}/{artifacts.name}"
 
-    # Iterate over files in the directory
-    for file_path in artifacts.glob("*"):
-        if file_path.is_file():
-            # Construct S3 key (object key)
-            s3_key = f"{s3_directory}/{file_path.name}"
+    # Construct S3 key (object key) for every file in the directory
+    files = {file_path: f"{s3_directory}/{file_path.name}"
+             for file_path in artifacts.glob("*") if file_path.is_file()}
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=upload_workers) as pool:
+        futures = {pool.submit(_upload_if_changed, s3_client, file_path, bucket_name, s3_key,
+                               transfer_config): (file_path, s3_key)
+                   for file_path, s3_key in files.items()}
+        for future in as_completed(futures):
+            file_path, s3_key = futures[future]
             try:
-                # Upload file to S3
-                s3_client.upload_file(str(file_path), bucket_name, s3_key)
-
+                if future.result():
+                    profiling.annotate(bytes_written=file_path.stat().st_size)
+                else:
+                    skipped += 1
                 # Append S3 URI to the list
                 uploaded_files.append(f"s3://{bucket_name}/{s3_key}")
-
             except FileNotFoundError as file_error:
                 logger.error("File not found error %s to S3: %s", file_path, file_error)
 
-    logger.info("File uploaded to S3")
-    return uploaded_files
+    logger.info("Uploaded %d files to s3://%s/%s, skipped %d unchanged",
+                len(uploaded_files) - skipped, bucket_name, s3_directory, skipped)
+    return sorted(uploaded_files)
@@ -0,0 +1,373 @@
+"""
+This module runs the pipeline as a DAG of fingerprinted stages, reusing cached stage outputs
+"""
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from copy import deepcopy
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+import joblib
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+import src.aws_utils as aws
+import src.evaluate_performance as ep
+import src.feature_cache as fc
+import src.generate_features as gf
+import src.profiling as profiling
+import src.scheduler as sched
+import src.score_model as sm
+import src.split as sp
+import src.train_model as tm
+import src.tune_model as tune
+
+logger = logging.getLogger("delay")
+
+
+@dataclass
+class Node:
+    '''
+    One pipeline stage
+
+    Attributes:
+        name (str): Unique stage name.
+        func (Callable): Called with the outputs of inputs, in order.
+        inputs (List[str]): Names of upstream stages.
+        params (Any): JSON-serialisable config slice the stage depends on.
+        version (str): Fingerprint of the stage code.
+        source (Callable[[], str]): Fingerprint of external data read by the stage.
+        cache (bool): Whether the output is stored and reused across runs.
+    '''
+    name: str
+    func: Callable[..., Any]
+    inputs: List[str] = field(default_factory=list)
+    params: Any = None
+    version: str = ""
+    source: Optional[Callable[[], str]] = None
+    cache: bool = True
+
+
+class DAG:
+    '''
+    Declarative graph of pipeline stages
+
+    A stage's fingerprint hashes its name, code version, config slice, external
+    source and the fingerprints of its inputs, so it changes exactly when the
+    stage or anything upstream of it changes. Stages whose fingerprint has a
+    stored output are loaded instead of run, and upstream stages needed only by
+    loaded stages are not run at all.
+    '''
+
+    def __init__(self, nodes: Iterable[Node], cache_config: Dict):
+        self.nodes = {node.name: node for node in nodes}
+        self.cache_config = cache_config
+        self.cache_dir = Path(cache_config.get("dir", "cache/dag"))
+        self.status: Dict[str, str] = {}
+        for node in self.nodes.values():
+            for name in node.inputs:
+                if name not in self.nodes:
+                    raise ValueError(f"Stage {node.name} depends on unknown stage {name}")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        order: List[str] = []
+        visiting = set()
+
+        def visit(name: str) -> None:
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage {name} is part of a cycle")
+            visiting.add(name)
+            for upstream in self.nodes[name].inputs:
+                visit(upstream)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name)
+        return order
+
+    def _ancestors(self, targets: Iterable[str]) -> List[str]:
+        needed = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                stack.extend(self.nodes[name].inputs)
+        return [name for name in self.order if name in needed]
+
+    def fingerprints(self, targets: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        '''
+        Fingerprint every stage the targets depend on
+
+        Args:
+            targets (Iterable[str]): Stages of interest; all stages when None.
+
+        Returns:
+            Dict[str, str]: Hex digest of each stage.
+        '''
+        fingerprints: Dict[str, str] = {}
+        for name in self._ancestors(targets or self.nodes):
+            node = self.nodes[name]
+            digest = hashlib.sha256()
+            parts = [name, node.version, json.dumps(node.params, sort_keys=True, default=str),
+                     node.source() if node.source is not None else "",
+                     *[fingerprints[upstream] for upstream in node.inputs]]
+            for part in parts:
+                digest.update(part.encode("utf-8"))
+                digest.update(b"\0")
+            fingerprints[name] = digest.hexdigest()
+        return fingerprints
+
+    def _location(self, name: str, fingerprint: str, suffix: str) -> Path:
+        return self.cache_dir / f"{name}-{fingerprint[:24]}{suffix}"
+
+    def _cached(self, name: str, fingerprint: str) -> Optional[Path]:
+        if not self.nodes[name].cache or self.cache_config.get("force_rebuild", False):
+            return None
+        for suffix in (".arrow", ".joblib"):
+            location = self._location(name, fingerprint, suffix)
+            if location.exists():
+                return location
+        return None
+
+    def _store(self, name: str, fingerprint: str, output: Any) -> None:
+        '''
+        Store a stage output: frames as Arrow files, anything else with joblib
+        '''
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        if isinstance(output, pd.DataFrame):
+            location = self._location(name, fingerprint, ".arrow")
+            partial = location.with_suffix(".partial")
+            feather.write_feather(pa.Table.from_pandas(output, preserve_index=True), partial,
+                                  compression="uncompressed")
+        else:
+            location = self._location(name, fingerprint, ".joblib")
+            partial = location.with_suffix(".partial")
+            joblib.dump(output, partial)
+        partial.replace(location)
+
+    @staticmethod
+    def _load(location: Path) -> Any:
+        '''
+        Memory-map a stored stage output
+        '''
+        if location.suffix == ".arrow":
+            return feather.read_table(location, memory_map=True).to_pandas()
+        return joblib.load(location, mmap_mode="r")
+
+    def _execute(self, node: Node, fingerprint: str, cached: Optional[Path],
+                 inputs: List[Any]) -> Any:
+        if cached is not None:
+            logger.info("Stage %s reused from %s", node.name, cached)
+            return self._load(cached)
+        start = time.perf_counter()
+        if profiling.profiler.enabled:
+            output = profiling.profiler.call(f"dag.{node.name}", node.func, *inputs)
+        else:
+            output = node.func(*inputs)
+        logger.info("Stage %s ran in %.1fs", node.name, time.perf_counter() - start)
+        if node.cache:
+            self._store(node.name, fingerprint, output)
+        return output
+
+    def run(self, targets: Optional[Iterable[str]] = None, workers: int = 1) -> Dict[str, Any]:
+        '''
+        Run the stages needed for targets, independent stages in parallel threads
+
+        Args:
+            targets (Iterable[str]): Stages whose outputs are wanted; all stages when None.
+            workers (int): Maximum number of stages running at once.
+
+        Returns:
+            Dict[str, Any]: Output of each target stage.
+        '''
+        targets = list(targets or self.order)
+        fingerprints = self.fingerprints(targets)
+        cached = {name: self._cached(name, fingerprint)
+                  for name, fingerprint in fingerprints.items()}
+
+        # Walk up from the targets, stopping at stages whose output is stored
+        required = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in required:
+                required.add(name)
+                if cached[name] is None:
+                    stack.extend(self.nodes[name].inputs)
+        self.status = {name: "cached" if cached[name] is not None else "computed"
+                       for name in self.order if name in required}
+
+        outputs: Dict[str, Any] = {}
+        pending = [name for name in self.order if name in required]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            running = {}
+            while pending or running:
+                for name in list(pending):
+                    upstream = [] if cached[name] is not None else self.nodes[name].inputs
+                    if all(dep in outputs for dep in upstream):
+                        pending.remove(name)
+                        future = pool.submit(self._execute, self.nodes[name], fingerprints[name],
+                                             cached[name], [outputs[dep] for dep in upstream])
+                        running[future] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    outputs[running.pop(future)] = future.result()
+
+        if self.cache_dir.exists():
+            fc.evict({**self.cache_config, "dir": self.cache_dir}, ("*.arrow", "*.joblib"))
+        logger.info("Pipeline stages computed: %s",
+                    [name for name, status in self.status.items() if status == "computed"])
+        return {name: outputs[name] for name in targets}
+
+
+def _module_version(module) -> str:
+    return aws.file_digest(Path(module.__file__))
+
+
+def _tune_stage(name: str, config: Dict) -> Callable[[Any], Dict]:
+    def run(split):
+        params, leaderboard = tune.tune_model(name, split.train, config)
+        return {"params": params, "leaderboard": leaderboard}
+    return run
+
+
+def _train_stage(name: str, config: Dict) -> Callable[..., Dict]:
+    def train(split, tuned=None):
+        train_config = config["train_model"]
+        if tuned is not None:
+            train_config = {**train_config, sched.MODELS[name]["section"]: tuned["params"]}
+        start = time.perf_counter()
+        model = sched.MODELS[name]["trainer"](split.train, train_config)
+        return {"model": model, "train_time": time.perf_counter() - start}
+    return train
+
+
+def _score_stage(config: Dict) -> Callable[[Any, Dict], pd.DataFrame]:
+    def score(split, trained):
+        return sm.score_model(split.test, trained["model"], config["score_model"])
+    return score
+
+
+def _evaluate_stage(name: str, config: Dict) -> Callable[[pd.DataFrame, Dict], Dict]:
+    def evaluate(scores, trained):
+        return sched.evaluate_chain(name, scores, trained["train_time"], config)
+    return evaluate
+
+
+def pipeline_nodes(config: Dict, artifacts: Path,
+                   file_keys: Union[str, Sequence[str]]) -> List[Node]:
+    '''
+    Build the acquire, features, split, train, score, evaluate, save and upload stages
+
+    Each model's train, score and evaluate stages depend only on its own config
+    section, so changing e.g. GBM.learning_rate reruns just the GBM stages.
+
+    Args:
+        config (Dict): The full pipeline config.
+        artifacts (Path): Directory of this run's artifacts.
+        file_keys (str or Sequence[str]): Key or keys of the raw flight data in the bucket.
+
+    Returns:
+        List[Node]: The pipeline stages.
+    '''
+    aws_config = config["aws"]
+    train_config = config["train_model"]
+    columns = aws.raw_columns(train_config)
+    file_keys = aws.as_keys(file_keys)
+
+    # Estimator threads share the CPU budget with the stages running beside them
+    budget = sched.worker_budget(
+        {"workers": config.get("dag", {}).get("workers"),
+         "cpu_budget": config.get("scheduler", {}).get("cpu_budget")}, len(sched.MODELS))
+    run_config = deepcopy(config)
+    for spec in sched.MODELS.values():
+        run_config["train_model"].setdefault(spec["section"], {})["n_jobs"] = budget["n_jobs"]
+    run_config["score_model"]["n_jobs"] = budget["n_jobs"]
+    # A tune stage's process pool gets the same share of the budget as a train stage
+    tune_config = deepcopy(run_config)
+    tune_config.setdefault("scheduler", {})["cpu_budget"] = budget["n_jobs"]
+    tuning = tune_config["train_model"].get("tuning", {})
+    tuning["workers"] = min(tuning.get("workers") or budget["n_jobs"], budget["n_jobs"])
+    logger.info("Model stages share the CPU budget with n_jobs=%d", budget["n_jobs"])
+
+    nodes = [
+        Node("acquire", lambda: aws.read_csvs_from_s3(file_keys, aws_config, columns),
+             params={"file_keys": file_keys, "columns": sorted(columns)},
+             source=lambda: aws.objects_etag(file_keys, aws_config), cache=False),
+        Node("features", lambda raw: gf.generate_features(raw), inputs=["acquire"],
+             version=fc.code_version()),
+        Node("split", lambda data: sp.split_data(data, config), inputs=["features"],
+             params={"split": config.get("split", {}),
+                     "columns": [train_config["features"], train_config["response"],
+                                 config["score_model"]["features"],
+                                 config["score_model"]["response"],
+                                 config["score_model"].get("segment_columns", [])]},
+             version=_module_version(sp)),
+    ]
+    tuned = tune.tuned_models(config)
+    for name, spec in sched.MODELS.items():
+        train_inputs = ["split"]
+        if name in tuned:
+            # The winning hyperparameters feed the train stage, which fits them on the
+            # full train split
+            nodes.append(Node(f"tune_{name}", _tune_stage(name, tune_config), inputs=["split"],
+                              params={"features": train_config["features"],
+                                      "response": train_config["response"],
+                                      "tuning": {key: value for key, value
+                                                 in train_config["tuning"].items()
+                                                 if key not in ("enabled", "spaces")},
+                                      "space": train_config["tuning"]["spaces"][spec["section"]],
+                                      spec["section"]: train_config.get(spec["section"], {})},
+                              version=_module_version(tune)))
+            train_inputs.append(f"tune_{name}")
+        nodes += [
+            Node(f"train_{name}", _train_stage(name, run_config), inputs=train_inputs,
+                 params={"features": train_config["features"],
+                         "response": train_config["response"],
+                         spec["section"]: train_config.get(spec["section"], {})},
+                 version=_module_version(tm)),
+            Node(f"score_{name}", _score_stage(run_config), inputs=["split", f"train_{name}"],
+                 params=config["score_model"], version=_module_version(sm)),
+            Node(f"evaluate_{name}", _evaluate_stage(name, run_config),
+                 inputs=[f"score_{name}", f"train_{name}"], version=_module_version(ep)),
+        ]
+
+    save_inputs = [f"{stage}_{name}" for name in sched.MODELS
+                   for stage in ("train", "score", "evaluate")]
+    save_inputs += [f"tune_{name}" for name in tuned]
+
+    def save(*outputs):
+        stage_outputs = dict(zip(save_inputs, outputs))
+        if tuned:
+            tune.save_leaderboard(pd.concat([stage_outputs[f"tune_{name}"]["leaderboard"]
+                                             for name in tuned], ignore_index=True),
+                                  artifacts / "leaderboard.csv")
+        metrics = {}
+        for name in sched.MODELS:
+            metrics[name] = dict(stage_outputs[f"evaluate_{name}"])
+            sched.save_chain_artifacts(name, stage_outputs[f"train_{name}"]["model"],
+                                       stage_outputs[f"score_{name}"], metrics[name],
+                                       run_config, artifacts)
+        return metrics
+
+    def upload(metrics):
+        if aws_config["upload"] == True:
+            aws.upload_artifacts(artifacts, aws_config)
+            logger.info("File uploaded to S3")
+        else:
+            logger.info("Do not uploaded to S3")
+        return metrics
+
+    nodes += [Node("save", save, inputs=save_inputs, cache=False),
+              Node("upload", upload, inputs=["save"], cache=False)]
+    return nodes
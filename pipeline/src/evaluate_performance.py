@@ -1,7 +1,8 @@
 """
 This module evaluates model's performance
 """
-from typing import Dict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List
 from pathlib import Path
 
 import logging
@@ -9,34 +10,193 @@ import numpy as np
 import pandas as pd
 import yaml
 
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+import src.profiling as profiling
 
 logger = logging.getLogger("delay")
 
-def evaluate_performance(scores: pd.DataFrame) -> Dict:
+@dataclass
+class MetricAccumulator:
+    '''
+    Sufficient statistics of regression errors, updated chunk by chunk and mergeable
+
+    The response is tracked as a mean and a sum of squared deviations (m2),
+    combined with Chan's parallel update, so R^2 stays accurate over hundreds
+    of millions of rows where a plain sum of squares would lose precision.
+    '''
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    abs_error: float = 0.0
+    sq_error: float = 0.0
+
+    def combine(self, count: int, mean: float, m2: float, abs_error: float,
+                sq_error: float) -> "MetricAccumulator":
+        '''
+        Fold in the statistics of another set of rows
+        '''
+        if count == 0:
+            return self
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.abs_error += abs_error
+        self.sq_error += sq_error
+        self.count = total
+        return self
+
+    def update(self, y_test: np.ndarray, y_pred: np.ndarray) -> "MetricAccumulator":
+        '''
+        Add a chunk of responses and predictions
+        '''
+        if len(y_test) == 0:
+            return self
+        mean = y_test.mean()
+        error = y_test - y_pred
+        return self.combine(len(y_test), mean, ((y_test - mean) ** 2).sum(),
+                            np.abs(error).sum(), (error ** 2).sum())
+
+    def merge(self, other: "MetricAccumulator") -> "MetricAccumulator":
+        '''
+        Add the rows of an accumulator filled elsewhere, e.g. in another worker
+        '''
+        return self.combine(other.count, other.mean, other.m2, other.abs_error, other.sq_error)
+
+    def metrics(self) -> Dict[str, float]:
+        '''
+        Mean absolute error, root mean squared error, R^2 and row count
+        '''
+        if self.count <= 0:
+            raise ValueError("Empty data")
+        if self.m2 > 0:
+            r2_new = 1 - self.sq_error / self.m2
+        else:
+            # Constant response: perfect predictions score 1, anything else 0, as in sklearn
+            r2_new = 1.0 if self.sq_error == 0 else 0.0
+        return {"mae": float(self.abs_error / self.count),
+                "rmse": float(np.sqrt(self.sq_error / self.count)),
+                "r2": float(r2_new), "n": int(self.count)}
+
+
+def _group_statistics(y_test: np.ndarray, y_pred: np.ndarray, codes: np.ndarray,
+                      n_groups: int) -> List[np.ndarray]:
+    '''
+    Count, mean, m2, absolute and squared error of every group code, in one vectorized pass
+    '''
+    count = np.bincount(codes, minlength=n_groups)
+    mean = np.bincount(codes, y_test, n_groups) / np.maximum(count, 1)
+    deviation = y_test - mean[codes]
+    error = y_test - y_pred
+    return [count, mean, np.bincount(codes, deviation * deviation, n_groups),
+            np.bincount(codes, np.abs(error), n_groups), np.bincount(codes, error * error, n_groups)]
+
+
+class StreamingEvaluator:
+    '''
+    Evaluate scores chunk by chunk, overall and per segment, without keeping the scores
+
+    Segments are score columns such as "Airline", "Month" or "dep_time"; every
+    distinct value of a segment column gets its own accumulator, filled in the
+    same pass as the overall one. Evaluators filled on different workers are
+    combined with merge.
+    '''
+
+    def __init__(self, segments: Iterable[str] = ()):
+        self.overall = MetricAccumulator()
+        self.segments: Dict[str, Dict[Any, MetricAccumulator]] = {column: {}
+                                                                  for column in segments}
+
+    def update(self, scores: pd.DataFrame) -> "StreamingEvaluator":
+        '''
+        Add a chunk of scores with "test" and "pred" columns and any segment columns
+        '''
+        y_test = scores["test"].to_numpy(dtype=np.float64)
+        y_pred = scores["pred"].to_numpy(dtype=np.float64)
+        if np.isnan(y_test).any() or np.isnan(y_pred).any():
+            raise ValueError("Input scores contain NaN values")
+        profiling.annotate(rows=len(y_test))
+        self.overall.update(y_test, y_pred)
+
+        for column, groups in self.segments.items():
+            if column not in scores.columns:
+                raise ValueError(f"Scores have no segment column {column}")
+            codes, values = pd.factorize(scores[column])
+            # Rows with a missing segment value only count towards the overall metrics
+            valid = codes >= 0
+            statistics = _group_statistics(y_test[valid], y_pred[valid], codes[valid],
+                                           len(values))
+            for i, value in enumerate(values):
+                key = value.item() if isinstance(value, np.generic) else value
+                # Segments read from the float32 feature matrix keep their integer keys
+                if isinstance(key, float) and key.is_integer():
+                    key = int(key)
+                groups.setdefault(key, MetricAccumulator()).combine(
+                    *[statistic[i] for statistic in statistics])
+        return self
+
+    def merge(self, other: "StreamingEvaluator") -> "StreamingEvaluator":
+        '''
+        Add the rows of an evaluator filled elsewhere
+        '''
+        self.overall.merge(other.overall)
+        for column, groups in other.segments.items():
+            mine = self.segments.setdefault(column, {})
+            for key, accumulator in groups.items():
+                mine.setdefault(key, MetricAccumulator()).merge(accumulator)
+        return self
+
+    def result(self) -> Dict:
+        '''
+        Overall metrics, plus metrics per value of every segment column
+
+        Returns:
+            Dict: mae, rmse, r2 and n, and with segments a "segments" mapping of
+            column -> value -> metrics.
+        '''
+        metrics = self.overall.metrics()
+        if self.segments:
+            metrics["segments"] = {
+                column: {key: groups[key].metrics() for key in sorted(groups, key=str)}
+                for column, groups in self.segments.items()}
+        return metrics
+
+
+@profiling.profiled("evaluate_performance.evaluate_performance")
+def evaluate_performance(scores: pd.DataFrame, segments: Iterable[str] = ()) -> Dict:
     '''
     Use scores dataframe to calculate mean_absolute_error, mean_squared_error, r2_score.
 
     Args:
-        scores (Dict): A dictionary containing scores dataframe with keys "test", "prob", and "bin".
+        scores (pd.DataFrame): Scores with "test" and "pred" columns and any segment columns.
+        segments (Iterable[str]): Score columns to also compute metrics per value of.
 
     Returns:
         Dict: A dictionary containing the calculated metrics.
     '''
-    y_test = scores["test"]
-    y_pred = scores["pred"]
-    if len(y_test) <= 0:
-        raise ValueError("Empty data")
-    if np.isnan(y_test).any() or np.isnan(y_pred).any():
-        raise ValueError("Input scores contain NaN values")
+    metrics = StreamingEvaluator(segments).update(scores).result()
+    del metrics["n"]
+    return metrics
+
 
-    mae = mean_absolute_error(y_test, y_pred)
-    rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-    r2_new = r2_score(y_test, y_pred)
+@profiling.profiled("evaluate_performance.evaluate_chunks")
+def evaluate_chunks(chunks: Iterable[pd.DataFrame], segments: Iterable[str] = ()) -> Dict:
+    '''
+    Evaluate a stream of score chunks in a single pass, holding one chunk at a time
 
-    return {"mae": mae, "rmse": rmse, "r2": r2_new}
+    Args:
+        chunks (Iterable[pd.DataFrame]): Chunks of scores.
+        segments (Iterable[str]): Score columns to also compute metrics per value of.
+
+    Returns:
+        Dict: Overall metrics with row count n, and per-segment metrics.
+    '''
+    evaluator = StreamingEvaluator(segments)
+    for chunk in chunks:
+        evaluator.update(chunk)
+    return evaluator.result()
 
 
+@profiling.profiled("evaluate_performance.save_metrics")
 def save_metrics(metric: Dict, location: Path) -> None:
     '''
     Save metrics as yml file
@@ -57,6 +217,7 @@ def save_metrics(metric: Dict, location: Path) -> None:
             metric["r2"] = r2_value
         with open(location, "w", encoding="utf-8") as file:
             yaml.dump(metric, file)
+        profiling.annotate(bytes_written=Path(location).stat().st_size)
         logger.info("Model metrics saved to %s", location)
     except FileNotFoundError as file_error:
         logger.error("File not found error occurred while saving dataset: %s", file_error)
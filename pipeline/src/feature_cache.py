@@ -0,0 +1,179 @@
+"""
+This module caches generated features on local disk as Arrow files
+"""
+import hashlib
+import inspect
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+import src.aws_utils as aws
+import src.generate_features as gf
+import src.schema as schema
+
+logger = logging.getLogger("delay")
+
+# Code whose source decides the feature matrix: the feature code itself, the
+# dtypes the raw data is read with and the raw columns it is built from
+FEATURE_SOURCES = (gf, schema, aws.raw_columns)
+
+def code_version() -> str:
+    '''
+    Fingerprint of the feature code, so edits to any of FEATURE_SOURCES invalidate the cache
+
+    Returns:
+        str: Hex digest of the sources of FEATURE_SOURCES.
+    '''
+    digest = hashlib.sha256()
+    for source in FEATURE_SOURCES:
+        digest.update(inspect.getsource(source).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def cache_key(source: str, columns: Iterable[str]) -> str:
+    '''
+    Content address of a feature matrix
+
+    Args:
+        source (str): Fingerprint of the raw data, e.g. S3 ETag or local file digest.
+        columns (Iterable[str]): Raw columns the features were built from.
+
+    Returns:
+        str: Hex digest identifying the feature matrix.
+    '''
+    digest = hashlib.sha256()
+    for part in [source, code_version(), *sorted(columns)]:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _cache_path(key: str, config: Dict) -> Path:
+    return Path(config.get("dir", "cache/features")) / f"{key}.arrow"
+
+
+def load_features(key: str, config: Dict) -> Optional[pd.DataFrame]:
+    '''
+    Load a cached feature matrix, memory-mapping the Arrow file
+
+    Args:
+        key (str): The cache key from cache_key.
+        config (Dict): The feature_cache config.
+
+    Returns:
+        pd.DataFrame: The cached features, or None on a miss or forced rebuild.
+    '''
+    location = _cache_path(key, config)
+    if config.get("force_rebuild", False):
+        logger.info("Feature cache rebuild forced; ignoring %s", location)
+        return None
+    if not location.exists():
+        logger.info("Feature cache miss for %s", key)
+        return None
+    try:
+        data = feather.read_table(location, memory_map=True).to_pandas()
+    except (OSError, pa.ArrowInvalid) as cache_error:
+        logger.error("Unreadable feature cache entry %s: %s", location, cache_error)
+        return None
+    # Refresh the access time used for eviction
+    os.utime(location)
+    logger.info("Features loaded from cache %s", location)
+    return data
+
+
+def store_features(data: pd.DataFrame, key: str, config: Dict) -> Path:
+    '''
+    Persist a feature matrix in the cache, then evict old entries
+
+    Args:
+        data (pd.DataFrame): The features to cache.
+        key (str): The cache key from cache_key.
+        config (Dict): The feature_cache config.
+
+    Returns:
+        Path: Location of the cached file.
+    '''
+    location = _cache_path(key, config)
+    location.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(data, preserve_index=True)
+    # A temporary file of its own, so processes writing the same key never share one
+    with tempfile.NamedTemporaryFile(dir=location.parent, prefix=f"{key}.",
+                                     suffix=".partial", delete=False) as file:
+        partial = Path(file.name)
+    try:
+        feather.write_feather(table, partial,
+                              compression=config.get("compression", "uncompressed"))
+        partial.replace(location)
+    finally:
+        # Left behind only if the write failed
+        partial.unlink(missing_ok=True)
+    logger.info("Features cached to %s", location)
+    evict(config)
+    return location
+
+
+def evict(config: Dict, patterns: Iterable[str] = ("*.arrow",)) -> None:
+    '''
+    Remove entries older than max_age_days, then least recently used entries
+    until the cache fits in max_size_gb
+
+    Args:
+        config (Dict): The feature_cache config.
+        patterns (Iterable[str]): Glob patterns of the cache entries in config["dir"].
+    '''
+    cache_dir = Path(config.get("dir", "cache/features"))
+    max_age = config.get("max_age_days")
+    max_size = config.get("max_size_gb")
+    entries = sorted({path for pattern in patterns for path in cache_dir.glob(pattern)},
+                     key=lambda path: path.stat().st_mtime)
+
+    if max_age is not None:
+        cutoff = time.time() - max_age * 86400
+        for path in [path for path in entries if path.stat().st_mtime < cutoff]:
+            path.unlink()
+            entries.remove(path)
+            logger.info("Evicted expired feature cache entry %s", path)
+
+    if max_size is not None:
+        total = sum(path.stat().st_size for path in entries)
+        # The newest entry is always kept, even when it alone exceeds the limit
+        while len(entries) > 1 and total > max_size * 1024 ** 3:
+            path = entries.pop(0)
+            total -= path.stat().st_size
+            path.unlink()
+            logger.info("Evicted feature cache entry %s to fit size limit", path)
+
+
+def spool_chunks(chunks: Iterable[pd.DataFrame], directory: Path) -> Callable[[], Iterator[pd.DataFrame]]:
+    '''
+    Write feature chunks to local Arrow files once, for cheap repeated passes
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): Feature chunks, e.g. streamed from S3.
+        directory (Path): Directory for the spooled files.
+
+    Returns:
+        Callable[[], Iterator[pd.DataFrame]]: Source re-reading the spooled chunks
+        memory-mapped, one at a time.
+    '''
+    directory.mkdir(parents=True, exist_ok=True)
+    locations = []
+    for i, chunk in enumerate(chunks):
+        location = directory / f"chunk_{i:05d}.arrow"
+        feather.write_feather(pa.Table.from_pandas(chunk, preserve_index=False), location,
+                              compression="uncompressed")
+        locations.append(location)
+    logger.info("Spooled %d feature chunks to %s", len(locations), directory)
+
+    def source() -> Iterator[pd.DataFrame]:
+        for location in locations:
+            yield feather.read_table(location, memory_map=True).to_pandas()
+    return source
@@ -3,33 +3,111 @@ This module performs feature engineering
 """
 import logging
 from pathlib import Path
+from typing import Iterable, Iterator, List
 
+import numpy as np
 import pandas as pd
 
+import src.profiling as profiling
+import src.schema as schema
+
 logger = logging.getLogger('delay')
 
+# One-hot encoded source columns and the prefix of their indicator columns
+ONE_HOT_COLUMNS = {"Airline": None, "dept-type": "dept-type_ohe", "arr-type": "arr-type_ohe"}
+
+
+def parse_dep_time(dep_time_blk: pd.Series) -> np.ndarray:
+    '''
+    Parse the departure hour from DepTimeBlk values such as "1000-1059"
+
+    Only the distinct blocks are parsed (the categories of a categorical column);
+    every row then takes its hour by code.
+
+    Args:
+        dep_time_blk (pd.Series): The DepTimeBlk column.
+
+    Returns:
+        np.ndarray: The departure hour of every row, in FEATURE_DTYPES["dep_time"].
+    '''
+    codes, blocks = pd.factorize(dep_time_blk)
+    if (codes < 0).any():
+        raise ValueError("DepTimeBlk contains missing values")
+    hours = np.array([int(block[0:2]) for block in blocks],
+                     dtype=schema.FEATURE_DTYPES["dep_time"])
+    return hours[codes]
+
+
+def one_hot_encode(data: pd.DataFrame) -> pd.DataFrame:
+    '''
+    One-hot encode all ONE_HOT_COLUMNS into a single preallocated indicator matrix
+
+    Columns are named and ordered like pd.get_dummies: sorted categories, with
+    the configured prefix; missing values get no indicator.
+
+    Args:
+        data (pd.DataFrame): The input DataFrame containing the source columns.
+
+    Returns:
+        pd.DataFrame: Boolean (one byte per cell) indicator columns aligned to data.
+    '''
+    encoded = []
+    names = []
+    for col, prefix in ONE_HOT_COLUMNS.items():
+        codes, categories = pd.factorize(data[col], sort=True)
+        encoded.append((len(names), codes))
+        names.extend(str(c) if prefix is None else f"{prefix}_{c}" for c in categories)
+
+    ohe = np.zeros((len(data), len(names)), dtype=bool)
+    rows = np.arange(len(data))
+    for offset, codes in encoded:
+        valid = codes >= 0
+        ohe[rows[valid], offset + codes[valid]] = True
+    return pd.DataFrame(ohe, index=data.index, columns=names, copy=False)
+
+
+@profiling.profiled("generate_features.generate_features")
 def generate_features(data: pd.DataFrame) -> pd.DataFrame:
     '''
     Generate features from data
 
+    Cancelled flights are dropped; Cancelled may be the schema's bool or the
+    raw "True"/"False" strings.
+
     Args:
         data (pd.DataFrame): The input DataFrame containing the data.
 
     Returns:
         pd.DataFrame: The DataFrame with generated features.
     '''
-    data = data[data['Cancelled'] == 'False']
-    dep_time = []
-    for i in data['DepTimeBlk']:
-        dep_time.append(int(i[0:2]))
-    data['dep_time'] = dep_time
-    for col in ['Airline']:
-        ohe = pd.get_dummies(data[col])
-        data = pd.concat([data, ohe], axis=1)
-    for i, col in enumerate(['dept-type', 'arr-type']):
-        ohe = pd.get_dummies(data[col], prefix=col+'_ohe')
-        data = pd.concat([data, ohe], axis=1)
-    return data
+    data = data[~schema.as_bool(data['Cancelled']).to_numpy()]
+    dep_time = pd.Series(parse_dep_time(data['DepTimeBlk']), index=data.index, name='dep_time')
+    ohe = one_hot_encode(data)
+    profiling.annotate(rows=len(data))
+    return pd.concat([data, dep_time, ohe], axis=1)
+
+def generate_feature_chunks(chunks: Iterable[pd.DataFrame],
+                            columns: List[str]) -> Iterator[pd.DataFrame]:
+    '''
+    Generate features chunk by chunk, keeping only the model columns
+
+    One-hot columns of categories absent from a chunk are added as False, so
+    every chunk has the same columns in the same order.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): Raw data chunks.
+        columns (List[str]): Feature and response columns to keep.
+
+    Yields:
+        pd.DataFrame: The model columns of each chunk.
+    '''
+    for chunk in chunks:
+        data = generate_features(chunk)
+        missing = [col for col in columns if col not in data.columns]
+        if missing:
+            data = pd.concat([data, pd.DataFrame(False, index=data.index, columns=missing)], axis=1)
+        yield data[columns]
+
 
 def save_features(data: pd.DataFrame, location: Path) -> None:
     '''
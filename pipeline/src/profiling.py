@@ -0,0 +1,221 @@
+"""
+This module records wall time, CPU time, peak memory and data volume of pipeline stages
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import resource
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("delay")
+
+# Seconds between resident memory samples while a stage is running
+SAMPLE_INTERVAL = 0.01
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    '''
+    Resident memory of this process in bytes
+
+    Falls back to the process peak from getrusage where /proc is unavailable.
+
+    Returns:
+        int: Resident set size in bytes.
+    '''
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Profiler:
+    '''
+    Collects one record per profiled stage call
+
+    Records hold wall and CPU seconds, the peak resident memory sampled while
+    the stage ran, and the rows and bytes the stage reported through annotate.
+    CPU time is process-wide, so stages running at the same time in different
+    threads count each other's CPU time.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = False
+        self.records: List[Dict[str, Any]] = []
+        self._profiles: List[cProfile.Profile] = []
+        self._active: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sampler: Optional[threading.Thread] = None
+        self._origin = time.perf_counter()
+
+    def configure(self, config: Optional[Dict]) -> None:
+        '''
+        Enable or disable profiling from the profiling config
+
+        Args:
+            config (Dict): The profiling config with enabled and cprofile.
+        '''
+        config = config or {}
+        self.enabled = config.get("enabled", False)
+        self.cprofile = self.enabled and config.get("cprofile", False)
+        # Threads do not survive a fork, so worker processes start their own sampler
+        if self.enabled and (self._sampler is None or not self._sampler.is_alive()):
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+
+    def _sample(self) -> None:
+        while True:
+            time.sleep(SAMPLE_INTERVAL)
+            rss = current_rss()
+            with self._lock:
+                for record in self._active:
+                    record["peak_rss_mb"] = max(record["peak_rss_mb"], rss / 1024 ** 2)
+
+    def _stack(self) -> List[Dict[str, Any]]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def call(self, stage: str, func: Callable, *args, **kwargs):
+        '''
+        Run func as a profiled stage
+        '''
+        stack = self._stack()
+        record = {"stage": stage, "thread": threading.current_thread().name,
+                  "start_s": time.perf_counter() - self._origin,
+                  "peak_rss_mb": current_rss() / 1024 ** 2,
+                  "rows": None, "bytes_read": None, "bytes_written": None}
+        # cProfile can only follow one profiler per thread, so nested stages
+        # are covered by their outermost stage's profile
+        profile = cProfile.Profile() if self.cprofile and not stack else None
+        stack.append(record)
+        with self._lock:
+            self._active.append(record)
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+            record["wall_s"] = time.perf_counter() - wall
+            record["cpu_s"] = time.process_time() - cpu
+            stack.pop()
+            with self._lock:
+                self._active.remove(record)
+                record["peak_rss_mb"] = max(record["peak_rss_mb"], current_rss() / 1024 ** 2)
+                self.records.append(record)
+                if profile is not None:
+                    self._profiles.append(profile)
+            logger.info("Profiled %s: %.3fs wall, %.3fs CPU, %.0f MB peak RSS",
+                        stage, record["wall_s"], record["cpu_s"], record["peak_rss_mb"])
+
+    def annotate(self, **counts: int) -> None:
+        '''
+        Add rows, bytes_read or bytes_written to the innermost running stage of this thread
+        '''
+        if not self.enabled or not self._stack():
+            return
+        record = self._stack()[-1]
+        for key, value in counts.items():
+            record[key] = (record[key] or 0) + int(value)
+
+    def collect(self) -> List[Dict[str, Any]]:
+        '''
+        Return and clear the records gathered so far, e.g. to send them from a worker process
+        '''
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+    def extend(self, records: List[Dict[str, Any]]) -> None:
+        '''
+        Add records gathered in another process
+        '''
+        with self._lock:
+            self.records.extend(records)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        '''
+        Totals per stage name: calls, wall and CPU seconds, rows, bytes and peak memory
+        '''
+        totals: Dict[str, Dict[str, Any]] = {}
+        for record in self.records:
+            total = totals.setdefault(record["stage"], {
+                "calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0,
+                "rows": 0, "bytes_read": 0, "bytes_written": 0})
+            total["calls"] += 1
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], record["peak_rss_mb"])
+            for key in ("wall_s", "cpu_s", "rows", "bytes_read", "bytes_written"):
+                total[key] += record[key] or 0
+        return totals
+
+    def write(self, artifacts: Path) -> Optional[Path]:
+        '''
+        Write profile.json and, with cprofile set, a profile.prof pstats dump
+
+        The pstats dump can be opened with snakeviz or turned into a flamegraph
+        with flameprof.
+
+        Args:
+            artifacts (Path): The run's artifacts directory.
+
+        Returns:
+            Path: The written profile.json, or None when profiling is disabled.
+        '''
+        if not self.enabled:
+            return None
+        location = artifacts / "profile.json"
+        profile = {"max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                   "stages": self.summary(), "calls": self.records}
+        with open(location, "w", encoding="utf-8") as file:
+            json.dump(profile, file, indent=2)
+        if self._profiles:
+            stats = pstats.Stats(self._profiles[0])
+            for extra in self._profiles[1:]:
+                stats.add(extra)
+            stats.dump_stats(artifacts / "profile.prof")
+        logger.info("Pipeline profile saved to %s", location)
+        return location
+
+
+# Process-wide profiler used by the profiled decorator
+profiler = Profiler()
+
+
+def profiled(stage: str) -> Callable[[Callable], Callable]:
+    '''
+    Decorate a function so each call is recorded as a stage when profiling is enabled
+
+    Args:
+        stage (str): Stage name in profile.json.
+
+    Returns:
+        Callable: The decorator.
+    '''
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            return profiler.call(stage, func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**counts: int) -> None:
+    '''
+    Report rows, bytes_read or bytes_written for the running stage; no-op when disabled
+    '''
+    profiler.annotate(**counts)
@@ -0,0 +1,293 @@
+"""
+This module runs the train, score and evaluate chain of every model in parallel
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+from threadpoolctl import threadpool_limits
+
+import src.compact_model as cm
+import src.evaluate_performance as ep
+import src.profiling as profiling
+import src.schema as schema
+import src.score_model as sm
+import src.train_model as tm
+
+logger = logging.getLogger("delay")
+
+# Model name used in artifact file names, with its trainer and config section
+MODELS: Dict[str, Dict[str, Any]] = {
+    "pcr": {"trainer": tm.train_model_pcr, "incremental": tm.train_model_pcr_incremental,
+            "section": "PCR"},
+    "rf": {"trainer": tm.train_model_rf, "incremental": tm.train_model_rf_incremental,
+           "section": "RF"},
+    "gbm": {"trainer": tm.train_model_gbm, "incremental": tm.train_model_gbm_incremental,
+            "section": "GBM"},
+}
+
+
+def worker_budget(config: Dict, n_models: int) -> Dict[str, int]:
+    '''
+    Split the CPU budget between model processes and estimator threads
+
+    Args:
+        config (Dict): The scheduler config with optional workers and cpu_budget.
+        n_models (int): Number of model chains to run.
+
+    Returns:
+        Dict[str, int]: Number of worker processes and n_jobs for each estimator.
+    '''
+    cpu_budget = config.get("cpu_budget") or os.cpu_count() or 1
+    workers = max(1, min(config.get("workers") or n_models, n_models, cpu_budget))
+    return {"workers": workers, "n_jobs": max(1, cpu_budget // workers)}
+
+
+def share_frame(data: pd.DataFrame, columns: List[str], location: Path) -> Path:
+    '''
+    Write the model columns of a frame as one float32 array that workers memory-map
+
+    Args:
+        data (pd.DataFrame): The train or test frame.
+        columns (List[str]): Feature and response columns to keep.
+        location (Path): The .npy file to write.
+
+    Returns:
+        Path: The written file.
+    '''
+    np.save(location, schema.model_frame(data, columns).to_numpy())
+    return location
+
+
+def load_shared_frame(location: Path, columns: List[str]) -> pd.DataFrame:
+    '''
+    Memory-map a frame written by share_frame without copying it
+
+    Args:
+        location (Path): The .npy file.
+        columns (List[str]): Column names, in the order they were written.
+
+    Returns:
+        pd.DataFrame: A read-only frame backed by the mapped file.
+    '''
+    return pd.DataFrame(np.load(location, mmap_mode="r"), columns=columns, copy=False)
+
+
+def run_chain(name: str, train: pd.DataFrame, test: pd.DataFrame, config: Dict,
+              artifacts: Path) -> Dict:
+    '''
+    Train, save, score and evaluate one model
+
+    The test rows are scored in blocks of score_model.block_rows that are
+    evaluated and written to the scores file as they are predicted.
+
+    Args:
+        name (str): Key of the model in MODELS.
+        train (pd.DataFrame): The training dataset.
+        test (pd.DataFrame): The test dataset.
+        config (Dict): The full pipeline config.
+        artifacts (Path): Directory for the model, scores and metrics files.
+
+    Returns:
+        Dict: The evaluated metrics of the model, with its training time in seconds.
+    '''
+    trainer: Callable = MODELS[name]["trainer"]
+    start = time.perf_counter()
+    model = trainer(train, config["train_model"])
+    train_time = time.perf_counter() - start
+    return _stream_chain(name, model, [test], train_time, config, artifacts)
+
+
+def run_incremental_chain(name: str, train: tm.ChunkSource, test: tm.ChunkSource, config: Dict,
+                          artifacts: Path) -> Dict:
+    '''
+    Train one model chunk by chunk, then score the test chunks one at a time
+
+    Args:
+        name (str): Key of the model in MODELS.
+        train (ChunkSource): Source of training feature chunks.
+        test (ChunkSource): Source of test feature chunks.
+        config (Dict): The full pipeline config.
+        artifacts (Path): Directory for the model, scores and metrics files.
+
+    Returns:
+        Dict: The evaluated metrics of the model, with its training time in seconds.
+    '''
+    trainer: Callable = MODELS[name]["incremental"]
+    start = time.perf_counter()
+    model = trainer(train, config["train_model"])
+    train_time = time.perf_counter() - start
+    return _stream_chain(name, model, test(), train_time, config, artifacts)
+
+
+def _stream_chain(name: str, model, test: Iterable[pd.DataFrame], train_time: float,
+                  config: Dict, artifacts: Path) -> Dict:
+    '''
+    Score the test frames block by block, evaluating and writing each block as it is
+    predicted, then save the model and metrics
+    '''
+    score_config = config["score_model"]
+    evaluator = ep.StreamingEvaluator(score_config.get("segment_columns", []))
+    with sm.ScoreWriter(sm.scores_location(artifacts, name, score_config),
+                        score_config) as writer:
+        for frame in test:
+            for scores in sm.iter_scores(frame, model, score_config):
+                evaluator.update(scores)
+                writer.write(scores)
+    metrics = evaluator.result()
+    del metrics["n"]
+    _add_chain_details(name, metrics, train_time, config)
+
+    tm.save_model(model, artifacts / f"{name}_model_object.joblib")
+    _export_compact(name, model, config, artifacts)
+    ep.save_metrics(metrics, artifacts / f"metrics_{name}.yaml")
+    return metrics
+
+
+def evaluate_chain(name: str, scores: pd.DataFrame, train_time: float, config: Dict) -> Dict:
+    '''
+    Evaluate the scores of one model, adding its training time and GBM engine
+    '''
+    metrics = ep.evaluate_performance(scores, config["score_model"].get("segment_columns", []))
+    _add_chain_details(name, metrics, train_time, config)
+    return metrics
+
+
+def _add_chain_details(name: str, metrics: Dict, train_time: float, config: Dict) -> None:
+    metrics["train_time"] = train_time
+    engine = config["train_model"].get(MODELS[name]["section"], {}).get("engine")
+    if engine is not None:
+        metrics["engine"] = engine
+
+
+def _export_compact(name: str, model, config: Dict, artifacts: Path) -> None:
+    export_config = config.get("export_model", {})
+    if export_config.get("enabled", False):
+        cm.save_compact_model(model, artifacts / f"{name}_model_compact.npz",
+                              export_config.get("compress", False))
+
+
+def save_chain_artifacts(name: str, model, scores: pd.DataFrame, metrics: Dict, config: Dict,
+                         artifacts: Path) -> None:
+    '''
+    Write the model (and its compact export), scores and metrics of one model
+    '''
+    tm.save_model(model, artifacts / f"{name}_model_object.joblib")
+    _export_compact(name, model, config, artifacts)
+    sm.save_scores(scores, sm.scores_location(artifacts, name, config["score_model"]),
+                   config["score_model"])
+    ep.save_metrics(metrics, artifacts / f"metrics_{name}.yaml")
+
+
+def _run_shared_chain(name: str, shared: Dict[str, Path], columns: List[str], config: Dict,
+                      artifacts: Path, n_jobs: int) -> Tuple[Dict, List[Dict]]:
+    '''
+    Worker entry point: map the shared train/test arrays and run one chain
+
+    Returns the chain's metrics and the profile records gathered in the worker.
+    '''
+    profiling.profiler.configure(config.get("profiling"))
+    # Drop records a forked worker inherited from the parent
+    profiling.profiler.collect()
+    with threadpool_limits(limits=n_jobs):
+        train = load_shared_frame(shared["train"], columns)
+        test = load_shared_frame(shared["test"], columns)
+        if "test_segments" in shared:
+            segments = feather.read_table(shared["test_segments"], memory_map=True).to_pandas()
+            test = pd.concat([test, segments], axis=1, copy=False)
+        metrics = run_chain(name, train, test, config, artifacts)
+    return metrics, profiling.profiler.collect()
+
+
+def run_models(train: pd.DataFrame, test: pd.DataFrame, config: Dict,
+               artifacts: Path) -> Dict[str, Dict]:
+    '''
+    Run every model chain, in a process pool when scheduler.parallel is set
+
+    The train and test features are written once to memory-mapped arrays that
+    every worker maps, rather than being pickled to each process.
+
+    Args:
+        train (pd.DataFrame): The training dataset.
+        test (pd.DataFrame): The test dataset.
+        config (Dict): The full pipeline config.
+        artifacts (Path): Directory for the model, scores and metrics files.
+
+    Returns:
+        Dict[str, Dict]: Metrics of each model, keyed by model name.
+    '''
+    scheduler_config = config.get("scheduler", {})
+    parallel = scheduler_config.get("parallel", False)
+    budget = worker_budget(scheduler_config, len(MODELS) if parallel else 1)
+    config = deepcopy(config)
+    for spec in MODELS.values():
+        config["train_model"].setdefault(spec["section"], {})["n_jobs"] = budget["n_jobs"]
+    config["score_model"]["n_jobs"] = budget["n_jobs"]
+
+    if not parallel:
+        return {name: run_chain(name, train, test, config, artifacts) for name in MODELS}
+
+    columns = list(dict.fromkeys(config["train_model"]["features"]
+                                 + config["score_model"]["features"]
+                                 + [config["train_model"]["response"],
+                                    config["score_model"]["response"]]))
+    shared_dir = Path(tempfile.mkdtemp(prefix="delay-shared-"))
+    try:
+        shared = {"train": share_frame(train, columns, shared_dir / "train.npy"),
+                  "test": share_frame(test, columns, shared_dir / "test.npy")}
+        # Non-numeric segment columns such as Airline travel as a dictionary-encoded Arrow file
+        segments = [column for column in config["score_model"].get("segment_columns", [])
+                    if column not in columns]
+        if segments:
+            shared["test_segments"] = shared_dir / "test_segments.arrow"
+            feather.write_feather(
+                pa.Table.from_pandas(test[segments].astype("category"), preserve_index=False),
+                shared["test_segments"], compression="uncompressed")
+        logger.info("Running %d model chains on %d workers with n_jobs=%d",
+                    len(MODELS), budget["workers"], budget["n_jobs"])
+        with ProcessPoolExecutor(max_workers=budget["workers"]) as pool:
+            futures = {name: pool.submit(_run_shared_chain, name, shared, columns, config,
+                                         artifacts, budget["n_jobs"])
+                       for name in MODELS}
+            metrics = {}
+            for name, future in futures.items():
+                metrics[name], records = future.result()
+                profiling.profiler.extend(records)
+            return metrics
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+def run_models_incremental(chunks: tm.ChunkSource, config: Dict,
+                           artifacts: Path) -> Dict[str, Dict]:
+    '''
+    Run every model chain on chunked data, one model at a time so that peak
+    memory stays bounded by the chunk size
+
+    Args:
+        chunks (ChunkSource): Callable returning a fresh iterator of feature chunks.
+        config (Dict): The full pipeline config.
+        artifacts (Path): Directory for the model, scores and metrics files.
+
+    Returns:
+        Dict[str, Dict]: Metrics of each model, keyed by model name.
+    '''
+    incremental_config = config["train_model"].get("incremental", {})
+    train, test = tm.train_test_chunks(chunks, incremental_config.get("test_size", 0.2),
+                                       incremental_config.get("random_state", 42))
+    budget = worker_budget(config.get("scheduler", {}), 1)
+    config = deepcopy(config)
+    for spec in MODELS.values():
+        config["train_model"].setdefault(spec["section"], {})["n_jobs"] = budget["n_jobs"]
+    config["score_model"]["n_jobs"] = budget["n_jobs"]
+    return {name: run_incremental_chain(name, train, test, config, artifacts) for name in MODELS}
@@ -0,0 +1,122 @@
+"""
+This module defines the compact dtypes of the flight table and applies them
+"""
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Parser dtypes of the raw flight table: small integers for calendar fields, float32 for
+# measurements, a bool for Cancelled and categoricals for the text columns
+RAW_DTYPES: Dict[str, str] = {
+    "Quarter": "int8",
+    "Month": "int8",
+    "DayOfWeek": "int8",
+    "dept-elevation_ft": "float32",
+    "arr-elevation_ft": "float32",
+    "Route_Popularity": "float32",
+    "Distance_Final": "float32",
+    "Wind_Speed_mph": "float32",
+    "Wind_Gust_mph": "float32",
+    "Visibility_miles": "float32",
+    "tempF": "float32",
+    "precip_in": "float32",
+    "daily_snow_in": "float32",
+    "DepDelayMinutes": "float32",
+    "Cancelled": "bool",
+    "DepTimeBlk": "category",
+    "Airline": "category",
+    "dept-type": "category",
+    "arr-type": "category",
+}
+
+# Dtypes of the columns generate_features adds; one-hot indicators are bool
+FEATURE_DTYPES: Dict[str, str] = {"dep_time": "int8"}
+
+# Dtype the trainers fit on; tree ensembles bin and split in float32 anyway
+MODEL_DTYPE = np.float32
+
+
+def as_bool(values: pd.Series) -> pd.Series:
+    '''
+    A bool column, also accepting the "True"/"False" strings of unparsed frames
+
+    Args:
+        values (pd.Series): A bool or string column such as Cancelled.
+
+    Returns:
+        pd.Series: The values as bool.
+    '''
+    if values.dtype == bool:
+        return values
+    return values.astype(str).str.lower().eq("true")
+
+
+def apply_schema(data: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Cast the flight table columns present in data to RAW_DTYPES
+
+    Columns that already have their dtype are not copied.
+
+    Args:
+        data (pd.DataFrame): Raw flights, e.g. parsed without dtypes.
+
+    Returns:
+        pd.DataFrame: The flights in the compact dtypes.
+    '''
+    casts = {}
+    for column, dtype in RAW_DTYPES.items():
+        if column not in data.columns or data[column].dtype == dtype:
+            continue
+        casts[column] = as_bool(data[column]) if dtype == "bool" else data[column].astype(dtype)
+    return data.assign(**casts) if casts else data
+
+
+def concat_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Concatenate parsed chunks, keeping categoricals whose chunks saw different categories
+
+    pd.concat falls back to object columns when categories differ, so each
+    categorical column is first given the sorted union of the chunks' categories.
+
+    Args:
+        chunks (List[pd.DataFrame]): Chunks with the same columns.
+
+    Returns:
+        pd.DataFrame: The chunks with a fresh RangeIndex.
+    '''
+    chunks = list(chunks)
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([chunk[column] for chunk in chunks],
+                                            sort_categories=True).categories
+            chunks = [chunk.assign(**{column: chunk[column].cat.set_categories(categories)})
+                      for chunk in chunks]
+    return pd.concat(chunks, ignore_index=True, copy=False)
+
+
+def model_frame(data: pd.DataFrame, columns: Iterable[str],
+                dtype: type = MODEL_DTYPE) -> pd.DataFrame:
+    '''
+    The given columns as one block of a single dtype, as the trainers fit on
+
+    Mixed int8, float32 and bool columns would otherwise be converted to
+    float64 column by column inside every estimator. Frames that already start
+    with the columns in dtype, such as split.FeatureMatrix views, are returned
+    as a view of those columns without a copy.
+
+    Args:
+        data (pd.DataFrame): Feature frame.
+        columns (Iterable[str]): Feature columns, in model order.
+        dtype (type): Dtype of the block; MODEL_DTYPE unless the model needs float64.
+
+    Returns:
+        pd.DataFrame: The features with their names.
+    '''
+    columns = list(columns)
+    head = data.iloc[:, :len(columns)]
+    if list(head.columns) == columns and (head.dtypes == dtype).all():
+        return head
+    return pd.DataFrame(data[columns].to_numpy(dtype=dtype), index=data.index,
+                        columns=columns, copy=False)
@@ -1,13 +1,91 @@
 """
 This module save scores of models
 """
+import copy
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterator, Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import src.compact_model as cm
+import src.profiling as profiling
+import src.schema as schema
 
 logger = logging.getLogger("delay")
 
+# File suffix of each score_model.format
+SCORE_SUFFIXES = {"csv": ".csv", "parquet": ".parquet"}
+
+
+def scores_location(artifacts: Path, name: str, config: Dict) -> Path:
+    '''
+    Path of a model's scores file in the configured format
+
+    Args:
+        artifacts (Path): The artifacts directory.
+        name (str): Model name used in artifact file names.
+        config (Dict): The score_model config.
+
+    Returns:
+        Path: artifacts / scores_<name>.<csv|parquet>.
+    '''
+    return artifacts / f"scores_{name}{SCORE_SUFFIXES[config.get('format', 'csv')]}"
+
+
+def iter_scores(test: pd.DataFrame, tmo, config: Dict) -> Iterator[pd.DataFrame]:
+    """
+    Score the test data in blocks of block_rows rows, predicted in parallel threads.
+
+    Blocks are yielded in order as soon as they are predicted, so callers can
+    evaluate or write them without holding every score at once.
+
+    Args:
+        test (pd.DataFrame): The test dataset.
+        tmo: The trained model object.
+        config (Dict): The score_model config; block_rows and n_jobs set the block
+            size and the number of prediction threads. With engine "compiled",
+            tree ensembles are predicted by compact_model.compile_model.
+
+    Yields:
+        pd.DataFrame: Scores of consecutive blocks of test rows.
+    """
+    block_rows = config.get("block_rows", 500_000)
+    n_jobs = config.get("n_jobs") or 1
+    if n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    # An empty test frame still yields one (empty) block with every score column
+    starts = range(0, len(test), block_rows) or range(1)
+    workers = min(n_jobs, len(starts))
+    # Threads the block pool leaves idle split the trees within each block
+    if config.get("engine", "sklearn") == "compiled":
+        tmo = cm.compile_model(tmo, max(1, n_jobs // workers))
+    elif workers > 1 and "n_jobs" in getattr(tmo, "get_params", dict)(deep=False):
+        # A shallow copy shares the fitted estimators but not their thread count
+        tmo = copy.copy(tmo).set_params(n_jobs=max(1, n_jobs // workers))
+
+    def predict(start: int) -> np.ndarray:
+        block = test.iloc[start:start + block_rows]
+        if block.empty:
+            return np.empty(0)
+        # Rows of a single-block feature frame are views; otherwise one block is gathered
+        return tmo.predict(schema.model_frame(block, config["features"]))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start, ypred in zip(starts, pool.map(predict, starts)):
+            block = test.iloc[start:start + block_rows]
+            scores = pd.DataFrame({"test": block[config["response"]], "pred": ypred})
+            for column in config.get("segment_columns", []):
+                scores[column] = block[column]
+            yield scores
+
+
+@profiling.profiled("score_model.score_model")
 def score_model(test: pd.DataFrame, tmo, config: dict) -> pd.DataFrame:
     """
     Score the model on the test data.
@@ -15,27 +93,80 @@ def score_model(test: pd.DataFrame, tmo, config: dict) -> pd.DataFrame:
     Args:
         test (pd.DataFrame): The test dataset.
         tmo (RandomForestClassifier): The trained model object.
-        config (dict): A dictionary containing configuration parameters.
+        config (dict): A dictionary containing configuration parameters; the optional
+            segment_columns are copied into the scores for per-segment evaluation.
 
     Returns:
         pd.DataFrame: A DataFrame containing the scores.
     """
-    ypred = tmo.predict(test[config["features"]])
-    scores = pd.DataFrame({"test": test[config["response"]], "pred": ypred})
-    return scores
+    profiling.annotate(rows=len(test))
+    blocks = list(iter_scores(test, tmo, config))
+    if len(blocks) == 1:
+        return blocks[0]
+    return pd.concat(blocks)
+
+
+class ScoreWriter:
+    '''
+    Write blocks of scores to one CSV or Parquet file as they arrive
+
+    The format follows the file suffix. Parquet files are compressed with
+    config["compression"] and, with config["float32"], store the predictions
+    as float32.
+    '''
+
+    def __init__(self, location: Path, config: Optional[Dict] = None):
+        self.location = Path(location)
+        self.config = config or {}
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._header = True
+
+    def write(self, scores: pd.DataFrame) -> None:
+        '''
+        Append one block of scores
+        '''
+        if self.location.suffix == ".parquet":
+            if self.config.get("float32", True):
+                scores = scores.astype({"pred": np.float32})
+            table = pa.Table.from_pandas(scores, preserve_index=True)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(
+                    self.location, table.schema,
+                    compression=self.config.get("compression", "zstd"))
+            self._writer.write_table(table)
+        else:
+            scores.to_csv(self.location, mode="w" if self._header else "a", header=self._header)
+        self._header = False
+
+    def close(self) -> None:
+        '''
+        Finish the file
+        '''
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self) -> "ScoreWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
 
-def save_scores(scores: pd.DataFrame, location: Path) -> None:
+@profiling.profiled("score_model.save_scores")
+def save_scores(scores: pd.DataFrame, location: Path, config: Optional[Dict] = None) -> None:
     '''
-    Save scores DataFrame to a CSV file.
+    Save scores DataFrame to a CSV or Parquet file, chosen by the file suffix.
 
     Args:
         scores (pd.DataFrame): The DataFrame containing scores.
-        location (Path): The file path to save the scores CSV.
+        location (Path): The file path to save the scores to.
+        config (Dict): Optional score_model config with compression and float32.
     '''
     try:
-        scores.to_csv(location)
+        with ScoreWriter(location, config) as writer:
+            writer.write(scores)
+        profiling.annotate(bytes_written=Path(location).stat().st_size)
         logger.info("Model scores saved to %s", location)
     except FileNotFoundError as file_error:
         logger.error("File not found error occurred while saving scores: %s", file_error)
-        
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""
+This module splits the feature table into train and test rows of one float32 matrix
+"""
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import GroupKFold, KFold, train_test_split
+
+import src.schema as schema
+
+logger = logging.getLogger("delay")
+
+# Train and test row positions
+Indices = Tuple[np.ndarray, np.ndarray]
+
+
+def random_split(n_rows: int, test_size: float = 0.2, random_state: int = 42) -> Indices:
+    '''
+    Shuffled train and test row positions
+
+    The rows are the ones train_test_split picks for a frame of n_rows rows.
+
+    Args:
+        n_rows (int): Number of rows.
+        test_size (float): Fraction of rows held out for testing.
+        random_state (int): Seed of the shuffle.
+
+    Returns:
+        Indices: The train and the test positions.
+    '''
+    return tuple(train_test_split(np.arange(n_rows), test_size=test_size,
+                                  random_state=random_state))
+
+
+def time_split(data: pd.DataFrame, column: str = "Month", test_from: Optional[int] = None,
+               test_size: float = 0.2) -> Indices:
+    '''
+    Train on earlier periods and test on the later ones
+
+    Args:
+        data (pd.DataFrame): Frame with the period column.
+        column (str): Period column, e.g. Month or Quarter.
+        test_from (int): First test period; by default the latest periods
+            holding about test_size of the rows.
+        test_size (float): Fraction of rows held out when test_from is not given.
+
+    Returns:
+        Indices: The train and the test positions, each in row order.
+    '''
+    periods = data[column].to_numpy()
+    if test_from is None:
+        values, counts = np.unique(periods, return_counts=True)
+        # Latest periods whose rows make up about test_size of the table, at least one
+        in_test = np.cumsum(counts[::-1]) <= test_size * len(periods)
+        test_from = values[::-1][max(in_test.sum(), 1) - 1]
+    is_test = periods >= test_from
+    if is_test.all() or not is_test.any():
+        raise ValueError(f"{column} >= {test_from} leaves no train or no test rows")
+    return np.flatnonzero(~is_test), np.flatnonzero(is_test)
+
+
+def kfold(n_rows: int, n_splits: int = 5, random_state: int = 42) -> Iterator[Indices]:
+    '''
+    Shuffled k-fold train and test row positions
+
+    Args:
+        n_rows (int): Number of rows.
+        n_splits (int): Number of folds.
+        random_state (int): Seed of the shuffle.
+
+    Yields:
+        Indices: The train and the test positions of each fold.
+    '''
+    yield from KFold(n_splits, shuffle=True, random_state=random_state).split(np.empty(n_rows))
+
+
+def time_kfold(data: pd.DataFrame, column: str = "Month", n_splits: int = 4) -> Iterator[Indices]:
+    '''
+    k-fold row positions that hold out whole periods, so no period is on both sides
+
+    Args:
+        data (pd.DataFrame): Frame with the period column.
+        column (str): Period column, e.g. Month or Quarter.
+        n_splits (int): Number of folds; at most the number of periods.
+
+    Yields:
+        Indices: The train and the test positions of each fold.
+    '''
+    periods = data[column].to_numpy()
+    yield from GroupKFold(n_splits).split(np.empty(len(periods)), groups=periods)
+
+
+class FeatureMatrix:
+    '''
+    The model columns of the feature table as one C-contiguous float32 matrix
+
+    Rows are stored train first, then test, so train and test are views of
+    the same buffer rather than copies, and every trainer and score_model
+    read that buffer. Non-numeric columns the scores need, such as the
+    Airline segment, are kept beside the matrix in their own dtype.
+
+    Attributes:
+        values (np.ndarray): The (rows, columns) matrix.
+        columns (List[str]): Matrix column names; features first.
+        index (pd.Index): Original row labels, in matrix order.
+        extras (Dict[str, np.ndarray]): Other columns, in matrix order.
+        n_train (int): Number of train rows at the top of the matrix.
+    '''
+
+    def __init__(self, values: np.ndarray, columns: List[str], index: pd.Index,
+                 extras: Dict[str, np.ndarray], n_train: int):
+        self.values = values
+        self.columns = columns
+        self.index = index
+        self.extras = extras
+        self.n_train = n_train
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, columns: Sequence[str], train_rows: np.ndarray,
+                   test_rows: np.ndarray, extra_columns: Iterable[str] = ()) -> "FeatureMatrix":
+        '''
+        Gather the train then test rows of data column by column into one matrix
+
+        Only one column is converted at a time, so the table is never copied whole.
+
+        Args:
+            data (pd.DataFrame): The feature table.
+            columns (Sequence[str]): Numeric model columns; features first.
+            train_rows (np.ndarray): Positions of the train rows.
+            test_rows (np.ndarray): Positions of the test rows.
+            extra_columns (Iterable[str]): Other columns to carry, e.g. segment columns.
+
+        Returns:
+            FeatureMatrix: The matrix.
+        '''
+        order = np.concatenate([train_rows, test_rows])
+        values = np.empty((len(order), len(columns)), dtype=schema.MODEL_DTYPE)
+        for j, column in enumerate(columns):
+            values[:, j] = data[column].to_numpy()[order]
+        extras = {column: data[column].iloc[order].array for column in extra_columns
+                  if column not in columns}
+        return cls(values, list(columns), data.index[order], extras, len(train_rows))
+
+    def rows(self, positions, extras: bool = False) -> pd.DataFrame:
+        '''
+        A frame of the given matrix rows
+
+        A slice gives a view of the matrix; an array of positions (e.g. a fold)
+        copies just those rows. Without extras the frame is a single float32
+        block, which schema.model_frame and the estimators use without a copy.
+
+        Args:
+            positions (slice or np.ndarray): Matrix rows.
+            extras (bool): Whether to add the extra columns after the model columns.
+
+        Returns:
+            pd.DataFrame: The model columns, then any extra columns.
+        '''
+        frame = pd.DataFrame(self.values[positions], index=self.index[positions],
+                             columns=self.columns, copy=False)
+        if extras:
+            for column, values in self.extras.items():
+                frame[column] = values[positions]
+        return frame
+
+    @property
+    def train(self) -> pd.DataFrame:
+        '''
+        View of the train rows, for the trainers
+        '''
+        return self.rows(slice(0, self.n_train))
+
+    @property
+    def test(self) -> pd.DataFrame:
+        '''
+        View of the test rows with the extra columns, for score_model
+        '''
+        return self.rows(slice(self.n_train, None), extras=True)
+
+    def folds(self, n_splits: int = 5, random_state: int = 42,
+              column: Optional[str] = None) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame]]:
+        '''
+        k-fold train and validation frames of the train rows
+
+        Args:
+            n_splits (int): Number of folds.
+            random_state (int): Seed of the shuffle.
+            column (str): Period column to hold out whole periods of instead of random rows.
+
+        Yields:
+            Tuple[pd.DataFrame, pd.DataFrame]: Train and validation rows of each fold.
+        '''
+        train = self.train
+        splits = (kfold(self.n_train, n_splits, random_state) if column is None
+                  else time_kfold(train, column, n_splits))
+        for fit_rows, validation_rows in splits:
+            yield self.rows(fit_rows), self.rows(validation_rows)
+
+
+def split_data(data: pd.DataFrame, config: Dict) -> FeatureMatrix:
+    '''
+    Split the feature table as configured into one FeatureMatrix
+
+    Args:
+        data (pd.DataFrame): The feature table.
+        config (Dict): The full pipeline config; split holds method ("random" or
+            "time"), test_size, random_state and, for time splits, column and test_from.
+
+    Returns:
+        FeatureMatrix: Train and test rows of the train and score columns, with
+        the score_model segment columns beside them.
+    '''
+    split_config = config.get("split", {})
+    method = split_config.get("method", "random")
+    test_size = split_config.get("test_size", 0.2)
+    if method == "random":
+        train_rows, test_rows = random_split(len(data), test_size,
+                                             split_config.get("random_state", 42))
+    elif method == "time":
+        train_rows, test_rows = time_split(data, split_config.get("column", "Month"),
+                                           split_config.get("test_from"), test_size)
+    else:
+        raise ValueError(f"Unknown split method {method}; expected 'random' or 'time'")
+
+    train_config, score_config = config["train_model"], config["score_model"]
+    columns = list(dict.fromkeys(train_config["features"] + score_config["features"]
+                                 + [train_config["response"], score_config["response"]]))
+    matrix = FeatureMatrix.from_frame(data, columns, train_rows, test_rows,
+                                      score_config.get("segment_columns", []))
+    logger.info("%s split: %d train and %d test rows in a %.0f MB matrix", method,
+                len(train_rows), len(test_rows), matrix.values.nbytes / 1024 ** 2)
+    return matrix
@@ -0,0 +1,134 @@
+"""
+This module generates synthetic flight tables with the schema of the raw flight data
+"""
+import argparse
+from pathlib import Path
+from typing import Iterator, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from src.schema import RAW_DTYPES, apply_schema
+
+AIRLINES = ["Air Wisconsin Airlines Corp", "Alaska Airlines Inc.", "Allegiant Air",
+            "American Airlines Inc.", "Capital Cargo International", "Comair Inc.",
+            "Commutair Aka Champlain Enterprises, Inc.", "Delta Air Lines Inc.",
+            "Endeavor Air Inc.", "Envoy Air", "Frontier Airlines Inc.",
+            "GoJet Airlines, LLC d/b/a United Express", "Horizon Air", "JetBlue Airways",
+            "Mesa Airlines Inc.", "Republic Airlines", "SkyWest Airlines Inc.",
+            "Southwest Airlines Co.", "Spirit Air Lines", "United Air Lines Inc."]
+# Rough market shares of the airlines above
+AIRLINE_WEIGHTS = [1, 5, 2, 14, 1, 1, 1, 13, 3, 4, 3, 1, 1, 4, 3, 4, 11, 18, 3, 7]
+AIRPORT_TYPES = ["closed", "large_airport", "medium_airport", "small_airport"]
+AIRPORT_TYPE_WEIGHTS = [0.01, 0.62, 0.29, 0.08]
+DEP_TIME_BLKS = ["0001-0559"] + [f"{h:02d}00-{h:02d}59" for h in range(6, 24)]
+
+
+def generate_flights(n_rows: int, seed: Union[int, Sequence[int]] = 42) -> pd.DataFrame:
+    '''
+    Generate a raw flight table with the columns of flight_data_2021.csv, as parsed
+    with the schema dtypes
+
+    Weather, calendar and airport columns follow plausible distributions, about
+    2% of flights (more on snowy days) are cancelled with a missing delay, and
+    DepDelayMinutes grows with departure hour, wind, precipitation, snow and
+    low visibility, so the trained models have signal to find.
+
+    Args:
+        n_rows (int): Number of flights.
+        seed (int or Sequence[int]): Seed of the random generator.
+
+    Returns:
+        pd.DataFrame: The flights, with columns in RAW_DTYPES order and dtypes.
+    '''
+    rng = np.random.default_rng(seed)
+    month = rng.integers(1, 13, n_rows)
+    hour_block = rng.choice(len(DEP_TIME_BLKS), n_rows,
+                            p=np.r_[0.04, np.full(len(DEP_TIME_BLKS) - 1, 0.96 / 18)])
+    hour = np.where(hour_block == 0, 5, hour_block + 5)
+
+    wind = rng.gamma(3.0, 3.0, n_rows)
+    temp = 55 - 25 * np.cos((month - 1) / 12 * 2 * np.pi) + rng.normal(0, 10, n_rows)
+    precip = np.where(rng.random(n_rows) < 0.2, rng.exponential(0.1, n_rows), 0.0)
+    snow = np.where((temp < 32) & (rng.random(n_rows) < 0.3), rng.exponential(1.0, n_rows), 0.0)
+    visibility = np.clip(10 - rng.exponential(1.5, n_rows), 0, 10)
+
+    cancelled = rng.random(n_rows) < 0.02 + 0.1 * (snow > 0)
+    delay = rng.exponential(4 + 0.6 * (hour - 5) + 0.5 * wind + 40 * precip + 8 * snow
+                            + 10 * (visibility < 3))
+    delay = np.where(rng.random(n_rows) < 0.6, 0.0, delay)
+
+    data = pd.DataFrame({
+        "Quarter": (month - 1) // 3 + 1,
+        "Month": month,
+        "DayOfWeek": rng.integers(1, 8, n_rows),
+        "dept-elevation_ft": np.clip(rng.gamma(1.2, 700, n_rows), 0, 9000).round(),
+        "arr-elevation_ft": np.clip(rng.gamma(1.2, 700, n_rows), 0, 9000).round(),
+        "Route_Popularity": rng.gamma(2.0, 600, n_rows).round(),
+        "Distance_Final": np.clip(rng.gamma(2.5, 300, n_rows), 30, 5000).round(),
+        "Wind_Speed_mph": wind.round(1),
+        "Wind_Gust_mph": (wind + rng.gamma(2.0, 3.0, n_rows)).round(1),
+        "Visibility_miles": visibility.round(1),
+        "tempF": temp.round(1),
+        "precip_in": precip.round(2),
+        "daily_snow_in": snow.round(1),
+        "DepDelayMinutes": np.where(cancelled, np.nan, delay.round()),
+        "Cancelled": cancelled,
+        "DepTimeBlk": np.array(DEP_TIME_BLKS, dtype=object)[hour_block],
+        "Airline": rng.choice(np.array(AIRLINES, dtype=object), n_rows,
+                              p=np.array(AIRLINE_WEIGHTS) / sum(AIRLINE_WEIGHTS)),
+        "dept-type": rng.choice(np.array(AIRPORT_TYPES, dtype=object), n_rows,
+                                p=AIRPORT_TYPE_WEIGHTS),
+        "arr-type": rng.choice(np.array(AIRPORT_TYPES, dtype=object), n_rows,
+                               p=AIRPORT_TYPE_WEIGHTS),
+    })
+    return apply_schema(data[list(RAW_DTYPES)])
+
+
+def iter_flights(n_rows: int, chunk_rows: int = 1_000_000,
+                 seed: int = 42) -> Iterator[pd.DataFrame]:
+    '''
+    Generate n_rows flights in chunks, each with its own derived seed
+
+    Args:
+        n_rows (int): Total number of flights.
+        chunk_rows (int): Flights per chunk.
+        seed (int): Base seed.
+
+    Yields:
+        pd.DataFrame: Consecutive chunks of flights.
+    '''
+    for i, start in enumerate(range(0, n_rows, chunk_rows)):
+        chunk = generate_flights(min(chunk_rows, n_rows - start), seed=[seed, i])
+        chunk.index += start
+        yield chunk
+
+
+def write_flights_csv(location: Path, n_rows: int, chunk_rows: int = 1_000_000,
+                      seed: int = 42) -> Path:
+    '''
+    Write n_rows synthetic flights to a CSV file, chunk by chunk
+
+    Args:
+        location (Path): The CSV file to write.
+        n_rows (int): Number of flights.
+        chunk_rows (int): Flights generated and written at a time.
+        seed (int): Base seed.
+
+    Returns:
+        Path: The written file.
+    '''
+    with open(location, "w", encoding="utf-8", newline="") as file:
+        for i, chunk in enumerate(iter_flights(n_rows, chunk_rows, seed)):
+            chunk.to_csv(file, header=i == 0, index=False)
+    return location
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic flight data CSV")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--output", default="data/flight_data_synthetic.csv")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    write_flights_csv(Path(args.output), args.rows, seed=args.seed)
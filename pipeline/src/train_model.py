@@ -3,20 +3,28 @@ This module trains the model
 """
 import logging
 from pathlib import Path
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Iterator, Tuple
 
 import joblib
+import numpy as np
 import pandas as pd
 
-from sklearn.decomposition import PCA
-from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
-from sklearn.linear_model import LinearRegression
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.ensemble import (GradientBoostingRegressor, HistGradientBoostingRegressor,
+                              RandomForestRegressor)
+from sklearn.linear_model import LinearRegression, SGDRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import StandardScaler
 
+import src.profiling as profiling
+import src.schema as schema
+
 logger = logging.getLogger("delay")
 
+# Callable returning a fresh iterator over feature chunks, for multi-pass training
+ChunkSource = Callable[[], Iterator[pd.DataFrame]]
+
 def train_test(data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Splits the input DataFrame into training and testing datasets.
@@ -37,6 +45,7 @@ def train_test(data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
     return train, test
 
 
+@profiling.profiled("train_model.train_model_pcr")
 def train_model_pcr(train: pd.DataFrame, config: Dict[str, Any]):
     '''
     Train model using PCR
@@ -51,18 +60,22 @@ def train_model_pcr(train: pd.DataFrame, config: Dict[str, Any]):
     pcr_config = config.get("PCR", {})
     n_components = pcr_config.get("n_components", None)
     svd_solver = pcr_config.get("solver", "auto")
-    x_train = train[config["features"]]
+    n_jobs = pcr_config.get("n_jobs", None)
+    # PCA and least squares keep float64 precision
+    x_train = schema.model_frame(train, config["features"], np.float64)
     y_train = train[config["response"]]
+    profiling.annotate(rows=len(train))
 
     scaler = StandardScaler()
     pca = PCA(n_components=n_components, svd_solver=svd_solver)
-    linear_regression = LinearRegression()
+    linear_regression = LinearRegression(n_jobs=n_jobs)
     pcr = make_pipeline(scaler, pca, linear_regression)
     pcr.fit(x_train, y_train)
     logger.info("PCR model created")
     return pcr
 
 
+@profiling.profiled("train_model.train_model_rf")
 def train_model_rf(train: pd.DataFrame, config: Dict[str, Any]):
     '''
     Train model using RF
@@ -78,20 +91,50 @@ def train_model_rf(train: pd.DataFrame, config: Dict[str, Any]):
     n_estimators = rf_config.get("n_estimators", 100)
     max_depth = rf_config.get("max_depth", None)
     random_state = rf_config.get("random_state", None)
-    x_train = train[config["features"]]
+    n_jobs = rf_config.get("n_jobs", None)
+    x_train = schema.model_frame(train, config["features"])
     y_train = train[config["response"]]
+    profiling.annotate(rows=len(train))
 
     if not isinstance(config["RF"]["n_estimators"], int) or n_estimators <= 0:
         raise ValueError("n_estimators must be a positive integer")
     if not isinstance(config["RF"]["max_depth"], int) or max_depth <= 0:
         raise ValueError("max_depth must be a positive integer")
 
-    rf_model = RandomForestRegressor(n_estimators, max_depth, random_state)
+    rf_model = RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth,
+                                     random_state=random_state, n_jobs=n_jobs)
     rf_model.fit(x_train, y_train)
     logger.info("Random Forest model created")
     return rf_model
 
 
+def _gbm_estimator(gbm_config: Dict[str, Any]):
+    '''
+    Build the unfitted GBM estimator for the configured engine
+    '''
+    engine = gbm_config.get("engine", "exact")
+    n_estimators = gbm_config.get("n_estimators", 100)
+    learning_rate = gbm_config.get("learning_rate", 0.1)
+    max_depth = gbm_config.get("max_depth", 3)
+    random_state = gbm_config.get("random_state", None)
+    if engine == "exact":
+        gbm = GradientBoostingRegressor(n_estimators=n_estimators, learning_rate=learning_rate,
+                                       max_depth=max_depth, random_state=random_state)
+    elif engine == "hist":
+        # Binned, multithreaded booster; n_estimators caps the boosting iterations
+        gbm = HistGradientBoostingRegressor(
+            max_iter=n_estimators, learning_rate=learning_rate, max_depth=max_depth,
+            max_bins=gbm_config.get("max_bins", 255),
+            early_stopping=gbm_config.get("early_stopping", True),
+            validation_fraction=gbm_config.get("validation_fraction", 0.1),
+            n_iter_no_change=gbm_config.get("n_iter_no_change", 10),
+            random_state=random_state)
+    else:
+        raise ValueError(f"Unknown GBM engine {engine}; expected 'exact' or 'hist'")
+    return gbm
+
+
+@profiling.profiled("train_model.train_model_gbm")
 def train_model_gbm(train: pd.DataFrame, config: Dict[str, Any]):
     '''
     Train model using GBM
@@ -105,21 +148,153 @@ def train_model_gbm(train: pd.DataFrame, config: Dict[str, Any]):
     '''
     gbm_config = config.get("GBM", {})
     n_estimators = gbm_config.get("n_estimators", 100)
-    learning_rate = gbm_config.get("learning_rate", 0.1)
     max_depth = gbm_config.get("max_depth", 3)
-    random_state = gbm_config.get("random_state", None)
-    x_train = train[config["features"]]
+    x_train = schema.model_frame(train, config["features"])
     y_train = train[config["response"]]
+    profiling.annotate(rows=len(train))
 
     if not isinstance(config["GBM"]["n_estimators"], int) or n_estimators <= 0:
         raise ValueError("n_estimators must be a positive integer")
     if not isinstance(config["GBM"]["max_depth"], int) or max_depth <= 0:
         raise ValueError("max_depth must be a positive integer")
 
-    gbm = GradientBoostingRegressor(n_estimators=n_estimators, learning_rate=learning_rate,
-                                   max_depth=max_depth, random_state=random_state)
+    gbm = _gbm_estimator(gbm_config)
     gbm.fit(x_train, y_train)
-    logger.info("GBM created")
+    logger.info("GBM created with %s engine", gbm_config.get("engine", "exact"))
+    return gbm
+
+
+def train_test_chunks(chunks: ChunkSource, test_size: float = 0.2,
+                      random_state: int = 42) -> Tuple[ChunkSource, ChunkSource]:
+    '''
+    Split a re-iterable source of feature chunks into train and test sources
+
+    Each chunk is split with a generator seeded by its position, so every pass
+    over the data assigns the same rows to the same side.
+
+    Args:
+        chunks (ChunkSource): Callable returning a fresh iterator of feature chunks.
+        test_size (float): Fraction of rows held out for testing.
+        random_state (int): Seed of the row assignment.
+
+    Returns:
+        Tuple[ChunkSource, ChunkSource]: The train and the test chunk sources.
+    '''
+    def side(test: bool) -> ChunkSource:
+        def source() -> Iterator[pd.DataFrame]:
+            for i, chunk in enumerate(chunks()):
+                in_test = np.random.default_rng([random_state, i]).random(len(chunk)) < test_size
+                yield chunk[in_test if test else ~in_test]
+        return source
+    return side(False), side(True)
+
+
+@profiling.profiled("train_model.train_model_pcr_incremental")
+def train_model_pcr_incremental(chunks: ChunkSource, config: Dict[str, Any]):
+    '''
+    Train PCR chunk by chunk with IncrementalPCA and SGD regression
+
+    The scaler, the PCA and the regression each take their own pass(es) over
+    the chunks, so only one chunk is in memory at a time.
+
+    Args:
+        chunks (ChunkSource): Callable returning a fresh iterator of feature chunks.
+        config (Dict[str, Any]): A dictionary containing the configuration parameters.
+
+    Returns:
+        Trained PCR pipeline
+    '''
+    pcr_config = config.get("PCR", {})
+    incremental_config = config.get("incremental", {})
+    n_components = pcr_config.get("n_components", None)
+    if not isinstance(n_components, int):
+        logger.info("IncrementalPCA needs an integer n_components, got %s; keeping all components",
+                    n_components)
+        n_components = None
+    features = config["features"]
+    min_rows = n_components or len(features)
+
+    scaler = StandardScaler()
+    for chunk in chunks():
+        if len(chunk):
+            scaler.partial_fit(schema.model_frame(chunk, features, np.float64))
+            profiling.annotate(rows=len(chunk))
+
+    pca = IncrementalPCA(n_components=n_components)
+    for chunk in chunks():
+        # Every IncrementalPCA batch needs at least as many rows as components
+        if len(chunk) >= min_rows:
+            pca.partial_fit(scaler.transform(schema.model_frame(chunk, features, np.float64)))
+
+    sgd = SGDRegressor(random_state=incremental_config.get("random_state", None))
+    for _ in range(incremental_config.get("epochs", 3)):
+        for chunk in chunks():
+            if len(chunk):
+                x_chunk = schema.model_frame(chunk, features, np.float64)
+                sgd.partial_fit(pca.transform(scaler.transform(x_chunk)),
+                                chunk[config["response"]])
+
+    pcr = make_pipeline(scaler, pca, sgd)
+    logger.info("Incremental PCR model created")
+    return pcr
+
+
+@profiling.profiled("train_model.train_model_rf_incremental")
+def train_model_rf_incremental(chunks: ChunkSource, config: Dict[str, Any]):
+    '''
+    Train RF as a chunked ensemble: every chunk adds trees_per_chunk trees fit on it
+
+    Args:
+        chunks (ChunkSource): Callable returning a fresh iterator of feature chunks.
+        config (Dict[str, Any]): A dictionary containing the configuration parameters.
+
+    Returns:
+        Trained RF model
+    '''
+    rf_config = config.get("RF", {})
+    trees_per_chunk = config.get("incremental", {}).get("trees_per_chunk", 10)
+    rf_model = RandomForestRegressor(max_depth=rf_config.get("max_depth", None),
+                                     random_state=rf_config.get("random_state", None),
+                                     n_jobs=rf_config.get("n_jobs", None), warm_start=True)
+    n_trees = 0
+    for chunk in chunks():
+        if len(chunk):
+            n_trees += trees_per_chunk
+            rf_model.set_params(n_estimators=n_trees)
+            rf_model.fit(schema.model_frame(chunk, config["features"]),
+                         chunk[config["response"]])
+            profiling.annotate(rows=len(chunk))
+    logger.info("Incremental Random Forest model created with %d trees", n_trees)
+    return rf_model
+
+
+@profiling.profiled("train_model.train_model_gbm_incremental")
+def train_model_gbm_incremental(chunks: ChunkSource, config: Dict[str, Any]):
+    '''
+    Train GBM chunk by chunk: every chunk adds stages_per_chunk boosting stages fit on it
+
+    Args:
+        chunks (ChunkSource): Callable returning a fresh iterator of feature chunks.
+        config (Dict[str, Any]): A dictionary containing the configuration parameters.
+
+    Returns:
+        Trained GBM model
+    '''
+    gbm_config = config.get("GBM", {})
+    stages_per_chunk = config.get("incremental", {}).get("stages_per_chunk", 10)
+    if gbm_config.get("engine", "exact") != "exact":
+        # The hist engine re-bins every fit, which breaks warm starts on new chunks
+        logger.warning("Incremental GBM training uses the exact engine")
+        gbm_config = {**gbm_config, "engine": "exact"}
+    gbm = _gbm_estimator(gbm_config).set_params(warm_start=True)
+    n_stages = 0
+    for chunk in chunks():
+        if len(chunk):
+            n_stages += stages_per_chunk
+            gbm.set_params(n_estimators=n_stages)
+            gbm.fit(schema.model_frame(chunk, config["features"]), chunk[config["response"]])
+            profiling.annotate(rows=len(chunk))
+    logger.info("Incremental GBM created with %d stages", n_stages)
     return gbm
 
 
@@ -141,6 +316,7 @@ def save_data(train: pd.DataFrame, test: pd.DataFrame, location: Path) -> None:
         logger.error("File not found error occurred while saving data: %s", file_error)
 
 
+@profiling.profiled("train_model.save_model")
 def save_model(model, location: Path) -> None:
     '''
     Save trained model
@@ -151,6 +327,7 @@ def save_model(model, location: Path) -> None:
     '''
     try:
         joblib.dump(model, location)
+        profiling.annotate(bytes_written=Path(location).stat().st_size)
         logger.info("Model saved to %s", location)
     except FileNotFoundError as file_error:
         logger.error("File not found error occurred while saving model: %s", file_error)
@@ -0,0 +1,208 @@
+"""
+This module tunes model hyperparameters by successive halving on row subsamples
+"""
+import json
+import logging
+import math
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import ParameterGrid, ParameterSampler, train_test_split
+from threadpoolctl import threadpool_limits
+
+import src.scheduler as sched
+
+logger = logging.getLogger("delay")
+
+
+def candidates(space: Dict[str, List[Any]], n_candidates: int,
+               random_state: int = 42) -> List[Dict[str, Any]]:
+    '''
+    Hyperparameter sets to try: the whole grid, or n_candidates sampled from it
+
+    Args:
+        space (Dict[str, List]): Values to try for each hyperparameter.
+        n_candidates (int): Maximum number of sets.
+        random_state (int): Seed of the sampling.
+
+    Returns:
+        List[Dict]: The hyperparameter sets.
+    '''
+    grid = ParameterGrid(space)
+    if len(grid) <= n_candidates:
+        return list(grid)
+    return list(ParameterSampler(space, n_candidates, random_state=random_state))
+
+
+def halving_schedule(n_candidates: int, n_rows: int, min_rows: int,
+                     eta: int = 3) -> List[Tuple[int, int]]:
+    '''
+    Candidates and training rows of each successive halving rung
+
+    Every rung keeps the best 1/eta of the candidates and gives them eta times
+    the rows, so each rung costs about the same; the last rung trains the
+    remaining candidates on all n_rows rows.
+
+    Args:
+        n_candidates (int): Candidates in the first rung.
+        n_rows (int): Rows available for fitting.
+        min_rows (int): Fewest rows a candidate is trained on.
+        eta (int): Reduction factor between rungs.
+
+    Returns:
+        List[Tuple[int, int]]: (candidates, rows) of each rung.
+    '''
+    if eta < 2:
+        raise ValueError("eta must be at least 2")
+    n_rungs = 1
+    while eta ** (n_rungs - 1) < n_candidates:
+        n_rungs += 1
+    # Fewer rungs when the first would train on less than min_rows
+    while n_rungs > 1 and n_rows // eta ** (n_rungs - 1) < min_rows:
+        n_rungs -= 1
+    return [(math.ceil(n_candidates / eta ** rung), n_rows // eta ** (n_rungs - 1 - rung))
+            for rung in range(n_rungs)]
+
+
+def _fit_candidate(name: str, params: Dict[str, Any], shared: Dict[str, Path],
+                   columns: List[str], rows: int, config: Dict, n_jobs: int) -> Dict[str, Any]:
+    '''
+    Worker entry point: fit one candidate on the first rows of the mapped fit split
+    and score it on the mapped validation split
+    '''
+    train_config = deepcopy(config["train_model"])
+    section = sched.MODELS[name]["section"]
+    train_config[section] = {**train_config.get(section, {}), **params, "n_jobs": n_jobs}
+    with threadpool_limits(limits=n_jobs):
+        fit = sched.load_shared_frame(shared["fit"], columns)
+        validation = sched.load_shared_frame(shared["validation"], columns)
+        start = time.perf_counter()
+        model = sched.MODELS[name]["trainer"](fit.iloc[:rows], train_config)
+        fit_time = time.perf_counter() - start
+        pred = model.predict(validation[train_config["features"]])
+    error = validation[train_config["response"]].to_numpy() - pred
+    return {"fit_time": fit_time, "val_rmse": float(np.sqrt(np.mean(error ** 2)))}
+
+
+def tune_model(name: str, train: pd.DataFrame, config: Dict) -> Tuple[Dict, pd.DataFrame]:
+    '''
+    Pick the hyperparameters of one model by successive halving
+
+    The train split is divided into fit and validation rows that are written
+    once to memory-mapped arrays; every rung's candidates are fit in a process
+    pool on a prefix of the (shuffled) fit rows and ranked by validation RMSE.
+
+    Args:
+        name (str): Key of the model in scheduler.MODELS.
+        train (pd.DataFrame): The training dataset.
+        config (Dict): The full pipeline config; train_model.tuning holds the search.
+
+    Returns:
+        Tuple[Dict, pd.DataFrame]: The model's config section with the winning
+        hyperparameters, and the leaderboard of every fit.
+    '''
+    tuning = config["train_model"]["tuning"]
+    section = sched.MODELS[name]["section"]
+    base = config["train_model"].get(section, {})
+    sets = candidates(tuning["spaces"][section], tuning.get("n_candidates", 9),
+                      tuning.get("random_state", 42))
+    fit, validation = train_test_split(train, test_size=tuning.get("validation_fraction", 0.2),
+                                       random_state=tuning.get("random_state", 42))
+    schedule = halving_schedule(len(sets), len(fit), tuning.get("min_rows", 10_000),
+                                tuning.get("eta", 3))
+    budget = sched.worker_budget({"workers": tuning.get("workers"),
+                                  "cpu_budget": config.get("scheduler", {}).get("cpu_budget")},
+                                 len(sets))
+    columns = list(dict.fromkeys(config["train_model"]["features"]
+                                 + [config["train_model"]["response"]]))
+    logger.info("Tuning %s: %d candidates over rungs %s on %d workers", name, len(sets),
+                [rows for _, rows in schedule], budget["workers"])
+
+    leaderboard = []
+    alive = list(range(len(sets)))
+    shared_dir = Path(tempfile.mkdtemp(prefix="delay-tune-"))
+    try:
+        shared = {"fit": sched.share_frame(fit, columns, shared_dir / "fit.npy"),
+                  "validation": sched.share_frame(validation, columns,
+                                                  shared_dir / "validation.npy")}
+        with ProcessPoolExecutor(max_workers=budget["workers"]) as pool:
+            for rung, (_, rows) in enumerate(schedule):
+                futures = {i: pool.submit(_fit_candidate, name, sets[i], shared, columns, rows,
+                                          config, budget["n_jobs"]) for i in alive}
+                results = []
+                for i, future in futures.items():
+                    result = {"model": name, "candidate": i, "rung": rung, "rows": rows,
+                              **future.result(), "params": json.dumps(sets[i], sort_keys=True)}
+                    results.append(result)
+                leaderboard += results
+                ranked = sorted(results, key=lambda result: result["val_rmse"])
+                keep = schedule[rung + 1][0] if rung + 1 < len(schedule) else 1
+                alive = [result["candidate"] for result in ranked[:keep]]
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+    winner = alive[0]
+    leaderboard = pd.DataFrame(leaderboard)
+    leaderboard["winner"] = (leaderboard["candidate"] == winner) & (
+        leaderboard["rung"] == len(schedule) - 1)
+    logger.info("Tuned %s: %s", name, sets[winner])
+    return {**base, **sets[winner]}, leaderboard
+
+
+def tuned_models(config: Dict) -> List[str]:
+    '''
+    Models with a search space in train_model.tuning, when tuning is enabled
+    '''
+    tuning = config["train_model"].get("tuning", {})
+    if not tuning.get("enabled", False):
+        return []
+    return [name for name, spec in sched.MODELS.items()
+            if tuning.get("spaces", {}).get(spec["section"])]
+
+
+def tune_models(train: pd.DataFrame, config: Dict, artifacts: Path) -> Dict:
+    '''
+    Tune every model with a search space and write leaderboard.csv
+
+    Args:
+        train (pd.DataFrame): The training dataset.
+        config (Dict): The full pipeline config.
+        artifacts (Path): Directory for the leaderboard.
+
+    Returns:
+        Dict: A copy of config whose model sections hold the winning hyperparameters;
+        the chains train those on the full train split and save only that model.
+    '''
+    config = deepcopy(config)
+    leaderboards = []
+    for name in tuned_models(config):
+        section = sched.MODELS[name]["section"]
+        config["train_model"][section], leaderboard = tune_model(name, train, config)
+        leaderboards.append(leaderboard)
+    if leaderboards:
+        save_leaderboard(pd.concat(leaderboards, ignore_index=True), artifacts / "leaderboard.csv")
+    return config
+
+
+def save_leaderboard(leaderboard: pd.DataFrame, location: Path) -> None:
+    '''
+    Save the leaderboard, best validation RMSE of the last rung first for each model
+
+    Args:
+        leaderboard (pd.DataFrame): One row per candidate fit.
+        location (Path): The CSV file to write.
+    '''
+    leaderboard = leaderboard.sort_values(["model", "rung", "val_rmse"],
+                                          ascending=[True, False, True])
+    try:
+        leaderboard.to_csv(location, index=False)
+        logger.info("Tuning leaderboard saved to %s", location)
+    except FileNotFoundError as file_error:
+        logger.error("File not found error occurred while saving leaderboard: %s", file_error)
@@ -0,0 +1,36 @@
+"""
+    Fixtures and sample data shared by the pipeline tests
+    """
+import numpy as np
+import pandas as pd
+import pytest
+
+FEATURES = ["Month", "tempF", "dep_time", "Envoy Air"]
+RESPONSE = "DepDelayMinutes"
+
+@pytest.fixture
+def config():
+    """
+    Small pipeline config for fast training
+    """
+    return {
+        "scheduler": {"parallel": True, "workers": 3, "cpu_budget": 3},
+        "train_model": {
+            "features": FEATURES, "response": RESPONSE,
+            "PCR": {"n_components": 2, "solver": "full"},
+            "RF": {"n_estimators": 5, "max_depth": 3, "random_state": 42},
+            "GBM": {"n_estimators": 5, "learning_rate": 0.1, "max_depth": 3, "random_state": 42}
+        },
+        "score_model": {"features": FEATURES, "response": RESPONSE}
+    }
+
+
+def sample_frame(n_rows, seed):
+    """
+    Random feature frame with a response linear in the features
+    """
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(rng.random((n_rows, len(FEATURES))), columns=FEATURES)
+    data[RESPONSE] = data.to_numpy() @ np.arange(1, len(FEATURES) + 1)
+    data["Airline"] = rng.choice(["Envoy Air", "Horizon Air"], n_rows)
+    return data
@@ -0,0 +1,111 @@
+"""
+    Tests for aws_utils functions
+    """
+import boto3
+import pandas as pd
+import pytest
+import src.aws_utils as aws
+
+moto = pytest.importorskip("moto")
+
+BUCKET = "test-bucket"
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    """
+    Local S3 stand-in with an empty bucket
+    """
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=BUCKET)
+        yield s3_client
+
+
+def test_read_csv_from_s3_stream_matches_download(s3_bucket):
+    """
+    Tests that chunked streaming returns the same frame as the full download
+    """
+    raw = pd.DataFrame({
+        'Month': [1, 2, 3, 4, 5],
+        'Cancelled': ['False', 'True', 'False', 'False', 'False'],
+        'Airline': ['Envoy Air', 'Horizon Air', 'Envoy Air', 'Allegiant Air', 'Horizon Air'],
+        'DepDelayMinutes': [0.0, 12.0, 3.0, 45.0, 7.0],
+        'Unused': ['a', 'b', 'c', 'd', 'e']
+    })
+    s3_bucket.put_object(Bucket=BUCKET, Key="flights.csv", Body=raw.to_csv(index=False))
+    columns = {'Month', 'Cancelled', 'Airline', 'DepDelayMinutes'}
+
+    streamed = aws.read_csv_from_s3(
+        "flights.csv", {"bucket_name": BUCKET, "stream": True, "chunksize": 2}, columns)
+    downloaded = aws.read_csv_from_s3("flights.csv", {"bucket_name": BUCKET}, columns)
+
+    assert list(streamed.columns) == ['Month', 'Cancelled', 'Airline', 'DepDelayMinutes']
+    assert streamed['Cancelled'].tolist() == [False, True, False, False, False]
+    # Chunks with different airlines still concatenate into one categorical
+    assert streamed['Airline'].dtype == 'category'
+    pd.testing.assert_frame_equal(streamed, downloaded)
+
+
+def test_read_csvs_from_s3_concatenates_batch(s3_bucket):
+    """
+    Tests that a batch of keys reads as one frame with a combined fingerprint
+    """
+    for key, airline in (("2021/02.csv", "Horizon Air"), ("2021/01.csv", "Envoy Air")):
+        s3_bucket.put_object(Bucket=BUCKET, Key=key,
+                             Body=f"Month,Airline\n1,{airline}\n2,{airline}\n")
+    config = {"bucket_name": BUCKET}
+
+    data = aws.read_csvs_from_s3(["2021/02.csv", "2021/01.csv"], config)
+    assert data["Airline"].tolist() == ["Envoy Air"] * 2 + ["Horizon Air"] * 2
+    assert data["Airline"].dtype == "category" and data.index.tolist() == [0, 1, 2, 3]
+    assert aws.read_csvs_from_s3("2021/01.csv", config).equals(
+        aws.read_csv_from_s3("2021/01.csv", config))
+
+    assert aws.objects_etag("2021/01.csv", config) == aws.object_etag("2021/01.csv", config)
+    assert (aws.objects_etag(["2021/02.csv", "2021/01.csv"], config)
+            == aws.objects_etag(["2021/01.csv", "2021/02.csv"], config))
+    assert data.equals(aws.read_csvs_from_s3(["2021/01.csv", "2021/02.csv"], config))
+    assert pd.concat(aws.iter_csvs_from_s3(["2021/02.csv", "2021/01.csv"], config))[
+        "Airline"].tolist() == data["Airline"].tolist()
+
+
+def test_upload_artifacts_skips_unchanged(s3_bucket, tmp_path, monkeypatch):
+    """
+    Tests that only new or modified artifacts are uploaded, under the per-run prefix
+    """
+    uploads, pools = [], []
+    make_client = boto3.client
+
+    def counting_client(*args, **kwargs):
+        pools.append(kwargs["config"].max_pool_connections)
+        client = make_client(*args, **kwargs)
+        upload_file = client.upload_file
+
+        def upload(filename, bucket, key, **upload_kwargs):
+            uploads.append(key)
+            return upload_file(filename, bucket, key, **upload_kwargs)
+        client.upload_file = upload
+        return client
+    monkeypatch.setattr(aws.boto3, "client", counting_client)
+
+    artifacts = tmp_path / "1716668429"
+    artifacts.mkdir()
+    (artifacts / "rf_model_object.joblib").write_bytes(b"model" * 1000)
+    (artifacts / "metrics_rf.yaml").write_text("rmse: 1.0\n")
+    config = {"bucket_name": BUCKET, "prefix": "model-artifacts", "per_run_prefix": True}
+
+    first = aws.upload_artifacts(artifacts, config)
+    assert first == [f"s3://{BUCKET}/model-artifacts/1716668429/metrics_rf.yaml",
+                     f"s3://{BUCKET}/model-artifacts/1716668429/rf_model_object.joblib"]
+    assert len(uploads) == 2
+    # Every upload thread's transfer gets its own connections
+    assert pools == [8 * 8]
+
+    (artifacts / "metrics_rf.yaml").write_text("rmse: 0.5\n")
+    assert aws.upload_artifacts(artifacts, config) == first
+    assert uploads[2:] == ["model-artifacts/1716668429/metrics_rf.yaml"]
+    body = s3_bucket.get_object(Bucket=BUCKET, Key="model-artifacts/1716668429/metrics_rf.yaml")
+    assert body["Body"].read() == b"rmse: 0.5\n"
@@ -0,0 +1,156 @@
+"""
+    Tests for compact_model functions
+    """
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.ensemble import (GradientBoostingRegressor, HistGradientBoostingRegressor,
+                              RandomForestRegressor)
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+import src.compact_model as cm
+
+# The web app's copy of the module, built from its own Docker context
+WEB_COPY = Path(__file__).resolve().parents[2] / "web-app" / "src" / "compact_model.py"
+
+@pytest.fixture
+def data():
+    """
+    Random features with missing values and a linear response
+    """
+    rng = np.random.default_rng(0)
+    x_data = pd.DataFrame(rng.random((500, 4)), columns=["Month", "tempF", "dep_time", "precip_in"])
+    y_data = x_data.to_numpy() @ np.array([1.0, 2.0, 3.0, 4.0])
+    return x_data, y_data
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_compact_model_round_trip(data, tmp_path, compress):
+    """
+    Tests that saved and reloaded forests predict exactly like the original
+    """
+    x_data, y_data = data
+    model = RandomForestRegressor(n_estimators=10, max_depth=5, random_state=0).fit(x_data, y_data)
+    cm.save_compact_model(model, tmp_path / "rf.npz", compress=compress)
+    compact = cm.load_compact_model(tmp_path / "rf.npz")
+
+    assert isinstance(compact.arrays["left"], np.memmap) != compress
+    np.testing.assert_array_equal(compact.predict(x_data), model.predict(x_data))
+    # Columns are matched by name, not position
+    np.testing.assert_array_equal(compact.predict(x_data[x_data.columns[::-1]]),
+                                  model.predict(x_data))
+
+
+def test_compact_model_hist_missing_values(data, tmp_path):
+    """
+    Tests that the histogram booster's missing value routing is preserved
+    """
+    x_data, y_data = data
+    x_data = x_data.copy()
+    x_data.iloc[::5, 1] = np.nan
+    model = HistGradientBoostingRegressor(max_iter=20).fit(x_data, y_data)
+    cm.save_compact_model(model, tmp_path / "gbm.npz")
+
+    np.testing.assert_allclose(cm.load_compact_model(tmp_path / "gbm.npz").predict(x_data),
+                               model.predict(x_data))
+
+
+def test_compact_model_rejects_unchecked_sklearn(data, monkeypatch):
+    """
+    Tests that the booster's private attributes are read only on checked releases
+    """
+    x_data, y_data = data
+    model = HistGradientBoostingRegressor(max_iter=5).fit(x_data, y_data)
+    monkeypatch.setattr(cm, "HIST_SKLEARN_VERSIONS", ("0.1.",))
+    with pytest.raises(ValueError, match="supported releases: 0.1.x"):
+        cm.flatten_model(model)
+
+
+def test_web_copy_in_sync():
+    """
+    Tests that the web app's copy differs only in its docstring and logger name
+    """
+    if not WEB_COPY.exists():
+        pytest.skip("web app sources not present")
+
+    def code(source):
+        # Drop the module docstring; the logger names differ by design
+        body = source.split('"""', 2)[2]
+        return body.replace('logging.getLogger("clouds")', 'logging.getLogger("delay")')
+    assert code(WEB_COPY.read_text()) == code(Path(cm.__file__).read_text())
+
+
+def test_compact_model_rejects_wrong_width(data, tmp_path):
+    """
+    Tests for value error on inputs with the wrong number of features
+    """
+    x_data, y_data = data
+    model = RandomForestRegressor(n_estimators=2, random_state=0).fit(x_data, y_data)
+    cm.save_compact_model(model, tmp_path / "rf.npz")
+    with pytest.raises(ValueError, match="Expected 4 features"):
+        cm.load_compact_model(tmp_path / "rf.npz").predict(np.zeros((1, 3)))
+
+
+@pytest.mark.parametrize("n_jobs", [1, 3, -1])
+def test_compiled_trees_match_sklearn_exactly(data, n_jobs, monkeypatch):
+    """
+    Tests that compiled forests and boosters predict bit for bit like scikit-learn
+    """
+    x_data, y_data = data
+    # Several row blocks, and two row blocks split across tree blocks
+    monkeypatch.setattr(cm, "BLOCK_NODES", 1000)
+    for model in (RandomForestRegressor(n_estimators=7, max_depth=6, random_state=0),
+                  GradientBoostingRegressor(n_estimators=20, max_depth=3, random_state=0)):
+        model.fit(x_data, y_data)
+        compiled = cm.compile_model(model, n_jobs)
+        assert isinstance(compiled, cm.CompactModel)
+        np.testing.assert_array_equal(compiled.predict(x_data), model.predict(x_data))
+        for rows in (1, 150):
+            np.testing.assert_array_equal(compiled.predict(x_data.iloc[:rows]),
+                                          model.predict(x_data.iloc[:rows]))
+        assert compiled.predict(x_data.iloc[:0]).shape == (0,)
+
+    linear = LinearRegression().fit(x_data, y_data)
+    assert cm.compile_model(linear) is linear and not cm.compilable(linear)
+
+
+def test_fused_pcr_matches_pipeline(data, tmp_path):
+    """
+    Tests that the fused PCR weights predict like the scaler, PCA and regression steps
+    """
+    x_data, y_data = data
+    x_data = x_data.assign(Month=x_data["Month"] * 12)
+    for pca in (PCA(n_components=3), PCA(n_components=2, whiten=True), IncrementalPCA(3)):
+        model = make_pipeline(StandardScaler(), pca, LinearRegression()).fit(x_data, y_data)
+        weights, intercept = cm.fuse_pcr(model)
+        assert weights.shape == (4,)
+        np.testing.assert_allclose(x_data.to_numpy() @ weights + intercept,
+                                   model.predict(x_data), rtol=1e-10)
+
+    cm.save_compact_model(model, tmp_path / "pcr.npz")
+    compact = cm.load_compact_model(tmp_path / "pcr.npz")
+    assert compact.kind == "linear" and set(compact.arrays) == {"weights", "intercept", "meta"}
+    np.testing.assert_allclose(compact.predict(x_data), model.predict(x_data), rtol=1e-10)
+    np.testing.assert_allclose(cm.compile_model(model).predict(x_data.iloc[:1]),
+                               model.predict(x_data.iloc[:1]), rtol=1e-10)
+
+
+def test_reads_unfused_pcr_files(data):
+    """
+    Tests that version 1 files with separate PCR steps still load and predict
+    """
+    x_data, y_data = data
+    model = make_pipeline(StandardScaler(), PCA(n_components=3), LinearRegression())
+    model.fit(x_data, y_data)
+    scaler, pca, regression = [step for _, step in model.steps]
+    arrays = {"scaler_mean": scaler.mean_, "scaler_scale": scaler.scale_,
+              "pca_mean": pca.mean_, "components": pca.components_,
+              "coef": regression.coef_, "intercept": np.array([regression.intercept_]),
+              "meta": np.array(json.dumps({"version": 1, "kind": "pcr",
+                                           "features": list(x_data.columns)}))}
+    np.testing.assert_allclose(cm.CompactModel(arrays).predict(x_data), model.predict(x_data))
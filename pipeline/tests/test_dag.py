@@ -0,0 +1,128 @@
+"""
+    Tests for the pipeline DAG
+    """
+import threading
+
+import pandas as pd
+import pytest
+import src.aws_utils as aws
+import src.dag as dag
+import src.generate_features as gf
+from tests.conftest import sample_frame
+
+
+class Counter:
+    """
+    Stage function factory recording how often each stage ran
+    """
+    def __init__(self):
+        self.calls = []
+
+    def stage(self, name, func):
+        def run(*inputs):
+            self.calls.append(name)
+            return func(*inputs)
+        return run
+
+
+def diamond(counter, scale=2):
+    """
+    a -> (b, c) -> d, where only b depends on scale
+    """
+    return [
+        dag.Node("a", counter.stage("a", lambda: pd.DataFrame({"x": [1.0, 2.0]})), cache=False),
+        dag.Node("b", counter.stage("b", lambda a: a * scale), inputs=["a"],
+                 params={"scale": scale}),
+        dag.Node("c", counter.stage("c", lambda a: a["x"].sum()), inputs=["a"]),
+        dag.Node("d", counter.stage("d", lambda b, c: b["x"].sum() + c), inputs=["b", "c"]),
+    ]
+
+
+def test_dag_reuses_unchanged_stages(tmp_path):
+    """
+    Tests that a rerun loads stored outputs and a config change reruns only downstream stages
+    """
+    cache_config = {"dir": tmp_path}
+    counter = Counter()
+    assert dag.DAG(diamond(counter), cache_config).run(["d"])["d"] == 9.0
+    assert counter.calls.count("a") == 1 and len(counter.calls) == 4
+
+    counter.calls.clear()
+    assert dag.DAG(diamond(counter), cache_config).run(["d"])["d"] == 9.0
+    assert counter.calls == []
+
+    pipeline = dag.DAG(diamond(counter, scale=3), cache_config)
+    assert pipeline.run(["d"])["d"] == 12.0
+    assert sorted(counter.calls) == ["a", "b", "d"]
+    assert pipeline.status == {"a": "computed", "b": "computed", "c": "cached", "d": "computed"}
+
+
+def test_dag_runs_independent_stages_in_parallel(tmp_path):
+    """
+    Tests that sibling stages run at the same time
+    """
+    barrier = threading.Barrier(2, timeout=10)
+    nodes = [dag.Node("left", barrier.wait, cache=False),
+             dag.Node("right", barrier.wait, cache=False)]
+    dag.DAG(nodes, {"dir": tmp_path}).run(workers=2)
+
+
+def test_dag_rejects_cycles(tmp_path):
+    """
+    Tests that cycles and unknown inputs are reported
+    """
+    with pytest.raises(ValueError, match="cycle"):
+        dag.DAG([dag.Node("a", len, inputs=["b"]), dag.Node("b", len, inputs=["a"])],
+                {"dir": tmp_path})
+    with pytest.raises(ValueError, match="unknown stage"):
+        dag.DAG([dag.Node("a", len, inputs=["z"])], {"dir": tmp_path})
+
+
+def test_pipeline_reruns_only_changed_model(config, tmp_path, monkeypatch):
+    """
+    Tests that changing GBM.learning_rate reruns just the GBM stages
+    """
+    monkeypatch.setattr(aws, "read_csv_from_s3", lambda *args: sample_frame(200, 0))
+    monkeypatch.setattr(aws, "object_etag", lambda *args: "etag-1")
+    monkeypatch.setattr(gf, "generate_features", lambda raw: raw)
+    config.update({"aws": {"upload": False}, "export_model": {"enabled": False}})
+    cache_config = {"dir": tmp_path / "cache"}
+
+    def run(artifacts):
+        artifacts.mkdir()
+        pipeline = dag.DAG(dag.pipeline_nodes(config, artifacts, "flights.csv"), cache_config)
+        metrics = pipeline.run(["upload"], workers=3)["upload"]
+        return pipeline.status, metrics
+
+    status, first = run(tmp_path / "run1")
+    assert set(status.values()) == {"computed"}
+
+    config["train_model"]["GBM"]["learning_rate"] = 0.5
+    status, second = run(tmp_path / "run2")
+    computed = {name for name, state in status.items() if state == "computed"}
+    assert computed == {"train_gbm", "score_gbm", "evaluate_gbm", "save", "upload"}
+    assert second["rf"] == first["rf"]
+    assert second["gbm"]["mae"] != first["gbm"]["mae"]
+    assert (tmp_path / "run2" / "rf_model_object.joblib").exists()
+
+
+def test_tune_stages_share_cpu_budget(config, tmp_path, monkeypatch):
+    """
+    Tests that each tune stage's pool is sized to its share of the CPU budget
+    """
+    config["scheduler"]["cpu_budget"] = 6
+    config.update({"aws": {"upload": False}, "dag": {"workers": 3}})
+    config["train_model"]["tuning"] = {"enabled": True, "workers": 0,
+                                       "spaces": {"GBM": {"learning_rate": [0.1, 0.5]}}}
+    seen = []
+
+    def tune_model(name, train, tune_config):
+        seen.append((tune_config["scheduler"]["cpu_budget"],
+                     tune_config["train_model"]["tuning"]["workers"]))
+        return {}, pd.DataFrame()
+    monkeypatch.setattr(dag.tune, "tune_model", tune_model)
+
+    nodes = {node.name: node for node in dag.pipeline_nodes(config, tmp_path, "flights.csv")}
+    nodes["tune_gbm"].func(type("Split", (), {"train": None}))
+    assert seen == [(2, 2)]
+    assert config["scheduler"]["cpu_budget"] == 6
@@ -51,4 +51,63 @@ def test_evaluate_performance_nan_values():
     # Expect ValueError due to NaN values
     with pytest.raises(ValueError, match="Input scores contain NaN values"):
         ep.evaluate_performance(scores)
-  
\ No newline at end of file
+  
+
+def sample_scores(n_rows, seed):
+    """
+    Random scores with airline and hour segments
+    """
+    rng = np.random.default_rng(seed)
+    test = rng.exponential(15, n_rows)
+    return pd.DataFrame({
+        "test": test, "pred": test + rng.normal(0, 5, n_rows),
+        "Airline": rng.choice(["Envoy Air", "Horizon Air", "JetBlue Airways"], n_rows),
+        "dep_time": rng.integers(5, 24, n_rows)})
+
+
+def test_streaming_evaluator_matches_full_pass():
+    """
+    Tests that chunked and merged accumulators reproduce the in-memory metrics
+    """
+    scores = sample_scores(10_000, 0)
+    expected = ep.evaluate_performance(scores)
+
+    chunked = ep.evaluate_chunks(scores.iloc[i:i + 777] for i in range(0, len(scores), 777))
+    workers = [ep.StreamingEvaluator().update(scores.iloc[:3000]),
+               ep.StreamingEvaluator().update(scores.iloc[3000:])]
+    merged = workers[0].merge(workers[1]).result()
+    for metrics in (chunked, merged):
+        assert metrics["n"] == len(scores)
+        for name in ("mae", "rmse", "r2"):
+            assert metrics[name] == pytest.approx(expected[name], rel=1e-12)
+
+
+def test_streaming_evaluator_segments():
+    """
+    Tests that per-segment metrics equal the metrics of each segment's rows
+    """
+    scores = sample_scores(5000, 1)
+    metrics = ep.evaluate_chunks([scores.iloc[:2500], scores.iloc[2500:]],
+                                 segments=["Airline", "dep_time"])
+    airlines = metrics["segments"]["Airline"]
+    assert sorted(airlines) == ["Envoy Air", "Horizon Air", "JetBlue Airways"]
+    horizon = scores[scores["Airline"] == "Horizon Air"]
+    assert airlines["Horizon Air"]["n"] == len(horizon)
+    assert airlines["Horizon Air"]["r2"] == pytest.approx(
+        r2_score(horizon["test"], horizon["pred"]), rel=1e-12)
+    assert set(metrics["segments"]["dep_time"]) == set(range(5, 24))
+    assert sum(group["n"] for group in metrics["segments"]["dep_time"].values()) == len(scores)
+
+
+def test_streaming_evaluator_errors():
+    """
+    Tests that empty input, NaN chunks and missing segment columns are rejected
+    """
+    with pytest.raises(ValueError, match="Empty data"):
+        ep.evaluate_chunks([])
+    scores = sample_scores(10, 2)
+    scores.loc[3, "pred"] = np.nan
+    with pytest.raises(ValueError, match="NaN"):
+        ep.StreamingEvaluator().update(scores)
+    with pytest.raises(ValueError, match="segment column Month"):
+        ep.StreamingEvaluator(["Month"]).update(sample_scores(10, 2))
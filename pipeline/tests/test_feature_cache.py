@@ -0,0 +1,84 @@
+"""
+    Tests for feature_cache functions
+    """
+import os
+from pathlib import Path
+
+import pandas as pd
+import src.feature_cache as fc
+
+def sample_features():
+    """
+    Small feature frame with a filtered index
+    """
+    return pd.DataFrame({
+        'Month': [1, 3],
+        'dep_time': [10, 18],
+        'Southwest Airlines Co.': [True, False],
+        'DepDelayMinutes': [4.0, 0.0]
+    }, index=[0, 2])
+
+
+def test_feature_cache_round_trip(tmp_path):
+    """
+    Tests that stored features load back unchanged, and that force_rebuild misses
+    """
+    config = {"dir": str(tmp_path)}
+    key = fc.cache_key("s3://bucket/flights.csv@etag", ["Month", "Airline"])
+    assert fc.load_features(key, config) is None
+
+    data = sample_features()
+    fc.store_features(data, key, config)
+    pd.testing.assert_frame_equal(fc.load_features(key, config), data)
+    assert fc.load_features(key, {**config, "force_rebuild": True}) is None
+
+
+def test_feature_cache_key_depends_on_source():
+    """
+    Tests that a changed raw object gives a new key
+    """
+    assert fc.cache_key("etag-1", ["Month"]) != fc.cache_key("etag-2", ["Month"])
+    assert fc.cache_key("etag-1", ["Month", "Airline"]) == fc.cache_key("etag-1", ["Airline", "Month"])
+
+
+def test_code_version_covers_feature_sources_only(monkeypatch):
+    """
+    Tests that the dtypes and raw columns version the cache, but not the S3 upload code
+    """
+    assert fc.FEATURE_SOURCES == (fc.gf, fc.schema, fc.aws.raw_columns)
+    before = fc.code_version()
+    monkeypatch.setattr(fc, "FEATURE_SOURCES", (fc.gf, fc.schema, fc.aws.upload_artifacts))
+    assert fc.code_version() != before
+
+
+def test_store_features_writes_through_own_temp_file(tmp_path, monkeypatch):
+    """
+    Tests that concurrent writers of one key do not share a temporary file
+    """
+    config = {"dir": str(tmp_path)}
+    partials = []
+    write_feather = fc.feather.write_feather
+
+    def record(table, dest, **kwargs):
+        partials.append(Path(dest))
+        write_feather(table, dest, **kwargs)
+    monkeypatch.setattr(fc.feather, "write_feather", record)
+    for _ in range(2):
+        fc.store_features(sample_features(), "key", config)
+    assert partials[0] != partials[1] and partials[0].parent == tmp_path
+    assert [path.name for path in tmp_path.iterdir()] == ["key.arrow"]
+
+
+def test_feature_cache_evicts_old_entries(tmp_path):
+    """
+    Tests eviction by age and by total size
+    """
+    config = {"dir": str(tmp_path)}
+    old = fc.store_features(sample_features(), "old", config)
+    os.utime(old, (0, 0))
+    newer = fc.store_features(sample_features(), "newer", {**config, "max_age_days": 1})
+    assert not old.exists()
+
+    newest = fc.store_features(sample_features(), "newest", {**config, "max_size_gb": 1e-9})
+    assert not newer.exists()
+    assert newest.exists()
@@ -24,7 +24,7 @@ def test_generate_features_happy_path():
         'Airline': ['Southwest Airlines Co.'],
         'dept-type': ['large_airport'],
         'arr-type': ['medium_airport'],
-        'dep_time': [10],
+        'dep_time': pd.Series([10], dtype='int8'),
         'Southwest Airlines Co.': [True],
         'dept-type_ohe_large_airport': [True],
         'arr-type_ohe_medium_airport': [True]
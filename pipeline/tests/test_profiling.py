@@ -0,0 +1,55 @@
+"""
+    Tests for pipeline profiling
+    """
+import json
+import pstats
+
+import pytest
+import src.evaluate_performance as ep
+import src.profiling as profiling
+import src.score_model as sm
+import src.train_model as tm
+from tests.conftest import sample_frame
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    """
+    Fresh process-wide profiler, restored after the test
+    """
+    fresh = profiling.Profiler()
+    monkeypatch.setattr(profiling, "profiler", fresh)
+    return fresh
+
+
+def test_profile_records_stages(config, profiler, tmp_path):
+    """
+    Tests that profiled stages report time, memory, rows and bytes to profile.json
+    """
+    profiler.configure({"enabled": True, "cprofile": True})
+    train, test = sample_frame(200, 0), sample_frame(50, 1)
+    model = tm.train_model_rf(train, config["train_model"])
+    scores = sm.score_model(test, model, config["score_model"])
+    ep.save_metrics(ep.evaluate_performance(scores), tmp_path / "metrics.yaml")
+
+    profile = json.loads(profiler.write(tmp_path).read_text())
+    stages = profile["stages"]
+    assert stages["train_model.train_model_rf"]["rows"] == 200
+    assert stages["score_model.score_model"]["rows"] == 50
+    assert stages["evaluate_performance.evaluate_performance"]["rows"] == 50
+    assert stages["evaluate_performance.save_metrics"]["bytes_written"] == \
+        (tmp_path / "metrics.yaml").stat().st_size
+    record = profile["calls"][0]
+    assert record["wall_s"] > 0 and record["cpu_s"] >= 0 and record["peak_rss_mb"] > 0
+    assert pstats.Stats(str(tmp_path / "profile.prof")).total_calls > 0
+
+
+def test_profile_disabled(config, profiler, tmp_path):
+    """
+    Tests that nothing is recorded or written while profiling is disabled
+    """
+    profiler.configure({"enabled": False})
+    tm.train_model_pcr(sample_frame(50, 0), config["train_model"])
+    assert profiler.records == []
+    assert profiler.write(tmp_path) is None
+    assert not (tmp_path / "profile.json").exists()
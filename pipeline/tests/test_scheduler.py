@@ -0,0 +1,57 @@
+"""
+    Tests for scheduler functions
+    """
+import joblib
+import numpy as np
+import pytest
+import src.compact_model as cm
+import src.scheduler as sched
+from tests.conftest import FEATURES, sample_frame
+
+
+def test_worker_budget_splits_cores():
+    """
+    Tests that estimator threads share the CPU budget across workers
+    """
+    assert sched.worker_budget({"workers": 3, "cpu_budget": 12}, 3) == {"workers": 3, "n_jobs": 4}
+    assert sched.worker_budget({"workers": 8, "cpu_budget": 2}, 3) == {"workers": 2, "n_jobs": 1}
+
+
+def test_run_models_parallel_matches_serial(config, tmp_path):
+    """
+    Tests that the process pool produces the same metrics and artifacts as serial runs
+    """
+    train, test = sample_frame(200, 0), sample_frame(50, 1)
+    config["score_model"]["segment_columns"] = ["Airline", "Month"]
+    (tmp_path / "parallel").mkdir()
+    (tmp_path / "serial").mkdir()
+
+    parallel = sched.run_models(train, test, config, tmp_path / "parallel")
+    config["scheduler"]["parallel"] = False
+    serial = sched.run_models(train, test, config, tmp_path / "serial")
+
+    assert parallel.keys() == serial.keys() == {"pcr", "rf", "gbm"}
+    for name, metrics in serial.items():
+        for metric in ["mae", "rmse", "r2"]:
+            assert parallel[name][metric] == pytest.approx(metrics[metric])
+            assert parallel[name]["segments"]["Airline"]["Horizon Air"][metric] == \
+                pytest.approx(metrics["segments"]["Airline"]["Horizon Air"][metric])
+        assert len(parallel[name]["segments"]["Month"]) == 50
+        assert parallel[name]["train_time"] > 0
+        assert (tmp_path / "parallel" / f"{name}_model_object.joblib").exists()
+        assert (tmp_path / "parallel" / f"metrics_{name}.yaml").exists()
+
+
+def test_run_models_exports_compact_models(config, tmp_path):
+    """
+    Tests that the export stage writes compact models that predict like the originals
+    """
+    config["scheduler"]["parallel"] = False
+    config["export_model"] = {"enabled": True}
+    test = sample_frame(50, 1)
+    sched.run_models(sample_frame(200, 0), test, config, tmp_path)
+
+    for name in ["pcr", "rf", "gbm"]:
+        model = joblib.load(tmp_path / f"{name}_model_object.joblib")
+        compact = cm.load_compact_model(tmp_path / f"{name}_model_compact.npz")
+        np.testing.assert_allclose(compact.predict(test[FEATURES]), model.predict(test[FEATURES]))
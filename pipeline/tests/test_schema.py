@@ -0,0 +1,51 @@
+"""
+    Tests for the flight table schema
+    """
+import numpy as np
+import pandas as pd
+import src.generate_features as gf
+import src.schema as schema
+import src.synthetic_data as sd
+
+
+def test_apply_schema_casts_raw_strings():
+    """
+    Tests that unparsed flights get compact dtypes and a bool Cancelled
+    """
+    flights = sd.generate_flights(5000, seed=2)
+    raw = flights.astype({column: object if dtype in ("bool", "category") else "float64"
+                          for column, dtype in schema.RAW_DTYPES.items()})
+    raw["Cancelled"] = raw["Cancelled"].map({True: "True", False: "False"})
+
+    typed = schema.apply_schema(raw)
+    assert typed.dtypes.astype(str).to_dict() == schema.RAW_DTYPES
+    assert typed["Cancelled"].equals(flights["Cancelled"])
+    assert schema.apply_schema(typed) is typed
+    assert typed.memory_usage(deep=True).sum() * 4 < raw.memory_usage(deep=True).sum()
+    # Feature generation gives the same rows from either representation
+    pd.testing.assert_frame_equal(gf.generate_features(typed)[["dep_time", "Envoy Air"]],
+                                  gf.generate_features(raw)[["dep_time", "Envoy Air"]])
+
+
+def test_concat_chunks_keeps_categoricals():
+    """
+    Tests that chunks with different categories concatenate into one categorical
+    """
+    chunks = [pd.DataFrame({"Airline": pd.Categorical(["Horizon Air"])}),
+              pd.DataFrame({"Airline": pd.Categorical(["Envoy Air", "Allegiant Air"])})]
+    data = schema.concat_chunks(chunks)
+    assert list(data["Airline"].cat.categories) == ["Allegiant Air", "Envoy Air", "Horizon Air"]
+    assert data["Airline"].tolist() == ["Horizon Air", "Envoy Air", "Allegiant Air"]
+    assert data.index.tolist() == [0, 1, 2]
+
+
+def test_model_frame_is_one_float32_block():
+    """
+    Tests that mixed feature dtypes become one named float32 block
+    """
+    data = pd.DataFrame({"Month": np.int8([1, 2]), "tempF": np.float32([3.5, 4.5]),
+                         "Envoy Air": [True, False]})
+    frame = schema.model_frame(data, ["tempF", "Month", "Envoy Air"])
+    assert list(frame.columns) == ["tempF", "Month", "Envoy Air"]
+    assert (frame.dtypes == np.float32).all()
+    assert frame.to_numpy().tolist() == [[3.5, 1.0, 1.0], [4.5, 2.0, 0.0]]
@@ -0,0 +1,86 @@
+"""
+    Tests for score_model functions
+    """
+import numpy as np
+import pandas as pd
+import src.score_model as sm
+import src.train_model as tm
+from tests.conftest import FEATURES, RESPONSE, sample_frame
+
+
+def test_score_blocks_match_single_predict(config):
+    """
+    Tests that blocks predicted on several threads equal one predict call, in order
+    """
+    config["train_model"]["RF"]["n_jobs"] = 3
+    model = tm.train_model_rf(sample_frame(200, 0), config["train_model"])
+    test = sample_frame(1000, 1)
+    config["score_model"].update({"block_rows": 128, "n_jobs": 3,
+                                  "segment_columns": ["Airline"]})
+
+    blocks = list(sm.iter_scores(test, model, config["score_model"]))
+    assert [len(block) for block in blocks] == [128] * 7 + [104]
+    scores = sm.score_model(test, model, config["score_model"])
+    assert scores.index.equals(test.index)
+    # Threaded forests add up their trees in whichever order the threads finish
+    np.testing.assert_allclose(scores["pred"], model.predict(test[FEATURES]), rtol=1e-12)
+    assert (scores["Airline"] == test["Airline"]).all()
+    # Blocks predict on a copy of the forest with its threads split between them
+    assert model.n_jobs == 3
+
+    empty = sm.score_model(test.iloc[:0], model, config["score_model"])
+    assert empty.empty and list(empty.columns) == ["test", "pred", "Airline"]
+
+
+def test_compiled_engine_matches_sklearn(config):
+    """
+    Tests that the compiled engine scores forests and boosters exactly like predict,
+    and PCR through its fused weights up to rounding
+    """
+    test = sample_frame(700, 1)
+    config["score_model"].update({"block_rows": 300, "n_jobs": 2, "engine": "compiled"})
+    for train in (tm.train_model_rf, tm.train_model_gbm):
+        model = train(sample_frame(200, 0), config["train_model"])
+        scores = sm.score_model(test, model, config["score_model"])
+        np.testing.assert_array_equal(scores["pred"], model.predict(test[FEATURES]))
+    model = tm.train_model_pcr(sample_frame(200, 0), config["train_model"])
+    scores = sm.score_model(test, model, config["score_model"])
+    # Scored rows are float32; the fused map evaluates them in float64 like the pipeline would
+    rows = test[FEATURES].astype(np.float32).astype(np.float64)
+    np.testing.assert_allclose(scores["pred"], model.predict(rows), rtol=1e-9)
+
+
+def test_save_scores_parquet_float32(config, tmp_path):
+    """
+    Tests that Parquet scores are written compressed with float32 predictions
+    """
+    model = tm.train_model_rf(sample_frame(200, 0), config["train_model"])
+    scores = sm.score_model(sample_frame(300, 1), model, config["score_model"])
+    score_config = {"format": "parquet", "compression": "zstd", "float32": True}
+    location = sm.scores_location(tmp_path, "rf", score_config)
+    assert location.name == "scores_rf.parquet"
+
+    sm.save_scores(scores, location, score_config)
+    saved = pd.read_parquet(location)
+    assert saved["pred"].dtype == np.float32
+    np.testing.assert_allclose(saved["pred"], scores["pred"], rtol=1e-6)
+    assert saved["test"].equals(scores["test"])
+    assert saved.index.equals(scores.index)
+
+
+def test_score_writer_appends_blocks(tmp_path):
+    """
+    Tests that CSV and Parquet writers keep every block, with one CSV header
+    """
+    blocks = [pd.DataFrame({"test": [1.0, 2.0], "pred": [1.5, 2.5]}, index=[0, 1]),
+              pd.DataFrame({"test": [3.0], "pred": [3.5]}, index=[2])]
+    for suffix in (".csv", ".parquet"):
+        location = tmp_path / f"scores{suffix}"
+        with sm.ScoreWriter(location) as writer:
+            for block in blocks:
+                writer.write(block)
+        saved = (pd.read_csv(location, index_col=0) if suffix == ".csv"
+                 else pd.read_parquet(location))
+        assert saved["test"].tolist() == [1.0, 2.0, 3.0]
+        assert saved.index.tolist() == [0, 1, 2]
+        assert RESPONSE not in saved
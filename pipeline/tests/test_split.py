@@ -0,0 +1,69 @@
+"""
+    Tests for the train/test split and the shared feature matrix
+    """
+import numpy as np
+import pandas as pd
+import pytest
+import src.schema as schema
+import src.score_model as sm
+import src.split as sp
+import src.train_model as tm
+from sklearn.model_selection import train_test_split
+from tests.conftest import FEATURES, RESPONSE, sample_frame
+
+
+def test_split_data_views_one_matrix(config):
+    """
+    Tests that train and test are float32 views of one buffer, with the rows of train_test_split
+    """
+    data = sample_frame(500, 0)
+    config["score_model"]["segment_columns"] = ["Airline", "Month"]
+    matrix = sp.split_data(data, config)
+    train, test = matrix.train, matrix.test
+
+    expected_train, expected_test = train_test_split(data, test_size=0.2, random_state=42)
+    assert train.index.equals(expected_train.index) and test.index.equals(expected_test.index)
+    np.testing.assert_allclose(train[FEATURES], expected_train[FEATURES], rtol=1e-6)
+    assert (test["Airline"] == expected_test["Airline"]).all()
+    assert matrix.values.dtype == np.float32 and matrix.values.flags["C_CONTIGUOUS"]
+    for frame in (train, test):
+        assert np.shares_memory(frame[RESPONSE].to_numpy(), matrix.values)
+    features = schema.model_frame(train, FEATURES)
+    assert np.shares_memory(np.asarray(features), matrix.values)
+
+    model = tm.train_model_rf(train, config["train_model"])
+    scores = sm.score_model(test, model, config["score_model"])
+    assert scores.index.equals(test.index) and list(scores["Airline"]) == list(test["Airline"])
+
+
+def test_time_split_tests_latest_periods():
+    """
+    Tests that time splits hold out the latest months
+    """
+    data = pd.DataFrame({"Month": np.repeat(np.arange(1, 13), 10)})
+    train_rows, test_rows = sp.time_split(data, "Month", test_size=0.2)
+    assert set(data["Month"].iloc[test_rows]) == {11, 12}
+    assert data["Month"].iloc[train_rows].max() == 10
+    train_rows, test_rows = sp.time_split(data, "Month", test_from=7)
+    assert len(test_rows) == 60 and len(train_rows) == 60
+    with pytest.raises(ValueError, match="no train"):
+        sp.time_split(data, "Month", test_from=1)
+
+
+def test_folds_cover_train_rows(config):
+    """
+    Tests that random and period folds partition the train rows
+    """
+    data = sample_frame(300, 1)
+    data["Month"] = np.tile(np.arange(1, 7), 50)
+    matrix = sp.split_data(data, {**config, "split": {"method": "time", "test_from": 6}})
+    assert (matrix.test["Month"] == 6).all()
+
+    for column in (None, "Month"):
+        folds = list(matrix.folds(n_splits=5, column=column))
+        assert len(folds) == 5
+        validation = np.concatenate([fold[1].index for fold in folds])
+        assert sorted(validation) == sorted(matrix.train.index)
+        if column is not None:
+            for fit, held_out in folds:
+                assert set(fit["Month"]).isdisjoint(held_out["Month"])
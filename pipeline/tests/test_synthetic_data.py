@@ -0,0 +1,54 @@
+"""
+    Tests for the synthetic flight data generator
+    """
+import pandas as pd
+import yaml
+import src.aws_utils as aws
+import src.generate_features as gf
+import src.schema as schema
+import src.synthetic_data as sd
+from benchmarks import bench_suite
+
+
+def test_generate_flights_schema():
+    """
+    Tests that synthetic flights have the raw columns and feed generate_features
+    """
+    flights = sd.generate_flights(2000, seed=1)
+    assert list(flights.columns) == list(aws.RAW_DTYPES)
+    assert flights.dtypes.astype(str).to_dict() == schema.RAW_DTYPES
+    assert set(flights['Cancelled']) == {True, False}
+    assert flights.loc[flights['Cancelled'], 'DepDelayMinutes'].isna().all()
+    assert (flights['Quarter'] == (flights['Month'] - 1) // 3 + 1).all()
+
+    with open('config/default-config.yaml', encoding='utf-8') as f:
+        features = yaml.safe_load(f)['train_model']['features']
+    data = gf.generate_features(flights)
+    assert set(features) <= set(data.columns)
+    assert data['DepDelayMinutes'].notna().all()
+
+
+def test_flights_are_reproducible(tmp_path):
+    """
+    Tests that a seed fixes the data and that chunked CSV output round-trips
+    """
+    pd.testing.assert_frame_equal(sd.generate_flights(100, seed=3), sd.generate_flights(100, seed=3))
+    location = sd.write_flights_csv(tmp_path / 'flights.csv', 250, chunk_rows=100, seed=3)
+    written = pd.read_csv(location, dtype=aws.RAW_DTYPES)
+    expected = schema.concat_chunks(list(sd.iter_flights(250, chunk_rows=100, seed=3)))
+    assert len(written) == 250
+    pd.testing.assert_frame_equal(written, expected)
+
+
+def test_bench_suite_runs_every_stage():
+    """
+    Tests that the benchmark harness times every stage at a small scale
+    """
+    with open('config/default-config.yaml', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    config['train_model']['RF']['n_estimators'] = config['train_model']['GBM']['n_estimators'] = 2
+    results = bench_suite.run_scale(500, config, bench_suite.web_encoder(), repeat=1)
+    stages = [row['stage'] for row in results]
+    assert stages[0] == 'generate_features'
+    assert {'train_gbm', 'score_rf', 'evaluate_pcr', 'web_encode_predict_single'} <= set(stages)
+    assert all(row['rows_per_s'] > 0 for row in results)
@@ -0,0 +1,87 @@
+"""
+    Tests for train_model functions
+    """
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+import src.train_model as tm
+
+FEATURES = ["Month", "tempF", "dep_time"]
+
+@pytest.fixture
+def train():
+    """
+    Random training frame with a linear response
+    """
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.random((300, len(FEATURES))), columns=FEATURES)
+    data["DepDelayMinutes"] = data.to_numpy() @ np.array([1.0, 2.0, 3.0])
+    return data
+
+
+def gbm_config(**gbm):
+    """
+    train_model config with the given GBM section
+    """
+    return {"features": FEATURES, "response": "DepDelayMinutes",
+            "GBM": {"n_estimators": 20, "learning_rate": 0.1, "max_depth": 3,
+                    "random_state": 42, **gbm}}
+
+
+def test_train_model_gbm_engines(train):
+    """
+    Tests that the engine key selects the exact or histogram booster
+    """
+    assert isinstance(tm.train_model_gbm(train, gbm_config()), GradientBoostingRegressor)
+    hist = tm.train_model_gbm(train, gbm_config(engine="hist", validation_fraction=0.2,
+                                                n_iter_no_change=2))
+    assert isinstance(hist, HistGradientBoostingRegressor)
+    assert hist.n_iter_ <= 20
+
+
+def test_train_model_gbm_unknown_engine(train):
+    """
+    Tests for value error on an unsupported engine
+    """
+    with pytest.raises(ValueError, match="Unknown GBM engine"):
+        tm.train_model_gbm(train, gbm_config(engine="xgboost"))
+
+
+def chunk_source(data, size):
+    """
+    Re-iterable source over fixed-size chunks of a frame
+    """
+    return lambda: (data.iloc[i:i + size] for i in range(0, len(data), size))
+
+
+def test_train_test_chunks_is_stable(train):
+    """
+    Tests that every pass assigns the same rows to train and test
+    """
+    train_chunks, test_chunks = tm.train_test_chunks(chunk_source(train, 64), test_size=0.25)
+    first = pd.concat(list(test_chunks()))
+    assert first.index.equals(pd.concat(list(test_chunks())).index)
+    assert len(first) + sum(len(chunk) for chunk in train_chunks()) == len(train)
+    assert first.index.intersection(pd.concat(list(train_chunks())).index).empty
+
+
+def test_incremental_trainers_fit_chunks(train):
+    """
+    Tests that the chunked trainers produce models close to the response
+    """
+    config = {**gbm_config(), "PCR": {"n_components": 3},
+              "RF": {"max_depth": 4, "random_state": 42},
+              "incremental": {"epochs": 20, "trees_per_chunk": 5, "stages_per_chunk": 20,
+                              "random_state": 0}}
+    chunks = chunk_source(train, 100)
+    x_train, y_train = train[FEATURES], train["DepDelayMinutes"]
+
+    pcr = tm.train_model_pcr_incremental(chunks, config)
+    rf_model = tm.train_model_rf_incremental(chunks, config)
+    gbm = tm.train_model_gbm_incremental(chunks, config)
+
+    assert len(rf_model.estimators_) == 15
+    assert len(gbm.estimators_) == 60
+    for model in [pcr, rf_model, gbm]:
+        assert np.abs(model.predict(x_train) - y_train).mean() < 0.5
@@ -0,0 +1,54 @@
+"""
+    Tests for tune_model functions
+    """
+import json
+
+import pandas as pd
+import pytest
+import src.tune_model as tune
+from tests.conftest import sample_frame
+
+
+def test_halving_schedule_shrinks_candidates_and_grows_rows():
+    """
+    Tests that every rung keeps 1/eta of the candidates on eta times the rows
+    """
+    assert tune.halving_schedule(9, 90_000, 10_000, 3) == [(9, 10_000), (3, 30_000), (1, 90_000)]
+    # Too few rows for three rungs above min_rows
+    assert tune.halving_schedule(9, 30_000, 10_000, 3) == [(9, 10_000), (3, 30_000)]
+    assert tune.halving_schedule(1, 500, 100, 3) == [(1, 500)]
+    with pytest.raises(ValueError, match="eta"):
+        tune.halving_schedule(9, 1000, 10, 1)
+
+
+def test_tune_models_writes_leaderboard_and_winning_params(config, tmp_path):
+    """
+    Tests that tuning ranks candidates by validation RMSE and returns the winner's params
+    """
+    config["train_model"]["tuning"] = {
+        "enabled": True, "workers": 2, "n_candidates": 4, "eta": 2, "min_rows": 50,
+        "validation_fraction": 0.25, "random_state": 0,
+        "spaces": {"RF": {"max_depth": [1, 6], "n_estimators": [2, 10]}}}
+    tuned = tune.tune_models(sample_frame(800, 0), config, tmp_path)
+
+    leaderboard = pd.read_csv(tmp_path / "leaderboard.csv")
+    assert set(leaderboard["model"]) == {"rf"}
+    assert leaderboard.groupby("rung")["candidate"].count().tolist() == [4, 2, 1]
+    assert leaderboard.groupby("rung")["rows"].first().tolist() == [150, 300, 600]
+    assert (leaderboard["fit_time"] > 0).all()
+    winner = leaderboard[leaderboard["winner"]]
+    assert len(winner) == 1
+    # The last rung's survivors were the best of the rung before
+    second = leaderboard[leaderboard["rung"] == 1].nsmallest(1, "val_rmse")
+    assert second["candidate"].item() == winner["candidate"].item()
+    params = json.loads(winner["params"].item())
+    assert tuned["train_model"]["RF"] == {**config["train_model"]["RF"], **params}
+    assert tuned["train_model"]["GBM"] == config["train_model"]["GBM"]
+
+
+def test_tune_models_disabled_returns_config(config, tmp_path):
+    """
+    Tests that nothing is tuned or written without tuning.enabled
+    """
+    assert tune.tune_models(sample_frame(100, 0), config, tmp_path) == config
+    assert not (tmp_path / "leaderboard.csv").exists()
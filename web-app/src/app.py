@@ -9,7 +9,9 @@ import pandas as pd
 import yaml
 from pathlib import Path
 
-import aws_import as ai
+import encoder
+import model_registry as mr
+import prediction_cache as pc
 
 logging.config.fileConfig("config/logging/local.conf")
 logger = logging.getLogger("clouds")
@@ -32,6 +34,28 @@ with open(args.config, "r", encoding="utf-8") as f:
     else:
         logger.info("Configuration file loaded from %s", args.config)
 
+@st.cache_resource
+def get_encoder(config_path: str) -> encoder.FeatureEncoder:
+    """
+    Build the feature encoder of the config at config_path once per process;
+    reruns and sessions share it.
+    """
+    with open(config_path, "r", encoding="utf-8") as file:
+        return encoder.FeatureEncoder(yaml.load(file, Loader=yaml.FullLoader))
+
+@st.cache_resource
+def get_prediction_cache(bucket_name: str) -> pc.PredictionCache:
+    """
+    Build the prediction cache once per process; it drops a model's entries when
+    the registry loads a new version of it.
+    """
+    cache_config = config.get("prediction_cache", {})
+    cache = pc.PredictionCache(cache_config.get("max_entries", 4096),
+                               cache_config.get("decimals", 6))
+    # Named, so a rebuilt cache replaces the listener of the one it supersedes
+    mr.get_registry(bucket_name).on_load(cache.invalidate, name="prediction_cache")
+    return cache
+
 if config:
     # Set the config for AWS
     aws_config = config["aws"]
@@ -146,17 +170,6 @@ if config:
          "Departure Type": ["Closed", "Large Airport", "Medium Airport", "Small Airport"],
         "Arrival Type": ["Closed", "Large Airport", "Medium Airport", "Small Airport"]
     }
-    # Map user-friendly names to the original feature names
-    categorical_feature_mapping = {
-        "Closed": {"Departure Type": "dept-type_ohe_closed", 
-                   "Arrival Type": "arr-type_ohe_closed"},
-        "Large Airport": {"Departure Type": "dept-type_ohe_large_airport",
-                           "Arrival Type": "arr-type_ohe_large_airport"},
-        "Medium Airport": {"Departure Type": "dept-type_ohe_medium_airport",
-                            "Arrival Type": "arr-type_ohe_medium_airport"},
-        "Small Airport": {"Departure Type": "dept-type_ohe_small_airport",
-                           "Arrival Type": "arr-type_ohe_small_airport"},
-    }
 
     # Streamlit interface
     st.title("Flight Delay Prediction")
@@ -166,35 +179,37 @@ if config:
     model_selection = st.selectbox("Select Model", ["PCR", "Random Forest",
                                                      "Gradient Boosting"])
 
-    @st.cache_data
-    def load_model(bucket_name, object_key):
-        return ai.load_model_from_s3(bucket_name, object_key)
+    feature_encoder = get_encoder(args.config)
 
-    def clear_cache():
-        st.cache_data.clear()
+    # Models live in a process-wide registry shared by all sessions and reruns;
+    # all three are prefetched in the background on the first run
+    compact = aws_config.get("model_format", "joblib") == "compact"
+    model_keys = {
+        "PCR": aws_config['pcr_compact_key' if compact else 'pcr_key'],
+        "Random Forest": aws_config['rf_compact_key' if compact else 'rf_key'],
+        "Gradient Boosting": aws_config['gb_compact_key' if compact else 'gb_key'],
+    }
+    registry_config = aws_config.get("registry", {})
+    registry = mr.get_registry(aws_config["bucket_name"],
+                               max_models=registry_config.get("max_models", 3),
+                               refresh_seconds=registry_config.get("refresh_seconds", 300),
+                               model_dir=aws_config.get("model_dir", "models"))
+    # Repeated what-if queries are answered from the cache without calling the model
+    prediction_cache = get_prediction_cache(aws_config["bucket_name"])
+    if "prefetched" not in st.session_state:
+        registry.prefetch(model_keys.values())
+        st.session_state["prefetched"] = True
 
     if st.button("Load Model"):
-        # Clear cache if the model is changed
-        if "model_version" in st.session_state and st.session_state["model_version"] != model_selection:
-            clear_cache()
-        if model_selection == "PCR":
-            object_key = aws_config['pcr_key']
-        elif model_selection == "Random Forest":
-            object_key = aws_config['rf_key']
-        elif model_selection == "Gradient Boosting":
-            object_key = aws_config['gb_key']
-        # Set the bucket name and model key for s3 load
+        object_key = model_keys[model_selection]
         try:
-            imported_model = load_model(aws_config["bucket_name"], object_key)
-            if imported_model:
-                st.session_state["model"] = imported_model
-                st.session_state["model_version"] = model_selection
-                st.success(f"{model_selection} loaded successfully!")
-                logger.info(f"{model_selection} loaded successfully!")
-            else:
-                st.session_state["model"] = None
-                st.error("Model loaded is None.")
+            registry.get(object_key)
+            st.session_state["model_key"] = object_key
+            st.session_state["model_version"] = model_selection
+            st.success(f"{model_selection} loaded successfully!")
+            logger.info(f"{model_selection} loaded successfully!")
         except ValueError as value_error:
+            st.session_state.pop("model_key", None)
             st.error(f"Failed to load {model_selection}: {value_error}")
             logger.error(f"Failed to load {model_selection}: {value_error}") 
     # Set Text Input title
@@ -208,15 +223,7 @@ if config:
         ) 
     # Date input for extracting Quarter, Month, and DayOfWeek
     date_input = st.date_input("Select Date", 
-        value=st.session_state.get("date_input", pd.to_datetime("2021-01-01")),
-        on_change=clear_cache(),
-        args=("date_input", st.session_state.get("date_input", pd.to_datetime("2021-01-01"))))
-
-    # Extract Quarter, Month, and DayOfWeek from the date input
-    # These will combine into categorical features
-    quarter = (date_input.month - 1) // 3 + 1
-    month = date_input.month
-    day_of_week = date_input.weekday() + 1
+        value=st.session_state.get("date_input", pd.to_datetime("2021-01-01")))
 
     # Create dropdowns for categorical features
     categorical_inputs = {}
@@ -224,46 +231,34 @@ if config:
         categorical_inputs[feature] = st.selectbox(
             feature,
             options=default_categorical_options[feature],
-            index=default_categorical_options[feature].index(st.session_state.get(feature, default_categorical_options[feature][0])),
-            on_change=clear_cache(),
-            args=(feature, st.session_state.get(feature, default_categorical_options[feature][0]))
+            index=default_categorical_options[feature].index(st.session_state.get(feature, default_categorical_options[feature][0]))
         ) 
-    # Add extracted date-related features to inputs
-    numerical_inputs["Quarter"] = quarter
-    numerical_inputs["Month"] = month
-    numerical_inputs["DayOfWeek"] = day_of_week
-
-    # If the raw data requires one-hot encoding again before feeding into the model
-    encoded_inputs = {}
-    for feature in default_categorical_options.keys():
-        if feature in ["Airline", "Departure Type", "Arrival Type"]:
-            if feature == "Airline":
-                for option in default_categorical_options[feature]:
-                    encoded_inputs[f"{option}"] = int(categorical_inputs[feature] == option)
-            else:
-                for option, original_feature in categorical_feature_mapping.items():
-                    encoded_inputs[original_feature[feature]] = int(categorical_inputs[feature] == option)
 
-
-    # Reorder numerical inputs to match the order of the feature names
-    num_order = config["column_order"]["num_features"]
-    numerical_inputs = {key: numerical_inputs[key] for key in num_order}
-    # Combine the numerical and categorical inputs
-    input_features = {**numerical_inputs, **encoded_inputs}
-    input_features = pd.DataFrame(input_features,index=[0])
+    # Encode the raw inputs straight into a feature vector in column_order.features order
+    try:
+        input_features = feature_encoder.encode({**numerical_inputs, **categorical_inputs,
+                                                 "Date": date_input})
+    except ValueError as e:
+        input_features = None
+        st.error(f"Invalid flight details: {e}")
 
     # Dataset
-    st.write(input_features)
+    if input_features is not None:
+        st.write(dict(zip(feature_encoder.features, input_features[0].tolist())))
     # Feature engineering calculations
     if st.button("Make Prediction"):
-        if "model" in st.session_state:
-            try:        
-                # Clear the cache to ensure the latest prediction is shown
-                clear_cache()     
-                # Make predictions
-                pred = ai.make_prediction(st.session_state["model"], input_features)
+        if input_features is None:
+            st.error("Please fix the flight details first.")
+        elif "model_key" in st.session_state:
+            try:
+                # Make predictions with the registry's current version of the model
+                model, etag = registry.get_with_etag(st.session_state["model_key"])
+                pred = prediction_cache.predict(model, st.session_state["model_key"], etag,
+                                                input_features)
                 st.write(f"### Expected Delays: {pred} minutes")
-                logger.info("Prediction completed.")
+                stats = prediction_cache.stats()
+                st.caption(f"Prediction cache: {stats['hits']} hits, {stats['misses']} misses")
+                logger.info("Prediction completed; cache stats %s", stats)
             except ValueError as e:
                 st.error(f"Error making prediction: {e}")
                 logger.error("Error making prediction e %s:", e)
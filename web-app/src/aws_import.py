@@ -3,16 +3,35 @@ Used to import and load models from S3 bucket
 """
 import logging
 import io
+import shutil
+import threading
+import warnings
+import weakref
+from pathlib import Path
 
-from typing import Union, Optional
+from typing import Union, Optional, Tuple
 import numpy as np
 import pandas as pd
 import boto3
 import joblib
+from botocore.exceptions import ClientError
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 
+import compact_model as cm
+
 logger = logging.getLogger("clouds")
+
+# Rows from encoder.FeatureEncoder are plain arrays already in column_order.features
+# order, the order the models were fitted on. Installed once: catch_warnings around
+# each call is not thread-safe, and serve.py predicts on executor threads
+warnings.filterwarnings("ignore", message="X does not have valid feature names",
+                        module="sklearn")
+
+# Tree ensembles and PCR pipelines compiled by make_prediction, kept for as long as their model
+_compiled = weakref.WeakKeyDictionary()
+_compiled_lock = threading.Lock()
+
 def load_model_from_s3(bucket_name:str, object_key:str) -> Optional[Union[RandomForestRegressor, \
                                                                     GradientBoostingRegressor, \
                                                                     LinearRegression, \
@@ -39,23 +58,117 @@ def load_model_from_s3(bucket_name:str, object_key:str) -> Optional[Union[Random
         logger.error(f'Error loading model from S3: {e}')
         return None
 
+def load_compact_model_from_s3(bucket_name:str, object_key:str,
+                               model_dir:str = "models") -> Optional[cm.CompactModel]:
+    """
+    Load a compact (.npz) model exported by the pipeline from an AWS S3 bucket.
+
+    The object is downloaded to model_dir and memory-mapped from there, so
+    loading does not unpickle anything or copy the arrays into memory.
+    Args:
+        bucket_name (str): The S3 bucket holding the model.
+        object_key (str): The key in the S3 bucket where the model is stored.
+        model_dir (str): Local directory the model file is downloaded to.
+    Returns:
+        The loaded compact model, or None if loading fails.
+    """
+    try:
+        s3 = boto3.client('s3', region_name='us-east-2')
+        location = Path(model_dir) / Path(object_key).name
+        location.parent.mkdir(parents=True, exist_ok=True)
+        s3.download_file(bucket_name, object_key, str(location))
+        model = cm.load_compact_model(location)
+        logger.info(f'Compact model {object_key} successfully loaded from {bucket_name}')
+        return model
+    except (ValueError, ClientError) as e:
+        logger.error(f'Error loading compact model from S3: {e}')
+        return None
+
+def load_model_with_etag(bucket_name:str, object_key:str,
+                         model_dir:str = "models") -> Tuple[Optional[object], Optional[str]]:
+    """
+    Load a joblib or compact (.npz) model together with the ETag of the object read.
+
+    Compact models are written to model_dir under a temporary name and then
+    renamed, so models already memory-mapped from an older file stay valid.
+    Args:
+        bucket_name (str): The S3 bucket holding the model.
+        object_key (str): The key in the S3 bucket where the model is stored.
+        model_dir (str): Local directory compact models are downloaded to.
+    Returns:
+        The loaded model and its ETag, or (None, None) if loading fails.
+    """
+    try:
+        s3 = boto3.client('s3', region_name='us-east-2')
+        response = s3.get_object(Bucket=bucket_name, Key=object_key)
+        if object_key.endswith(".npz"):
+            location = Path(model_dir) / Path(object_key).name
+            location.parent.mkdir(parents=True, exist_ok=True)
+            partial = location.with_suffix(".partial")
+            with open(partial, "wb") as file:
+                shutil.copyfileobj(response['Body'], file)
+            partial.replace(location)
+            model = cm.load_compact_model(location)
+        else:
+            model = joblib.load(io.BytesIO(response['Body'].read()))
+        logger.info(f'Model {object_key} ({response["ETag"]}) successfully loaded from {bucket_name}')
+        return model, response['ETag']
+    except (ValueError, ClientError) as e:
+        logger.error(f'Error loading model from S3: {e}')
+        return None, None
+
+def get_etag(bucket_name:str, object_key:str) -> Optional[str]:
+    """
+    Return the current ETag of an S3 object, or None if it cannot be read.
+    """
+    try:
+        s3 = boto3.client('s3', region_name='us-east-2')
+        return s3.head_object(Bucket=bucket_name, Key=object_key)['ETag']
+    except ClientError as e:
+        logger.error(f'Error reading ETag of {object_key}: {e}')
+        return None
+
+def compiled_model(model):
+    """
+    Return the compiled engine of a scikit-learn forest, booster or PCR pipeline,
+    compiling it once.
+
+    Args:
+        model (object): A loaded model.
+    Returns:
+        The compact_model.CompactModel of a supported model, or model itself otherwise.
+    """
+    if not cm.compilable(model):
+        return model
+    with _compiled_lock:
+        compiled = _compiled.get(model)
+        if compiled is None:
+            compiled = _compiled[model] = cm.compile_model(model)
+    return compiled
+
 def make_prediction(model:Optional[Union[RandomForestRegressor, \
                                          GradientBoostingRegressor, \
-                                         LinearRegression]], \
-                    input_data:pd.DataFrame) -> Optional[Union[np.ndarray,\
+                                         LinearRegression, \
+                                         cm.CompactModel]], \
+                    input_data:Union[pd.DataFrame, np.ndarray]) -> Optional[Union[np.ndarray,\
                                                                None]]:
     """
     Make predictions using the given model and input data.
 
+    Random forests and gradient boosting models are predicted by their
+    compiled engine, and PCR by its fused weight vector (see compiled_model).
+    Both give the same predictions with far less overhead per call.
+
     Args:
         model (object): The machine learning model to use for predictions.
-        input_data (pd.DataFrame): The input data for making predictions.
+        input_data (pd.DataFrame or np.ndarray): The input data for making predictions,
+            in column_order.features order.
 
     Returns:
         np.ndarray: The predictions made by the model.
     """
     try:
-        res = model.predict(input_data)
+        res = compiled_model(model).predict(input_data)
         return res
     except ValueError as e:
         logger.error(f'Error making prediction: {e}')
@@ -0,0 +1,166 @@
+"""
+Score a file of upcoming flights in vectorized blocks and write the predictions as Parquet
+"""
+import argparse
+import logging
+import logging.config
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+import boto3
+import joblib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import yaml
+
+import aws_import as ai
+import compact_model as cm
+import encoder
+
+logger = logging.getLogger("clouds")
+
+# Model choice on the command line, with its joblib and compact config keys
+MODEL_KEYS = {"pcr": ("pcr_key", "pcr_compact_key"),
+              "rf": ("rf_key", "rf_compact_key"),
+              "gbm": ("gb_key", "gb_compact_key")}
+
+
+def split_s3_uri(uri: str) -> Tuple[str, str]:
+    """
+    Split an s3://bucket/key URI into bucket and key.
+    """
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def read_blocks(source: str, block_size: int,
+                dtype: Optional[Dict[str, str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Read a CSV or Parquet file, local or on S3, in blocks of rows.
+
+    CSV objects on S3 are streamed into the parser; Parquet objects are
+    downloaded first because the reader needs to seek.
+
+    Args:
+        source (str): Local path or s3:// URI of a .csv or .parquet file.
+        block_size (int): Rows per block.
+        dtype (Dict[str, str]): Dtypes of CSV columns, so every block reads them
+            alike instead of inferring them block by block.
+
+    Yields:
+        pd.DataFrame: Consecutive blocks of the file.
+    """
+    s3 = boto3.client('s3', region_name='us-east-2')
+    if source.endswith(".parquet"):
+        with tempfile.TemporaryDirectory() as tmp:
+            if source.startswith("s3://"):
+                location = str(Path(tmp) / "input.parquet")
+                s3.download_file(*split_s3_uri(source), location)
+            else:
+                location = source
+            for batch in pq.ParquetFile(location).iter_batches(batch_size=block_size):
+                yield batch.to_pandas()
+        return
+    if source.startswith("s3://"):
+        bucket, key = split_s3_uri(source)
+        source = s3.get_object(Bucket=bucket, Key=key)['Body']
+    with pd.read_csv(source, chunksize=block_size, dtype=dtype) as reader:
+        yield from reader
+
+
+def load_model(model_name: str, config: Dict, model_path: str = None):
+    """
+    Load the selected model from a local file or from the configured S3 key.
+
+    Args:
+        model_name (str): One of "pcr", "rf" or "gbm".
+        config (Dict): The web app config.
+        model_path (str): Optional local .joblib or .npz file to use instead of S3.
+
+    Returns:
+        The loaded model.
+    """
+    if model_path is not None:
+        if model_path.endswith(".npz"):
+            return cm.load_compact_model(Path(model_path))
+        return joblib.load(model_path)
+    aws_config = config["aws"]
+    joblib_key, compact_key = MODEL_KEYS[model_name]
+    if aws_config.get("model_format", "joblib") == "compact":
+        model = ai.load_compact_model_from_s3(aws_config["bucket_name"], aws_config[compact_key],
+                                              aws_config.get("model_dir", "models"))
+    else:
+        model = ai.load_model_from_s3(aws_config["bucket_name"], aws_config[joblib_key])
+    if model is None:
+        raise ValueError(f"Failed to load model {model_name}")
+    return model
+
+
+def score_file(source: str, output: str, model, config: Dict) -> int:
+    """
+    Encode and score every flight in source, writing inputs plus predictions to output.
+
+    Args:
+        source (str): Local path or s3:// URI of a .csv or .parquet file of flights.
+        output (str): Local path or s3:// URI of the Parquet file to write.
+        model: The loaded model.
+        config (Dict): The web app config.
+
+    Returns:
+        int: Number of flights scored.
+
+    Raises:
+        ValueError: When source holds no flights or the model fails on a block.
+    """
+    batch_config = config.get("batch_predict", {})
+    block_size = batch_config.get("block_size", 50000)
+    column = batch_config.get("prediction_column", "predicted_delay_minutes")
+    feature_encoder = encoder.FeatureEncoder(config)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        location = str(Path(tmp) / "predictions.parquet") if output.startswith("s3://") else output
+        writer = None
+        n_rows = 0
+        try:
+            for block in read_blocks(source, block_size, feature_encoder.input_dtypes):
+                if block.empty:
+                    continue
+                pred = ai.make_prediction(model, feature_encoder.encode_frame(block))
+                if pred is None:
+                    raise ValueError(f"Prediction failed for rows {n_rows}-{n_rows + len(block)}")
+                block[column] = pred.astype("float32")
+                table = pa.Table.from_pandas(block, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(location, table.schema,
+                                              compression=batch_config.get("compression", "zstd"))
+                else:
+                    # Columns the encoder does not read are still inferred block by block
+                    table = table.cast(writer.schema)
+                writer.write_table(table)
+                n_rows += len(block)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            raise ValueError(f"No flights to score in {source}")
+        if output.startswith("s3://"):
+            boto3.client('s3', region_name='us-east-2').upload_file(location, *split_s3_uri(output))
+    logger.info("Scored %d flights from %s into %s", n_rows, source, output)
+    return n_rows
+
+
+if __name__ == "__main__":
+    logging.config.fileConfig("config/logging/local.conf")
+    parser = argparse.ArgumentParser(description="Score a file of upcoming flights")
+    parser.add_argument("--config", default="config/config.yaml", help="Path to configuration file")
+    parser.add_argument("--input", required=True, help="Local path or s3:// URI of a CSV/Parquet file")
+    parser.add_argument("--output", required=True, help="Local path or s3:// URI of the Parquet output")
+    parser.add_argument("--model", choices=sorted(MODEL_KEYS), default="rf")
+    parser.add_argument("--model-path", help="Local .joblib or .npz model instead of S3")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    score_file(args.input, args.output, load_model(args.model, config, args.model_path), config)
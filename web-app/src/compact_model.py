@@ -0,0 +1,411 @@
+"""
+This module exports trained models to a compact, array-backed format and loads them
+
+A copy of pipeline/src/compact_model.py, which writes these files; the web app
+is built from its own Docker context, so keep the two in sync.
+"""
+import json
+import logging
+import os
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("clouds")
+
+# Version 2 stores PCR as one fused weight vector; version 1 files are still read
+FORMAT_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+
+# (tree, row) pairs walked together; keeps a block's node indices in cache
+BLOCK_NODES = 1 << 16
+
+# Models compile_model turns into a CompactModel, besides the PCR pipeline
+TREE_MODELS = ("RandomForestRegressor", "GradientBoostingRegressor",
+               "HistGradientBoostingRegressor")
+
+# scikit-learn releases whose private HistGradientBoostingRegressor attributes
+# (_predictors and _baseline_prediction) flatten_model was checked against
+HIST_SKLEARN_VERSIONS = ("1.2.",)
+
+
+def fuse_pcr(model) -> Tuple[np.ndarray, float]:
+    '''
+    Fold a StandardScaler -> PCA -> linear regression pipeline into one affine map
+
+    With v = components.T @ coef, the pipeline predicts
+    ((x - scaler_mean) / scaler_scale - pca_mean) @ v + intercept, which is
+    x @ (v / scaler_scale) plus a constant.
+
+    Args:
+        model: A trained PCR pipeline, e.g. from train_model_pcr or
+            train_model_pcr_incremental.
+
+    Returns:
+        Tuple[np.ndarray, float]: The weight of each input feature and the intercept.
+    '''
+    scaler, pca, regression = [step for _, step in model.steps]
+    components = pca.components_
+    if getattr(pca, "whiten", False):
+        components = components / np.sqrt(pca.explained_variance_)[:, None]
+    through = components.T @ np.ravel(regression.coef_)
+    mean = scaler.mean_ if scaler.with_mean else 0.0
+    scale = scaler.scale_ if scaler.with_std else 1.0
+    weights = (through / scale).astype(np.float64)
+    intercept = (float(np.ravel(regression.intercept_)[0])
+                 - float((mean / scale + pca.mean_) @ through))
+    return weights, intercept
+
+
+def is_pcr(model) -> bool:
+    '''
+    Whether model is a scaler, PCA and linear regression pipeline that fuse_pcr can fold
+    '''
+    if type(model).__name__ != "Pipeline" or len(model.steps) != 3:
+        return False
+    scaler, pca, regression = [step for _, step in model.steps]
+    return (type(scaler).__name__ == "StandardScaler"
+            and type(pca).__name__ in ("PCA", "IncrementalPCA")
+            and hasattr(regression, "coef_"))
+
+
+def flatten_model(model) -> Dict[str, np.ndarray]:
+    '''
+    Flatten a trained model into plain arrays
+
+    Tree ensembles (RandomForestRegressor, GradientBoostingRegressor and
+    HistGradientBoostingRegressor) become concatenated node arrays with one root
+    offset per tree; leaves have left == -1. The PCR pipeline is fused by
+    fuse_pcr into one weight vector and intercept.
+
+    Args:
+        model: The trained model.
+
+    Returns:
+        Dict[str, np.ndarray]: The model arrays, with a JSON "meta" entry.
+    '''
+    meta = {"version": FORMAT_VERSION,
+            "features": [str(name) for name in getattr(model, "feature_names_in_", [])]}
+    name = type(model).__name__
+    if is_pcr(model):
+        weights, intercept = fuse_pcr(model)
+        arrays = {"weights": weights, "intercept": np.array([intercept])}
+        meta["kind"] = "linear"
+    elif name == "RandomForestRegressor":
+        arrays = _flatten_trees([_sklearn_tree(tree.tree_, 1.0) for tree in model.estimators_])
+        meta.update(kind="trees", aggregate="mean", baseline=0.0, x_dtype="float32")
+    elif name == "GradientBoostingRegressor":
+        arrays = _flatten_trees([_sklearn_tree(tree.tree_, model.learning_rate)
+                                 for tree in model.estimators_[:, 0]])
+        baseline = float(np.ravel(model.init_.constant_)[0])
+        meta.update(kind="trees", aggregate="sum", baseline=baseline, x_dtype="float32")
+    elif name == "HistGradientBoostingRegressor":
+        predictors, baseline = _hist_internals(model)
+        arrays = _flatten_trees([_hist_tree(tree[0].nodes) for tree in predictors])
+        baseline = float(np.ravel(baseline)[0])
+        meta.update(kind="trees", aggregate="sum", baseline=baseline, x_dtype="float64")
+    else:
+        raise ValueError(f"Unsupported model type {name}")
+    arrays["meta"] = np.array(json.dumps(meta))
+    return arrays
+
+
+def _hist_internals(model):
+    # The trees and baseline of a HistGradientBoostingRegressor are private
+    # attributes, so their layout is only trusted on the checked releases
+    version = metadata.version("scikit-learn")
+    if (not version.startswith(HIST_SKLEARN_VERSIONS) or not hasattr(model, "_predictors")
+            or not hasattr(model, "_baseline_prediction")):
+        raise ValueError(f"Cannot flatten HistGradientBoostingRegressor of scikit-learn "
+                         f"{version}; supported releases: "
+                         f"{', '.join(release + 'x' for release in HIST_SKLEARN_VERSIONS)}")
+    return model._predictors, model._baseline_prediction
+
+
+def _sklearn_tree(tree, scale: float) -> Dict[str, np.ndarray]:
+    # sklearn evaluates float32 features against float64 thresholds
+    return {"left": tree.children_left, "right": tree.children_right,
+            "feature": tree.feature, "threshold": tree.threshold,
+            "value": tree.value[:, 0, 0] * scale,
+            "missing_left": np.zeros(tree.node_count, dtype=np.uint8)}
+
+
+def _hist_tree(nodes: np.ndarray) -> Dict[str, np.ndarray]:
+    is_leaf = nodes["is_leaf"].astype(bool)
+    return {"left": np.where(is_leaf, -1, nodes["left"]),
+            "right": np.where(is_leaf, -1, nodes["right"]),
+            "feature": nodes["feature_idx"], "threshold": nodes["num_threshold"],
+            "value": nodes["value"], "missing_left": nodes["missing_go_to_left"]}
+
+
+def _flatten_trees(trees) -> Dict[str, np.ndarray]:
+    sizes = np.array([len(tree["left"]) for tree in trees])
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+
+    def children(key):
+        return np.concatenate([np.where(tree[key] >= 0, tree[key] + root, -1)
+                               for tree, root in zip(trees, roots)]).astype(np.int32)
+    return {"roots": roots, "left": children("left"), "right": children("right"),
+            "feature": np.concatenate([tree["feature"] for tree in trees]).astype(np.int32),
+            "threshold": np.concatenate([tree["threshold"] for tree in trees]).astype(np.float64),
+            "value": np.concatenate([tree["value"] for tree in trees]).astype(np.float64),
+            "missing_left": np.concatenate([tree["missing_left"]
+                                            for tree in trees]).astype(np.uint8)}
+
+
+def save_compact_model(model, location: Path, compress: bool = False) -> None:
+    '''
+    Save a trained model in the compact .npz format
+
+    Args:
+        model: The trained model.
+        location (Path): The .npz file to write.
+        compress (bool): Deflate the arrays; compressed files cannot be memory-mapped.
+    '''
+    arrays = flatten_model(model)
+    try:
+        with open(location, "wb") as file:
+            (np.savez_compressed if compress else np.savez)(file, **arrays)
+        logger.info("Compact model saved to %s", location)
+    except FileNotFoundError as file_error:
+        logger.error("File not found error occurred while saving compact model: %s", file_error)
+
+
+def compile_model(model, n_jobs: int = 1):
+    '''
+    Compile a trained tree ensemble or PCR pipeline into an in-memory CompactModel
+
+    A compiled tree ensemble predicts the same values as model.predict, but
+    walks all trees over a block of rows at once instead of calling each
+    tree. A compiled PCR pipeline is one dot product per row, equal to the
+    pipeline's predictions up to float64 rounding.
+
+    Args:
+        model: The trained model.
+        n_jobs (int): Prediction threads; -1 uses every core.
+
+    Returns:
+        The CompactModel, or model itself if it is not a supported model.
+    '''
+    if not compilable(model):
+        return model
+    return CompactModel(flatten_model(model), n_jobs)
+
+
+def compilable(model) -> bool:
+    '''
+    Whether compile_model turns model into a CompactModel
+    '''
+    return type(model).__name__ in TREE_MODELS or is_pcr(model)
+
+
+def _mmap_npz(location: Path) -> Optional[Dict[str, np.ndarray]]:
+    '''
+    Memory-map every member of an uncompressed .npz; None if any member is compressed
+    '''
+    arrays = {}
+    with zipfile.ZipFile(location) as archive, open(location, "rb") as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                return None
+            # Skip the zip local file header to reach the .npy payload
+            file.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", file.read(4))
+            file.seek(name_length + extra_length, 1)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            arrays[info.filename[:-len(".npy")]] = np.memmap(
+                location, dtype=dtype, mode="r", offset=file.tell(), shape=shape,
+                order="F" if fortran_order else "C")
+    return arrays
+
+
+def load_compact_model(location: Path, mmap: bool = True) -> "CompactModel":
+    '''
+    Load a model saved by save_compact_model
+
+    Args:
+        location (Path): The .npz file.
+        mmap (bool): Memory-map the arrays of uncompressed files instead of reading them.
+
+    Returns:
+        CompactModel: The loaded model.
+    '''
+    arrays = _mmap_npz(location) if mmap else None
+    if arrays is None:
+        with np.load(location, allow_pickle=False) as archive:
+            arrays = {key: archive[key] for key in archive.files}
+    return CompactModel(arrays)
+
+
+class CompactModel:
+    '''
+    Predictor over the arrays produced by flatten_model
+
+    Args:
+        arrays (Dict[str, np.ndarray]): The model arrays.
+        n_jobs (int): Prediction threads; -1 uses every core.
+    '''
+
+    def __init__(self, arrays: Dict[str, np.ndarray], n_jobs: int = 1):
+        self.arrays = arrays
+        self.meta = json.loads(str(arrays["meta"][()]))
+        if self.meta["version"] not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported compact model version {self.meta['version']}")
+        self.kind = self.meta["kind"]
+        self.feature_names_in_ = np.array(self.meta["features"], dtype=object)
+        self.n_jobs = n_jobs
+        if self.kind == "trees":
+            self._compile()
+
+    def _compile(self) -> None:
+        '''
+        Lay the node arrays out for a traversal that takes the same steps for every row
+
+        Leaves become nodes that lead to themselves, so every row takes as many
+        steps as the deepest tree without checking which rows reached a leaf.
+        The children of node i are stored at 2 * i (right) and 2 * i + 1 (left),
+        so a step is one lookup indexed by the comparison result.
+        '''
+        arrays = self.arrays
+        left, right = np.asarray(arrays["left"]), np.asarray(arrays["right"])
+        leaf = left < 0
+        own = np.arange(len(left), dtype=np.intp)
+        self._children = np.stack([np.where(leaf, own, right),
+                                   np.where(leaf, own, left)], axis=1).ravel().astype(np.intp)
+        self._feature = np.where(leaf, 0, arrays["feature"]).astype(np.intp)
+        # NaN compares False, so a missing value in a leaf also stays there
+        self._threshold = np.where(leaf, np.inf, arrays["threshold"])
+        missing_left = (np.asarray(arrays["missing_left"]) == 1) & ~leaf
+        self._missing_left = missing_left if missing_left.any() else None
+        self._roots = np.asarray(arrays["roots"], dtype=np.intp)
+        self._value = np.asarray(arrays["value"])
+
+        self._depth = 0
+        frontier = self._roots
+        while True:
+            frontier = frontier[~leaf[frontier]]
+            if not len(frontier):
+                break
+            frontier = np.concatenate([left[frontier], right[frontier]])
+            self._depth += 1
+
+    def _as_array(self, x_data, dtype) -> np.ndarray:
+        if (isinstance(x_data, pd.DataFrame) and len(self.feature_names_in_)
+                and list(x_data.columns) != self.meta["features"]):
+            x_data = x_data[list(self.feature_names_in_)]
+        x_data = np.ascontiguousarray(x_data, dtype=dtype)
+        if x_data.ndim != 2 or x_data.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got shape {x_data.shape}")
+        return x_data
+
+    @property
+    def n_features(self) -> int:
+        '''
+        Number of input features
+        '''
+        if self.kind == "pcr":
+            return len(self.arrays["scaler_mean"])
+        if self.kind == "linear":
+            return len(self.arrays["weights"])
+        if len(self.feature_names_in_):
+            return len(self.feature_names_in_)
+        return int(np.max(self.arrays["feature"])) + 1
+
+    def predict(self, x_data, n_jobs: Optional[int] = None) -> np.ndarray:
+        '''
+        Predict the response for every row of x_data
+
+        Tree models are walked in blocks of rows on n_jobs threads.
+        Batches with fewer row blocks than threads are also split into blocks
+        of trees, so every thread has work; batches smaller than one block run
+        on the calling thread. Trees are always summed in order, so the result
+        does not depend on n_jobs.
+
+        Args:
+            x_data (pd.DataFrame or np.ndarray): Rows of input features.
+            n_jobs (int): Prediction threads; by default the model's n_jobs.
+
+        Returns:
+            np.ndarray: The predictions.
+        '''
+        if self.kind == "linear":
+            x_data = self._as_array(x_data, np.float64)
+            return x_data @ self.arrays["weights"] + self.arrays["intercept"][0]
+        if self.kind == "pcr":
+            # Version 1 files store the PCR steps unfused
+            arrays = self.arrays
+            x_data = self._as_array(x_data, np.float64)
+            scaled = (x_data - arrays["scaler_mean"]) / arrays["scaler_scale"]
+            projected = (scaled - arrays["pca_mean"]) @ arrays["components"].T
+            return projected @ arrays["coef"] + arrays["intercept"][0]
+        x_data = self._as_array(x_data, self.meta["x_dtype"])
+        n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        if n_jobs < 0:
+            n_jobs = os.cpu_count() or 1
+        block_rows = max(1, BLOCK_NODES // len(self._roots))
+        blocks = [x_data[start:start + block_rows] for start in range(0, len(x_data), block_rows)]
+        n_splits = min(len(self._roots), -(-n_jobs // max(len(blocks), 1)))
+        if len(x_data) * len(self._roots) < BLOCK_NODES:
+            # Too little work to pay for threads, e.g. a single row
+            n_splits = n_jobs = 1
+        if n_splits <= 1:
+            parts = self._map(lambda block: self._aggregate(self._leaves(block)), blocks, n_jobs)
+        else:
+            trees = [slice(split[0], split[-1] + 1)
+                     for split in np.array_split(np.arange(len(self._roots)), n_splits)]
+            leaves = self._map(lambda task: self._leaves(*task),
+                               [(block, tree_block) for block in blocks for tree_block in trees],
+                               n_jobs)
+            parts = [self._aggregate(np.vstack(leaves[i:i + n_splits]))
+                     for i in range(0, len(leaves), n_splits)]
+        return np.concatenate(parts or [np.empty(0)])
+
+    @staticmethod
+    def _map(func, tasks, n_jobs: int) -> list:
+        if n_jobs <= 1 or len(tasks) <= 1:
+            return [func(task) for task in tasks]
+        # NumPy releases the GIL in the gathers and comparisons of each step
+        with ThreadPoolExecutor(max_workers=min(n_jobs, len(tasks))) as pool:
+            return list(pool.map(func, tasks))
+
+    def _leaves(self, x_block: np.ndarray, trees: slice = slice(None)) -> np.ndarray:
+        '''
+        Walk the given trees for a block of rows at once, one depth level per step
+
+        Returns:
+            np.ndarray: (trees, rows) leaf values.
+        '''
+        # Feature j of row i is x_flat[i * n_features + j]
+        offsets = np.arange(len(x_block)) * x_block.shape[1]
+        x_flat = x_block.ravel()
+        roots = self._roots[trees]
+        node = np.repeat(roots[:, None], len(x_block), axis=1)
+        for _ in range(self._depth):
+            values = x_flat[offsets + self._feature[node]]
+            go_left = values <= self._threshold[node]
+            if self._missing_left is not None:
+                go_left |= np.isnan(values) & self._missing_left[node]
+            node = self._children[2 * node + go_left]
+        return self._value[node]
+
+    def _aggregate(self, leaves: np.ndarray) -> np.ndarray:
+        '''
+        Combine (trees, rows) leaf values, accumulating trees in order as scikit-learn does
+        '''
+        total = np.full(leaves.shape[1], 0.0 if self.meta["aggregate"] == "mean"
+                        else self.meta["baseline"])
+        for tree_leaves in leaves:
+            total += tree_leaves
+        if self.meta["aggregate"] == "mean":
+            total /= len(leaves)
+        return total
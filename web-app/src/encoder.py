@@ -0,0 +1,158 @@
+"""
+Encode raw flight inputs into model feature matrices
+"""
+import datetime
+import logging
+from typing import Dict, Iterable, Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("clouds")
+
+# Calendar features derived from the flight date
+DATE_FEATURES = ["Quarter", "Month", "DayOfWeek"]
+
+
+class FeatureEncoder:
+    """
+    Encode raw flights into feature vectors in column_order.features order.
+
+    All column positions are resolved once from the config, so encoding a
+    flight only writes its values into a NumPy row; no DataFrame is built.
+    A raw flight holds the numerical features by name, the categorical inputs
+    ("Airline", "Departure Type", "Arrival Type") with the app's option labels,
+    and either a "Date" or Quarter, Month and DayOfWeek.
+    """
+
+    def __init__(self, config: Dict):
+        self.features = list(config["column_order"]["features"])
+        position = {feature: i for i, feature in enumerate(self.features)}
+        self.date_positions = [position[feature] for feature in DATE_FEATURES]
+        self.numerical = [(feature, position[feature])
+                          for feature in config["column_order"]["num_features"]
+                          if feature not in DATE_FEATURES]
+        mapping = config["mappings"]["categorical_feature_mapping"]
+        self.categorical = {}
+        for feature in config["features"]["categorical_features"]:
+            if feature == "Airline":
+                self.categorical[feature] = {
+                    option: position[option]
+                    for option in config["default_values"]["categorical"][feature]}
+            else:
+                self.categorical[feature] = {option: position[names[feature]]
+                                             for option, names in mapping.items()}
+
+    @property
+    def n_features(self) -> int:
+        return len(self.features)
+
+    @property
+    def input_dtypes(self) -> Dict[str, str]:
+        """
+        Dtypes of the raw input columns, for readers that would otherwise infer them.
+        """
+        dtypes = {feature: "float64" for feature in DATE_FEATURES}
+        dtypes.update((feature, "float64") for feature, _ in self.numerical)
+        dtypes.update((feature, "str") for feature in ["Date", *self.categorical])
+        return dtypes
+
+    def encode(self, flight: Mapping, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Encode one raw flight.
+
+        Args:
+            flight (Mapping): Raw inputs of one flight; numbers may be given as strings.
+            out (np.ndarray): Optional float vector of n_features to write into.
+
+        Returns:
+            np.ndarray: Feature matrix of shape (1, features), or out when given.
+        """
+        vector = np.zeros((1, self.n_features)) if out is None else out
+        row = vector.reshape(-1)
+        row[:] = 0.0
+        if all(feature in flight for feature in DATE_FEATURES):
+            values = [flight[feature] for feature in DATE_FEATURES]
+        elif "Date" in flight:
+            date = flight["Date"]
+            if not isinstance(date, datetime.date):
+                date = pd.Timestamp(date)
+            values = [(date.month - 1) // 3 + 1, date.month, date.weekday() + 1]
+        else:
+            raise ValueError("Missing input Date or Quarter, Month and DayOfWeek")
+        for index, value in zip(self.date_positions, values):
+            row[index] = value
+        for feature, index in self.numerical:
+            try:
+                row[index] = float(flight[feature])
+            except KeyError:
+                raise ValueError(f"Missing input column {feature}") from None
+            except (TypeError, ValueError):
+                raise ValueError(f"{feature} must be a number, got {flight[feature]!r}") from None
+        for feature, columns in self.categorical.items():
+            if feature not in flight:
+                raise ValueError(f"Missing input column {feature}")
+            index = columns.get(flight[feature])
+            if index is None:
+                raise ValueError(f"Unknown {feature} values: {[flight[feature]]}")
+            row[index] = 1.0
+        return vector
+
+    def encode_records(self, flights: Iterable[Mapping]) -> np.ndarray:
+        """
+        Encode a list of raw flights row by row into one matrix.
+        """
+        flights = list(flights)
+        matrix = np.empty((len(flights), self.n_features))
+        for i, flight in enumerate(flights):
+            self.encode(flight, out=matrix[i])
+        return matrix
+
+    def encode_frame(self, frame: pd.DataFrame) -> np.ndarray:
+        """
+        Encode a frame of raw flights column by column.
+
+        Args:
+            frame (pd.DataFrame): Raw flights, one per row.
+
+        Returns:
+            np.ndarray: Float matrix of shape (rows, features).
+        """
+        matrix = np.zeros((len(frame), self.n_features), dtype=np.float64)
+        if set(DATE_FEATURES) <= set(frame.columns):
+            for feature, index in zip(DATE_FEATURES, self.date_positions):
+                matrix[:, index] = frame[feature].to_numpy(dtype=np.float64)
+        elif "Date" in frame.columns:
+            dates = pd.to_datetime(frame["Date"])
+            for values, index in zip([dates.dt.quarter, dates.dt.month, dates.dt.weekday + 1],
+                                     self.date_positions):
+                matrix[:, index] = values
+        else:
+            raise ValueError("Missing input Date or Quarter, Month and DayOfWeek")
+        for feature, index in self.numerical:
+            if feature not in frame.columns:
+                raise ValueError(f"Missing input column {feature}")
+            matrix[:, index] = frame[feature].to_numpy(dtype=np.float64)
+
+        rows = np.arange(len(frame))
+        for feature, columns in self.categorical.items():
+            indices = frame[feature].map(columns)
+            if indices.isna().any():
+                unknown = sorted(frame.loc[indices.isna(), feature].astype(str).unique())
+                raise ValueError(f"Unknown {feature} values: {unknown}")
+            matrix[rows, indices.to_numpy(dtype=np.int64)] = 1.0
+        return matrix
+
+
+def encode_frame(frame: pd.DataFrame, config: Dict) -> np.ndarray:
+    """
+    Encode a frame of raw flights into a feature matrix in column_order.features order.
+
+    Args:
+        frame (pd.DataFrame): Raw flights, one per row.
+        config (Dict): The web app config.
+
+    Returns:
+        np.ndarray: Float matrix of shape (rows, features).
+    """
+    return FeatureEncoder(config).encode_frame(frame)
@@ -0,0 +1,64 @@
+"""
+Load test the prediction service: p50/p99 latency and throughput under concurrent clients
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+import aiohttp
+import numpy as np
+
+# One flight in the raw input format of the service
+SAMPLE_FLIGHT = {
+    "Date": "2021-01-01", "dept-elevation_ft": 107.0, "arr-elevation_ft": 607.0,
+    "Route_Popularity": 2526, "Distance_Final": 754.0, "Wind_Speed_mph": 9.0,
+    "Wind_Gust_mph": 14.0, "Visibility_miles": 3.0, "tempF": 46.0, "precip_in": 0.0,
+    "daily_snow_in": 0.0, "dep_time": 9, "Airline": "Envoy Air",
+    "Departure Type": "Large Airport", "Arrival Type": "Medium Airport",
+}
+
+
+async def client(session: aiohttp.ClientSession, url: str, payload, n_requests: int,
+                 latencies: List[float]) -> None:
+    """
+    Send n_requests requests one after another, recording each latency.
+    """
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        async with session.post(url, json=payload) as response:
+            response.raise_for_status()
+            await response.read()
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(url: str, concurrency: int, n_requests: int, batch_size: int) -> dict:
+    """
+    Run concurrency clients sharing n_requests requests and summarize the latencies.
+    """
+    payload = SAMPLE_FLIGHT if batch_size == 1 else [SAMPLE_FLIGHT] * batch_size
+    latencies: List[float] = []
+    per_client = max(1, n_requests // concurrency)
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[client(session, url, payload, per_client, latencies)
+                               for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    latency_ms = np.array(latencies) * 1000
+    return {"requests": len(latencies), "concurrency": concurrency, "batch_size": batch_size,
+            "p50_ms": float(np.percentile(latency_ms, 50)),
+            "p99_ms": float(np.percentile(latency_ms, 99)),
+            "requests_per_s": len(latencies) / elapsed,
+            "rows_per_s": len(latencies) * batch_size / elapsed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the prediction service")
+    parser.add_argument("--url", default="http://localhost:8080/predict/rf")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=1, help="Flights per request")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.url, args.concurrency, args.requests,
+                                     args.batch_size)), indent=2))
@@ -0,0 +1,202 @@
+"""
+Process-wide registry of loaded models, shared by every Streamlit session and rerun
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+import aws_import as ai
+
+logger = logging.getLogger("clouds")
+
+
+@dataclass
+class Entry:
+    """
+    A loaded model with the ETag it was loaded from and when that ETag was last checked.
+    """
+    model: object
+    etag: str
+    checked_at: float
+
+
+class ModelRegistry:
+    """
+    LRU cache of loaded models keyed by S3 object key.
+
+    Models are returned from memory without any S3 call. Once an entry is older
+    than refresh_seconds, the next lookup starts a background ETag check, and
+    the model is reloaded in the background only if the object changed.
+    """
+
+    def __init__(self, bucket_name: str, max_models: int = 3, refresh_seconds: float = 300,
+                 model_dir: str = "models",
+                 loader: Optional[Callable[..., Tuple[object, Optional[str]]]] = None,
+                 etag_reader: Optional[Callable[[str, str], Optional[str]]] = None):
+        self.bucket_name = bucket_name
+        self.max_models = max_models
+        self.refresh_seconds = refresh_seconds
+        self.model_dir = model_dir
+        self._loader = loader or ai.load_model_with_etag
+        self._etag_reader = etag_reader or ai.get_etag
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per key, so concurrent misses on the same key load it once
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._refreshing = set()
+        self._listeners: Dict[Hashable, Callable[[str, str], None]] = {}
+
+    def _key_lock(self, object_key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(object_key, threading.Lock())
+
+    def _store(self, object_key: str, model, etag: str) -> Entry:
+        with self._lock:
+            entry = self._entries[object_key] = Entry(model, etag, time.monotonic())
+            self._entries.move_to_end(object_key)
+            while len(self._entries) > self.max_models:
+                evicted, _ = self._entries.popitem(last=False)
+                logger.info("Evicted model %s from registry", evicted)
+            listeners = list(self._listeners.values())
+        for listener in listeners:
+            listener(object_key, etag)
+        return entry
+
+    def _load(self, object_key: str) -> Entry:
+        model, etag = self._loader(self.bucket_name, object_key, self.model_dir)
+        if model is None:
+            raise ValueError(f"Failed to load model {object_key}")
+        return self._store(object_key, model, etag)
+
+    def on_load(self, listener: Callable[[str, str], None],
+                name: Optional[Hashable] = None) -> None:
+        """
+        Call listener(object_key, etag) whenever a model is loaded or reloaded.
+
+        Args:
+            listener (Callable[[str, str], None]): E.g. PredictionCache.invalidate.
+            name (Hashable): Replaces the listener registered under the same name,
+                e.g. the invalidate of a cache that has since been rebuilt. The
+                listener itself by default.
+        """
+        with self._lock:
+            self._listeners[listener if name is None else name] = listener
+
+    def off_load(self, name: Hashable) -> None:
+        """
+        Stop calling the listener registered under name (or the listener itself).
+        """
+        with self._lock:
+            self._listeners.pop(name, None)
+
+    def get(self, object_key: str):
+        """
+        Return the model stored at object_key, loading it on the first request.
+
+        Args:
+            object_key (str): The key in the S3 bucket where the model is stored.
+
+        Returns:
+            The loaded model.
+        """
+        return self.get_with_etag(object_key)[0]
+
+    def get_with_etag(self, object_key: str) -> Tuple[object, str]:
+        """
+        Return the model stored at object_key together with the ETag it was loaded from.
+
+        The pair always belongs to the same version, even while a reload runs.
+
+        Args:
+            object_key (str): The key in the S3 bucket where the model is stored.
+
+        Returns:
+            Tuple[object, str]: The loaded model and its ETag.
+        """
+        with self._lock:
+            entry = self._entries.get(object_key)
+            if entry is not None:
+                self._entries.move_to_end(object_key)
+                if (time.monotonic() - entry.checked_at > self.refresh_seconds
+                        and object_key not in self._refreshing):
+                    self._refreshing.add(object_key)
+                    threading.Thread(target=self._refresh, args=(object_key,), daemon=True).start()
+                return entry.model, entry.etag
+        with self._key_lock(object_key):
+            with self._lock:
+                entry = self._entries.get(object_key)
+            if entry is None:
+                entry = self._load(object_key)
+            return entry.model, entry.etag
+
+    def etag(self, object_key: str) -> Optional[str]:
+        """
+        ETag of the loaded version of object_key, or None if it is not loaded.
+        """
+        with self._lock:
+            entry = self._entries.get(object_key)
+            return None if entry is None else entry.etag
+
+    def _refresh(self, object_key: str) -> None:
+        """
+        Reload object_key if its ETag changed, otherwise just mark it as checked.
+        """
+        try:
+            etag = self._etag_reader(self.bucket_name, object_key)
+            with self._lock:
+                entry = self._entries.get(object_key)
+                if entry is not None and (etag is None or etag == entry.etag):
+                    entry.checked_at = time.monotonic()
+                    return
+            logger.info("Model %s changed in S3; reloading", object_key)
+            with self._key_lock(object_key):
+                self._load(object_key)
+        except ValueError as value_error:
+            logger.error("Failed to refresh model %s: %s", object_key, value_error)
+        finally:
+            with self._lock:
+                self._refreshing.discard(object_key)
+
+    def prefetch(self, object_keys: Iterable[str]) -> threading.Thread:
+        """
+        Load every key that is not loaded yet on a background thread.
+
+        Args:
+            object_keys (Iterable[str]): Keys to load.
+
+        Returns:
+            threading.Thread: The started loader thread.
+        """
+        def load_all():
+            for object_key in object_keys:
+                try:
+                    self.get(object_key)
+                except ValueError as value_error:
+                    logger.error("Failed to prefetch model %s: %s", object_key, value_error)
+        thread = threading.Thread(target=load_all, daemon=True)
+        thread.start()
+        return thread
+
+
+_registries: Dict[str, ModelRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(bucket_name: str, **kwargs) -> ModelRegistry:
+    """
+    Return the process-wide registry for bucket_name, creating it on first use.
+
+    Args:
+        bucket_name (str): The S3 bucket holding the models.
+        **kwargs: ModelRegistry options, used only when the registry is created.
+
+    Returns:
+        ModelRegistry: The shared registry.
+    """
+    with _registries_lock:
+        if bucket_name not in _registries:
+            _registries[bucket_name] = ModelRegistry(bucket_name, **kwargs)
+        return _registries[bucket_name]
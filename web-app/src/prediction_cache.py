@@ -0,0 +1,120 @@
+"""
+Process-wide LRU cache of predictions, keyed by model version and feature vector
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+import aws_import as ai
+
+logger = logging.getLogger("clouds")
+
+
+class PredictionCache:
+    """
+    LRU cache of single-row predictions.
+
+    Entries are keyed by the model's S3 key and ETag and the row's canonical
+    feature bytes, so a repeated what-if query is answered without touching
+    the model and a reloaded model never serves stale predictions. Rows are
+    keyed by their values rounded to decimals places, so inputs such as "46"
+    and "46.0" share an entry, but the model always predicts the rows as given.
+    """
+
+    def __init__(self, max_entries: int = 4096, decimals: int = 6):
+        self.max_entries = max_entries
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, Optional[str], bytes], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def canonical(self, features) -> np.ndarray:
+        """
+        Rows of features as rounded float64, with -0.0 folded into 0.0.
+        """
+        rows = np.atleast_2d(np.asarray(features, dtype=np.float64))
+        return np.round(rows, self.decimals) + 0.0
+
+    def predict(self, model, object_key: str, etag: Optional[str], features,
+                predictor: Optional[Callable] = None) -> Optional[np.ndarray]:
+        """
+        Predict every row of features, calling the model only for rows not cached.
+
+        Args:
+            model (object): The model to predict uncached rows with.
+            object_key (str): The key the model was loaded from.
+            etag (str): The ETag of the loaded version of the model.
+            features (np.ndarray): Encoded rows in column_order.features order.
+            predictor (Callable): Function of (model, rows) returning predictions;
+                aws_import.make_prediction by default.
+
+        Returns:
+            np.ndarray: One prediction per row, or None if the model failed.
+        """
+        rows = np.atleast_2d(np.asarray(features, dtype=np.float64))
+        keys = [(object_key, etag, row.tobytes()) for row in self.canonical(rows)]
+        pred = np.empty(len(rows))
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._entries.get(key)
+                if value is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    pred[i] = value
+            self.hits += len(rows) - len(missing)
+            self.misses += len(missing)
+        if not missing:
+            return pred
+
+        computed = (predictor or ai.make_prediction)(model, rows[missing])
+        if computed is None:
+            return None
+        pred[missing] = computed
+        with self._lock:
+            for i in missing:
+                self._entries[keys[i]] = float(pred[i])
+                self._entries.move_to_end(keys[i])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return pred
+
+    def invalidate(self, object_key: str, etag: Optional[str] = None) -> int:
+        """
+        Drop the entries of versions of object_key other than etag.
+
+        Used as a ModelRegistry load listener, so predictions of a replaced
+        artifact are freed as soon as the new one is loaded.
+
+        Returns:
+            int: Number of entries dropped.
+        """
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == object_key and key[1] != etag]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            logger.info("Dropped %d cached predictions of %s", len(stale), object_key)
+        return len(stale)
+
+    def clear(self) -> None:
+        """
+        Drop every entry and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Hit and miss counts, hit rate and number of cached rows.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,185 @@
+"""
+Serve delay predictions over HTTP, micro-batching concurrent requests into one predict call
+"""
+import argparse
+import asyncio
+import logging
+import logging.config
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+from aiohttp import web
+
+import aws_import as ai
+import batch_predict as bp
+import encoder
+
+logger = logging.getLogger("clouds")
+
+# Local model file names written by the pipeline, by model choice
+MODEL_FILES = {"pcr": "pcr_model", "rf": "rf_model", "gbm": "gbm_model"}
+
+
+def load_models(config: Dict, model_dir: Optional[str] = None) -> Dict:
+    """
+    Load all three models once, from S3 or from a local directory of pipeline artifacts.
+
+    Args:
+        config (Dict): The web app config.
+        model_dir (str): Optional directory holding <model>_model_object.joblib or,
+            with aws.model_format set to compact, <model>_model_compact.npz files.
+
+    Returns:
+        Dict: Loaded model by model choice ("pcr", "rf", "gbm").
+    """
+    models = {}
+    compact = config["aws"].get("model_format", "joblib") == "compact"
+    for name, stem in MODEL_FILES.items():
+        model_path = None
+        if model_dir is not None:
+            suffix = "_compact.npz" if compact else "_object.joblib"
+            model_path = str(Path(model_dir) / f"{stem}{suffix}")
+        models[name] = bp.load_model(name, config, model_path)
+        logger.info("Model %s loaded for serving", name)
+    return models
+
+
+class MicroBatcher:
+    """
+    Collect concurrent prediction requests for one model and score them together.
+
+    A batch closes when it reaches max_batch_rows rows or max_wait_ms after its
+    first request arrived, whichever comes first.
+    """
+
+    def __init__(self, model, max_batch_rows: int = 4096, max_wait_ms: float = 2.0):
+        self.model = model
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def predict(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        Queue encoded rows and wait for their predictions.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((matrix, future))
+        return await future
+
+    def _predict(self, matrix: np.ndarray) -> np.ndarray:
+        pred = ai.make_prediction(self.model, matrix)
+        if pred is None:
+            raise ValueError("Prediction failed")
+        return pred
+
+    async def run(self) -> None:
+        """
+        Batch and score queued requests until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            items: List[Tuple[np.ndarray, asyncio.Future]] = [await self.queue.get()]
+            rows = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+            while rows < self.max_batch_rows:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                rows += len(item[0])
+
+            # Any failure goes to the waiting requests; the loop itself must keep running,
+            # and requests whose clients went away are skipped
+            try:
+                pred = await loop.run_in_executor(
+                    None, self._predict, np.vstack([matrix for matrix, _ in items]))
+            except Exception as error:  # pylint: disable=broad-except
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            offsets = np.cumsum([len(matrix) for matrix, _ in items])[:-1]
+            for (_, future), result in zip(items, np.split(pred, offsets)):
+                if not future.done():
+                    future.set_result(result)
+
+
+async def predict_handler(request: web.Request) -> web.Response:
+    """
+    POST /predict/{model}: score one flight (JSON object) or a batch (JSON list).
+    """
+    batchers = request.app["batchers"]
+    name = request.match_info["model"]
+    if name not in batchers:
+        raise web.HTTPNotFound(text=f"Unknown model {name}; choose from {sorted(batchers)}")
+    try:
+        body = await request.json()
+        feature_encoder = request.app["encoder"]
+        if isinstance(body, dict):
+            matrix = feature_encoder.encode(body)
+        else:
+            matrix = feature_encoder.encode_records(body)
+        pred = await batchers[name].predict(matrix)
+    except (ValueError, KeyError, TypeError) as error:
+        raise web.HTTPBadRequest(text=str(error))
+    if isinstance(body, dict):
+        return web.json_response({"prediction": float(pred[0])})
+    return web.json_response({"predictions": pred.tolist()})
+
+
+async def health_handler(request: web.Request) -> web.Response:
+    """
+    GET /health: list the models kept warm.
+    """
+    return web.json_response({"models": sorted(request.app["batchers"])})
+
+
+def create_app(config: Dict, models: Dict) -> web.Application:
+    """
+    Build the prediction service around already loaded models.
+
+    Args:
+        config (Dict): The web app config.
+        models (Dict): Loaded model by model choice.
+
+    Returns:
+        web.Application: The aiohttp application.
+    """
+    serve_config = config.get("serve", {})
+    app = web.Application()
+    app["config"] = config
+    app["encoder"] = encoder.FeatureEncoder(config)
+    app["batchers"] = {name: MicroBatcher(model, serve_config.get("max_batch_rows", 4096),
+                                          serve_config.get("max_wait_ms", 2.0))
+                       for name, model in models.items()}
+
+    async def start_batchers(app):
+        app["tasks"] = [asyncio.create_task(batcher.run()) for batcher in app["batchers"].values()]
+
+    async def stop_batchers(app):
+        for task in app["tasks"]:
+            task.cancel()
+        await asyncio.gather(*app["tasks"], return_exceptions=True)
+
+    app.on_startup.append(start_batchers)
+    app.on_cleanup.append(stop_batchers)
+    app.router.add_post("/predict/{model}", predict_handler)
+    app.router.add_get("/health", health_handler)
+    return app
+
+
+if __name__ == "__main__":
+    logging.config.fileConfig("config/logging/local.conf")
+    parser = argparse.ArgumentParser(description="Serve flight delay predictions over HTTP")
+    parser.add_argument("--config", default="config/config.yaml", help="Path to configuration file")
+    parser.add_argument("--model-dir", help="Local directory of model artifacts instead of S3")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    serve_config = config.get("serve", {})
+    web.run_app(create_app(config, load_models(config, args.model_dir)),
+                host=serve_config.get("host", "0.0.0.0"), port=serve_config.get("port", 8080))
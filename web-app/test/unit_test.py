@@ -1,12 +1,22 @@
+import asyncio
+import importlib
 import logging
 import io
 import os
 import sys
+import warnings
 import boto3
 import joblib
+from aiohttp.test_utils import TestClient, TestServer
+import numpy as np
 import pandas as pd
+import yaml
 from botocore.stub import Stubber
-from sklearn.linear_model import LogisticRegression
+from sklearn.decomposition import PCA
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 import pytest
 
 # Add the src directory to the Python path
@@ -14,6 +24,12 @@ src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
 sys.path.insert(0, src_path)
 
 import aws_import as ai
+import batch_predict as bp
+import encoder
+import serve
+import compact_model as cm
+import model_registry as mr
+import prediction_cache as pc
 
 logger = logging.getLogger("clouds")
 
@@ -60,14 +76,372 @@ class TestModelFunctions:
             loaded_model = ai.load_model_from_s3('test-bucket', 'test-model.pkl')
             assert loaded_model is None
 
+    def test_load_compact_model_from_s3(self, input_data, tmp_path, monkeypatch):
+        moto = pytest.importorskip("moto")
+        monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+        monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+        model = RandomForestRegressor(n_estimators=5, random_state=0)
+        model.fit(input_data, [1.0, 2.0])
+        cm.save_compact_model(model, tmp_path / "rf_model_compact.npz")
+
+        with moto.mock_aws():
+            s3 = boto3.client('s3', region_name='us-east-2')
+            s3.create_bucket(Bucket='test-bucket',
+                             CreateBucketConfiguration={'LocationConstraint': 'us-east-2'})
+            s3.upload_file(str(tmp_path / "rf_model_compact.npz"), 'test-bucket',
+                           'model-artifacts/rf_model_compact.npz')
+            loaded_model = ai.load_compact_model_from_s3('test-bucket',
+                                                         'model-artifacts/rf_model_compact.npz',
+                                                         str(tmp_path / "models"))
+        assert loaded_model is not None
+        assert (loaded_model.predict(input_data) == model.predict(input_data)).all()
+
     def test_make_prediction_success(self, mock_model, input_data):
         predictions = ai.make_prediction(mock_model, input_data)
         assert predictions is not None
         assert len(predictions) == len(input_data)
 
+    def test_make_prediction_compiles_trees_once(self, input_data):
+        model = RandomForestRegressor(n_estimators=5, random_state=0).fit(input_data, [1.0, 2.0])
+        rows = pd.DataFrame(np.random.default_rng(0).random((50, 2)) * 4,
+                            columns=input_data.columns)
+        predictions = ai.make_prediction(model, rows)
+        np.testing.assert_array_equal(predictions, model.predict(rows))
+        assert isinstance(ai.compiled_model(model), cm.CompactModel)
+        assert ai.compiled_model(model) is ai.compiled_model(model)
+
+    def test_make_prediction_fuses_pcr(self, input_data):
+        rows = pd.DataFrame(np.random.default_rng(0).random((50, 2)) * 4,
+                            columns=input_data.columns)
+        model = make_pipeline(StandardScaler(), PCA(n_components=1), LinearRegression())
+        model.fit(rows, rows['feature1'] * 2 - rows['feature2'])
+        np.testing.assert_allclose(ai.make_prediction(model, rows), model.predict(rows),
+                                   rtol=1e-10)
+        assert ai.compiled_model(model).kind == "linear"
+
+    def test_make_prediction_silences_feature_names(self, input_data):
+        model = LinearRegression().fit(input_data, [1.0, 2.0])
+        with warnings.catch_warnings(record=True) as caught:
+            # pytest resets the filters installed while collecting, so import again
+            importlib.reload(ai)
+            np.testing.assert_allclose(ai.make_prediction(model, input_data.to_numpy()),
+                                       [1.0, 2.0])
+            # The filter only covers warnings raised by scikit-learn
+            warnings.warn("X does not have valid feature names")
+        assert [str(warning.message) for warning in caught] == \
+            ["X does not have valid feature names"]
+
     def test_make_prediction_failure(self, mock_model):
         predictions = ai.make_prediction(mock_model, pd.DataFrame([]))
         assert predictions is None
 
+
+@pytest.fixture
+def config():
+    config_path = os.path.join(os.path.dirname(__file__), '../config/config.yaml')
+    with open(config_path, encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+@pytest.fixture
+def flights():
+    return pd.DataFrame({
+        'Date': ['2021-01-01', '2021-07-15', '2021-11-30'],
+        'dept-elevation_ft': [107.0, 13.0, 5431.0], 'arr-elevation_ft': [607.0, 20.0, 13.0],
+        'Route_Popularity': [2526, 300, 1200], 'Distance_Final': [754.0, 200.0, 1600.0],
+        'Wind_Speed_mph': [9.0, 3.0, 14.0], 'Wind_Gust_mph': [14.0, 5.0, 22.0],
+        'Visibility_miles': [3.0, 10.0, 7.0], 'tempF': [46.0, 80.0, 30.0],
+        'precip_in': [0.0, 0.1, 0.0], 'daily_snow_in': [0.0, 0.0, 1.5],
+        'dep_time': [9, 14, 21],
+        'Airline': ['Envoy Air', 'Horizon Air', 'Delta Air Lines Inc.'],
+        'Departure Type': ['Large Airport', 'Small Airport', 'Closed'],
+        'Arrival Type': ['Medium Airport', 'Large Airport', 'Large Airport'],
+    })
+
+
+class TestFeatureEncoder:
+
+    def test_encode_matches_encode_frame(self, config, flights):
+        feature_encoder = encoder.FeatureEncoder(config)
+        records = flights.astype({'dep_time': str}).to_dict(orient='records')
+        vectors = np.vstack([feature_encoder.encode(record) for record in records])
+        np.testing.assert_array_equal(vectors, encoder.encode_frame(flights, config))
+        np.testing.assert_array_equal(feature_encoder.encode_records(records), vectors)
+
+    def test_encode_reuses_buffer(self, config, flights):
+        feature_encoder = encoder.FeatureEncoder(config)
+        records = flights.to_dict(orient='records')
+        out = np.empty(feature_encoder.n_features)
+        feature_encoder.encode(records[0], out=out)
+        assert feature_encoder.encode(records[1], out=out) is out
+        np.testing.assert_array_equal(out, feature_encoder.encode(records[1])[0])
+
+    @pytest.mark.parametrize('field, value, message', [
+        ('tempF', 'warm', 'tempF must be a number'),
+        ('Arrival Type', 'Heliport', 'Unknown Arrival Type'),
+        ('Airline', None, 'Unknown Airline'),
+    ])
+    def test_encode_rejects_bad_inputs(self, config, flights, field, value, message):
+        record = flights.to_dict(orient='records')[0]
+        record[field] = value
+        with pytest.raises(ValueError, match=message):
+            encoder.FeatureEncoder(config).encode(record)
+        del record[field]
+        with pytest.raises(ValueError, match=f"Missing input column {field}"):
+            encoder.FeatureEncoder(config).encode(record)
+
+
+class TestBatchPredict:
+
+    def test_encode_frame(self, config, flights):
+        features = config['column_order']['features']
+        matrix = encoder.encode_frame(flights, config)
+        encoded = pd.DataFrame(matrix, columns=features)
+        assert matrix.shape == (3, len(features))
+        assert encoded[['Quarter', 'Month', 'DayOfWeek']].values.tolist() == \
+            [[1, 1, 5], [3, 7, 4], [4, 11, 2]]
+        assert encoded['Horizon Air'].tolist() == [0, 1, 0]
+        assert encoded['dept-type_ohe_closed'].tolist() == [0, 0, 1]
+        assert encoded['arr-type_ohe_large_airport'].tolist() == [0, 1, 1]
+        assert (matrix[:, 14:].sum(axis=1) == 3).all()
+
+    def test_encode_frame_unknown_category(self, config, flights):
+        flights.loc[0, 'Airline'] = 'Pan Am'
+        with pytest.raises(ValueError, match="Unknown Airline"):
+            encoder.encode_frame(flights, config)
+
+    def test_score_file(self, config, flights, tmp_path):
+        features = config['column_order']['features']
+        model = RandomForestRegressor(n_estimators=3, random_state=0)
+        model.fit(pd.DataFrame(encoder.encode_frame(flights, config), columns=features), [1, 2, 3])
+        flights.to_csv(tmp_path / 'flights.csv', index=False)
+        config['batch_predict']['block_size'] = 2
+
+        n_rows = bp.score_file(str(tmp_path / 'flights.csv'), str(tmp_path / 'out.parquet'),
+                               model, config)
+        scored = pd.read_parquet(tmp_path / 'out.parquet')
+        assert n_rows == 3
+        assert scored['Airline'].tolist() == flights['Airline'].tolist()
+        np.testing.assert_allclose(
+            scored['predicted_delay_minutes'],
+            model.predict(pd.DataFrame(encoder.encode_frame(flights, config), columns=features)),
+            rtol=1e-6)
+
+    def test_score_file_types_drift_between_blocks(self, config, flights, tmp_path):
+        model = LinearRegression().fit(encoder.encode_frame(flights, config), [1, 2, 3])
+        # Whole numbers in the first block, decimals in the second
+        drifting = pd.concat([flights] * 2, ignore_index=True)
+        drifting['dept-elevation_ft'] = pd.Series([107, 13, 5431, 107.5, 13.25, 5431],
+                                                  dtype=object)
+        # A column the encoder does not read: integers, then a missing value
+        drifting['Gate'] = pd.Series([1, 2, 3, 4, None, 6], dtype=object)
+        drifting.to_csv(tmp_path / 'flights.csv', index=False)
+        config['batch_predict']['block_size'] = 3
+
+        assert bp.score_file(str(tmp_path / 'flights.csv'), str(tmp_path / 'out.parquet'),
+                             model, config) == 6
+        scored = pd.read_parquet(tmp_path / 'out.parquet')
+        assert scored['dept-elevation_ft'].tolist() == drifting['dept-elevation_ft'].tolist()
+        assert scored['Gate'].iloc[:4].tolist() == [1, 2, 3, 4]
+
+    def test_score_file_rejects_empty_input(self, config, flights, tmp_path):
+        flights.iloc[:0].to_csv(tmp_path / 'flights.csv', index=False)
+        with pytest.raises(ValueError, match="No flights"):
+            bp.score_file(str(tmp_path / 'flights.csv'), str(tmp_path / 'out.parquet'),
+                          LinearRegression(), config)
+        assert not (tmp_path / 'out.parquet').exists()
+
+class TestServe:
+
+    class CountingModel:
+        def __init__(self, model):
+            self.model = model
+            self.calls = 0
+
+        def predict(self, x_data):
+            self.calls += 1
+            return self.model.predict(x_data)
+
+    def test_micro_batched_predictions(self, config, flights):
+        features = config['column_order']['features']
+        x_data = pd.DataFrame(encoder.encode_frame(flights, config), columns=features)
+        model = self.CountingModel(RandomForestRegressor(n_estimators=3, random_state=0)
+                                   .fit(x_data, [1, 2, 3]))
+        config['serve'] = {'max_wait_ms': 50}
+        records = flights.to_dict(orient='records')
+
+        async def run():
+            app = serve.create_app(config, {'rf': model})
+            async with TestClient(TestServer(app)) as client:
+                responses = await asyncio.gather(
+                    *[client.post('/predict/rf', json=record) for record in records],
+                    client.post('/predict/rf', json=records))
+                bodies = [await response.json() for response in responses]
+                missing = await client.post('/predict/xgb', json=records[0])
+                return bodies, missing.status
+
+        bodies, missing_status = asyncio.run(run())
+        expected = model.model.predict(x_data)
+        assert [body['prediction'] for body in bodies[:3]] == pytest.approx(expected)
+        assert bodies[3]['predictions'] == pytest.approx(expected)
+        assert model.calls < 4
+        assert missing_status == 404
+
+    def test_batcher_survives_failed_and_cancelled_requests(self):
+        class FlakyModel:
+            def __init__(self):
+                self.calls = 0
+
+            def predict(self, x_data):
+                self.calls += 1
+                if self.calls == 1:
+                    raise TypeError("bad batch")
+                return x_data.sum(axis=1)
+
+        async def run():
+            batcher = serve.MicroBatcher(FlakyModel(), max_wait_ms=20)
+            task = asyncio.create_task(batcher.run())
+            failing = asyncio.create_task(batcher.predict(np.ones((1, 2))))
+            abandoned = asyncio.create_task(batcher.predict(np.ones((1, 2))))
+            await asyncio.sleep(0.005)
+            abandoned.cancel()
+            with pytest.raises(TypeError):
+                await asyncio.wait_for(failing, 1)
+            pred = await asyncio.wait_for(batcher.predict(np.array([[1.0, 2.0]])), 1)
+            task.cancel()
+            return pred
+
+        assert asyncio.run(run()).tolist() == [3.0]
+
+class TestModelRegistry:
+
+    class FakeStore:
+        def __init__(self):
+            self.etags = {}
+            self.loads = []
+
+        def load(self, bucket_name, object_key, model_dir):
+            self.loads.append(object_key)
+            return f"{object_key}@{self.etags[object_key]}", self.etags[object_key]
+
+        def etag(self, bucket_name, object_key):
+            return self.etags[object_key]
+
+    @pytest.fixture
+    def store(self):
+        store = self.FakeStore()
+        store.etags = {'a': '1', 'b': '1', 'c': '1'}
+        return store
+
+    def test_get_loads_once_and_evicts_least_recent(self, store):
+        registry = mr.ModelRegistry('bucket', max_models=2, loader=store.load,
+                                    etag_reader=store.etag)
+        assert registry.get('a') == 'a@1'
+        registry.get('b')
+        registry.get('a')
+        registry.get('c')
+        assert store.loads == ['a', 'b', 'c']
+        assert registry.etag('b') is None
+        assert registry.etag('a') == '1'
+
+    def test_refresh_reloads_only_changed_models(self, store):
+        registry = mr.ModelRegistry('bucket', refresh_seconds=0, loader=store.load,
+                                    etag_reader=store.etag)
+        registry.get('a')
+        registry._refresh('a')
+        assert store.loads == ['a']
+        store.etags['a'] = '2'
+        registry._refresh('a')
+        assert registry.get('a') == 'a@2'
+
+    def test_prefetch_and_failed_load(self, store):
+        registry = mr.ModelRegistry('bucket', loader=store.load, etag_reader=store.etag)
+        registry.prefetch(['a', 'b']).join()
+        assert store.loads == ['a', 'b']
+        registry._loader = lambda *args: (None, None)
+        with pytest.raises(ValueError):
+            registry.get('missing')
+
+    def test_load_listener_sees_every_version(self, store):
+        registry = mr.ModelRegistry('bucket', refresh_seconds=0, loader=store.load,
+                                    etag_reader=store.etag)
+        loaded = []
+        registry.on_load(lambda object_key, etag: loaded.append((object_key, etag)))
+        assert registry.get_with_etag('a') == ('a@1', '1')
+        store.etags['a'] = '2'
+        registry._refresh('a')
+        assert loaded == [('a', '1'), ('a', '2')]
+
+    def test_named_listener_is_replaced(self, store):
+        registry = mr.ModelRegistry('bucket', refresh_seconds=0, loader=store.load,
+                                    etag_reader=store.etag)
+        old, new = [], []
+        registry.on_load(lambda *args: old.append(args), name='cache')
+        registry.on_load(lambda *args: new.append(args), name='cache')
+        registry.get('a')
+        assert old == [] and new == [('a', '1')]
+        registry.off_load('cache')
+        store.etags['a'] = '2'
+        registry._refresh('a')
+        assert new == [('a', '1')]
+
+class TestPredictionCache:
+
+    class CountingModel:
+        def __init__(self):
+            self.rows = 0
+
+        def predict(self, x_data):
+            self.rows += len(x_data)
+            return x_data.sum(axis=1)
+
+    def test_repeated_rows_skip_the_model(self):
+        cache = pc.PredictionCache(max_entries=2)
+        model = self.CountingModel()
+        np.testing.assert_array_equal(cache.predict(model, 'rf', '1', [[1.0, 2.0]]), [3.0])
+        # Equal after canonicalization: a rounding difference and a negative zero
+        np.testing.assert_array_equal(
+            cache.predict(model, 'rf', '1', np.array([[1.0 + 1e-12, 2.0], [-0.0, 5.0]])),
+            [3.0, 5.0])
+        assert model.rows == 2
+        assert cache.stats() == {'hits': 1, 'misses': 2, 'entries': 2, 'hit_rate': 1 / 3}
+        # The least recently used row is evicted; another version is a miss
+        cache.predict(model, 'rf', '1', [[7.0, 0.0]])
+        cache.predict(model, 'rf', '2', [[0.0, 5.0]])
+        assert model.rows == 4
+        cache.predict(model, 'rf', '1', [[1.0, 2.0]])
+        assert model.rows == 5
+
+    def test_predicts_rows_as_given(self):
+        cache = pc.PredictionCache(decimals=2)
+        model = self.CountingModel()
+        np.testing.assert_array_equal(cache.predict(model, 'rf', '1', [[1.004, 2.0]]), [3.004])
+        # A row equal after rounding shares the entry of the first one
+        np.testing.assert_array_equal(cache.predict(model, 'rf', '1', [[1.0, 2.0]]), [3.004])
+        assert model.rows == 1
+
+    def test_registry_reload_invalidates_entries(self):
+        store = TestModelRegistry.FakeStore()
+        store.etags = {'a': '1'}
+        registry = mr.ModelRegistry('bucket', refresh_seconds=0, loader=store.load,
+                                    etag_reader=store.etag)
+        cache = pc.PredictionCache()
+        registry.on_load(cache.invalidate)
+        calls = []
+
+        def predictor(model, rows):
+            calls.append(model)
+            return np.zeros(len(rows))
+
+        for _ in range(2):
+            model, etag = registry.get_with_etag('a')
+            cache.predict(model, 'a', etag, [[1.0]], predictor)
+        assert calls == ['a@1'] and cache.stats()['entries'] == 1
+        store.etags['a'] = '2'
+        registry._refresh('a')
+        assert cache.stats()['entries'] == 0
+        model, etag = registry.get_with_etag('a')
+        cache.predict(model, 'a', etag, [[1.0]], predictor)
+        assert calls == ['a@1', 'a@2']
+
 if __name__ == '__main__':
     pytest.main()